@@ -1,29 +1,45 @@
+import ast
 import collections
 import concurrent.futures
 import itertools
+import re
 from pathlib import Path
 from string import Formatter
 
 import numpy as np
-import pandas as pd
 
 import _matcha
 
+from .Matcher import DualIndexMatcher
+
 class FastqReader:
     """
     Fastq reading, barcode matching, and optional export of barcoded fastqs
 
+    Args:
+        threads (int): Number of python threads used to read, match, and write sequences in parallel (optional)
+        prefetch (int): Number of chunks to read ahead on a background thread for each input fastq. 
+            With prefetch enabled, the next chunk is read and decompressed while the current chunk is being processed.
+
     Attributes:
         matches (Dict[str, matcha.MatchResult]): After calling read_chunk, holds the quality of matches for each barcode_name.
+        passed_filters (numpy.ndarray): After calling read_chunk, boolean array of whether each read passes the filters
+            from add_filter (None if no filters were added)
 
     """
-    MatcherConfig = collections.namedtuple("MatcherConfig", ["sequence_name", "barcode_name", "matcher", "match_start"])
+    MatcherConfig = collections.namedtuple("MatcherConfig", 
+        ["sequence_name", "barcode_name", "matcher", "match_start", "threads", "count", "i5_sequence_name", "i5_match_start"],
+        defaults=[None, 0])
     
 
-    def __init__(self, threads=None):
+    def __init__(self, threads=None, prefetch=0):
         self._started_reading = False
+        self._prefetch = prefetch
         self._inputs = {} # sequence_name -> input path
         self._outputs = {} # sequence_name -> output path
+        self._input_threads = {} # sequence_name -> decompression thread count
+        self._output_options = {} # sequence_name -> (compression thread count, compression level)
+        self._demux = {} # sequence_name -> (barcode_name, path prefix, path suffix, max open files, create empty files) for demultiplexed outputs
         self._barcodes = [] # list of barcode configs
         self._fastq_files = {} # sequence_name -> c++ FastqFile object
         
@@ -34,8 +50,19 @@ class FastqReader:
         self._barcode_name_to_index = {} # Dict from barcode_name to field_index
         self.set_output_names("{read_name}")
 
+        self._filters = [] # List of (barcode_name, field, op, value)
+        self._read_filter = None # c++ ReadFilter object
+        self._joint_count_names = [] # List of (barcode_name_a, barcode_name_b) pairs to count jointly
+        self._counters = {} # barcode_name -> c++ MatchCounter object
+        self._joint_counters = {} # (barcode_name_a, barcode_name_b) -> c++ JointCounter object
+        self._umi_count_configs = {} # (cell_barcode_name, feature_barcode_name) -> (umi_sequence_name, umi_start, umi_length)
+        self._umi_counters = {} # (cell_barcode_name, feature_barcode_name) -> c++ UmiCounter object
+
         # Dictionary of barcode_name -> match results for most recent chunk
         self.matches = {}
+        self._raw_matches = {} # barcode_name -> raw (2, n) uint64 match results for most recent chunk
+        self.passed_filters = None
+        self._chunk_size = 0 # Number of records in most recent chunk
 
         if threads:
             self._executor = concurrent.futures.ThreadPoolExecutor(threads)
@@ -44,14 +71,29 @@ class FastqReader:
             self._map = lambda *args: list(map(*args))
         
     
-    def add_sequence(self, sequence_name, input_path, output_path=""):
+    def add_sequence(self, sequence_name, input_path, output_path="", input_threads=1, output_threads=1, compression_level=6, max_open_files=256, create_empty_files=False):
         """
         Add fastq input and/or output files for barcode matching 
 
         Args:
             sequence_name (str): Name of sequence (typically R1, R2, I1, or I2)
             input_path (str): Path of fastq file for sequence
-            output_path (str): Path of output fastq containing matching reads (optional)
+            output_path (str): Path of output fastq containing matching reads (optional). To demultiplex reads into
+                one file per barcode label, give a template containing a barcode name, such as ``out/{sample}_R1.fastq.gz``.
+                Each read is then written to the file for the label of its best match, and unmatched reads
+                are written to the file for the label ``unmatched``.
+            input_threads (int): Number of background threads for reading and decompressing the input.
+                BGZF-compressed inputs (e.g. from bgzip) are decompressed in parallel on all threads,
+                while other inputs use a single read-ahead thread. Set to 0 to read and decompress 
+                inline during read_chunk.
+            output_threads (int): Number of threads for compressing gzipped output. Set to 0 to compress inline during write_chunk.
+            compression_level (int): gzip compression level (0-9) for output.
+            max_open_files (int): When demultiplexing, the maximum number of output files to hold open at once.
+                Records are buffered per label and files are reopened as needed, so any number of labels can be written.
+            create_empty_files (bool): When demultiplexing, also create empty files for labels that receive no reads.
+                By default, files are only created for labels with at least one read.
+
+        Output paths ending in .gz are written in BGZF format (as from bgzip), which is readable by any gzip reader.
         """
         if self._started_reading:
             raise Exception("Can't modify FastqReader settings after calling read_chunk")
@@ -61,19 +103,38 @@ class FastqReader:
         if isinstance(output_path, Path):
             output_path = str(output_path)
         
+        demux_fields = [field for _, field, _, _ in Formatter().parse(output_path) if field is not None]
+        if demux_fields:
+            if len(demux_fields) != 1 or not demux_fields[0].isidentifier():
+                raise ValueError("Output path templates must contain exactly one barcode name")
+            prefix, _, _, _ = next(Formatter().parse(output_path))
+            suffix = "".join(literal for literal, _, _, _ in itertools.islice(Formatter().parse(output_path), 1, None))
+            self._demux[sequence_name] = (demux_fields[0], prefix, suffix, max_open_files, create_empty_files)
+        else:
+            self._demux.pop(sequence_name, None)
+        
         self._inputs[sequence_name] = input_path
         self._outputs[sequence_name] = output_path
+        self._input_threads[sequence_name] = input_threads
+        self._output_options[sequence_name] = (output_threads, compression_level)
         
 
-    def add_barcode(self, barcode_name, matcher, sequence_name, match_start=0):
+    def add_barcode(self, barcode_name, matcher, sequence_name, match_start=0, threads=1, count=False):
         """
         Add barcode matcher on a sequence
 
         Args:
             barcode_name (str): Name of barcode (used to access match data from this barcode)
             matcher (Matcher): matcha.Matcher object holding the valid barcodes
-            sequence_name (str): Name of sequence to match on (typically R1, R2, I1, or I2)
-            match_start (int): 0-based index to start matching from in the sequence
+            sequence_name (str): Name of sequence to match on (typically R1, R2, I1, or I2). For a DualIndexMatcher,
+                this can be an (i7, i5) pair of sequence names such as ``("I1", "I2")`` to match indexes from two reads.
+            match_start (int): 0-based index to start matching from in the sequence. For a pair of sequence names,
+                this can be an (i7, i5) pair of start positions
+            threads (int): Number of native threads to split each chunk across while matching. 
+                Useful for slow matchers such as a HashMatcher with a large whitelist.
+            count (bool): Count reads per best match and by best and second-best match distance in native code 
+                during matching, for retrieval with get_counts. Matchers with more than 2^24 match indexes, such as
+                combinatorial matchers with many rounds, can't be counted.
         """
         if self._started_reading:
             raise Exception("Can't modify FastqReader settings after calling read_chunk")
@@ -81,7 +142,14 @@ class FastqReader:
         if barcode_name in self._parsed_attributes or barcode_name == "read_name":
             raise ValueError("Can't add barcode with reserved name read_name, lane, tile, x, or y")
 
-        config = self.MatcherConfig(sequence_name, barcode_name, matcher, match_start)
+        i5_sequence_name, i5_match_start = None, 0
+        if isinstance(sequence_name, (tuple, list)):
+            if not isinstance(matcher, DualIndexMatcher) or len(sequence_name) != 2:
+                raise ValueError("Pairs of sequence names are only supported for a DualIndexMatcher")
+            sequence_name, i5_sequence_name = sequence_name
+            match_start, i5_match_start = match_start if isinstance(match_start, (tuple, list)) else (match_start, match_start)
+
+        config = self.MatcherConfig(sequence_name, barcode_name, matcher, match_start, threads, count, i5_sequence_name, i5_match_start)
         self._barcodes.append(config)
     
     _parsed_attributes = {"lane": 3, "tile": 4, "x": 5, "y": 6} #0-based indices of attributes in bcl2fastq2 name when split by ':'
@@ -91,7 +159,8 @@ class FastqReader:
         Set pattern for read names in the output fastq.
         Available variables for substition are: 
             - read_name: The original read name from the input fastq
-            - Any barcodes that have been added via inputs.add_barcodes: outputs the label for best match barcode
+            - Any barcodes that have been added via inputs.add_barcodes: outputs the label for best match barcode,
+              or nothing for reads with no match
             - lane, tile, x, y: derived from Illumina read name position info
 
         Args:
@@ -110,7 +179,7 @@ class FastqReader:
                 fields.append(field)
                 carryover_string = ""
             else:
-                caryover_string += literal
+                carryover_string += literal
         literals.append(carryover_string)
 
         self._name_literals = literals # List of strings with any literal text to be included in output names
@@ -129,6 +198,100 @@ class FastqReader:
                     self._barcode_name_to_index[f] = new_idx
                 self._name_field_indexes.append(self._barcode_name_to_index[f])
         
+    def add_joint_counts(self, barcode_name_a, barcode_name_b):
+        """
+        Count reads for each pair of best matches between two barcodes (e.g. cell barcode and feature barcode) in
+        native code during matching. Only reads passing the conditions from add_filter are counted. 
+        Retrieve the counts with get_joint_counts.
+
+        Args:
+            barcode_name_a (str): Name of the first barcode as given in add_barcode
+            barcode_name_b (str): Name of the second barcode as given in add_barcode
+        """
+        if self._started_reading:
+            raise Exception("Can't modify FastqReader settings after calling read_chunk")
+        self._joint_count_names.append((barcode_name_a, barcode_name_b))
+
+    def add_umi_counts(self, cell_barcode_name, feature_barcode_name, umi_sequence_name, umi_start, umi_length):
+        """
+        Count unique molecules for each pair of cell and feature barcode matches, by deduplicating UMIs in native
+        code during reading. Only reads passing the conditions from add_filter, with a matched cell and feature and
+        no N's in the UMI are counted. Retrieve the counts with get_umi_counts.
+
+        Args:
+            cell_barcode_name (str): Name of the cell barcode as given in add_barcode
+            feature_barcode_name (str): Name of the feature barcode as given in add_barcode
+            umi_sequence_name (str): Name of the sequence holding the UMI (typically R1)
+            umi_start (int): 0-based index of the first UMI base in the sequence
+            umi_length (int): Number of UMI bases (at most 32)
+        """
+        if self._started_reading:
+            raise Exception("Can't modify FastqReader settings after calling read_chunk")
+        self._umi_count_configs[(cell_barcode_name, feature_barcode_name)] = (umi_sequence_name, umi_start, umi_length)
+
+    _comparison_pattern = re.compile(r"^\s*(\w+)\.(dist|second_best_dist|match|min_qual)\s*(<=|<|>=|>|==|!=)\s*(\d+)\s*$")
+    _membership_pattern = re.compile(r"^\s*(\w+)\.(match|label)\s+(not\s+in|in)\s+(.+?)\s*$")
+
+    def add_filter(self, expression, **values):
+        """
+        Add a condition that reads must pass to be written. Conditions are evaluated in native code right after 
+        matching in read_chunk, and write_chunk writes only reads that pass all of them. 
+
+        Expressions have one of the forms:
+            - ``<barcode_name>.<field> <op> <value>``, where field is dist, second_best_dist, match, or min_qual
+              (the lowest Phred quality score among the bases matched for the barcode), op is one of <, <=, >, >=, ==, 
+              or !=, and value is a non-negative integer. For example ``"cell_i5.dist <= 1"``.
+            - ``<barcode_name>.<field> in <values>`` or ``<barcode_name>.<field> not in <values>``, where field is
+              match or label, and values is a python list literal or the name of a keyword argument holding a 
+              collection of match indexes or labels. For example ``"sample.label in ['A1', 'A2']"`` or 
+              ``add_filter("cell.label in allowed", allowed=cell_labels)``. Unmatched reads are never in the collection.
+              Labels not in the whitelist are an error for ``in`` and ignored for ``not in``.
+
+        Args:
+            expression (str): Condition on barcode match results
+            values: Collections of match indexes or labels referenced by name in membership expressions
+        """
+        if self._started_reading:
+            raise Exception("Can't modify FastqReader settings after calling read_chunk")
+        match = self._comparison_pattern.match(expression)
+        if match is not None:
+            barcode_name, field, op, value = match.groups()
+            self._filters.append((barcode_name, field, op, int(value)))
+            return
+        match = self._membership_pattern.match(expression)
+        if match is None:
+            raise ValueError(f"Invalid filter expression: {expression}")
+        barcode_name, field, op, collection = match.groups()
+        if collection in values:
+            collection = values[collection]
+        else:
+            try:
+                collection = ast.literal_eval(collection)
+            except (ValueError, SyntaxError):
+                raise ValueError(f"Invalid filter expression: {expression}")
+        if isinstance(collection, (str, bytes)):
+            raise ValueError(f"Filter values must be a collection, not a single string: {expression}")
+        self._filters.append((barcode_name, field, " ".join(op.split()), list(collection)))
+
+    def _make_read_filter(self):
+        """Compile the conditions from add_filter into a c++ ReadFilter, with barcodes numbered in the order they were added"""
+        barcode_indexes = {b.barcode_name: i for i, b in enumerate(self._barcodes)}
+        read_filter = _matcha.ReadFilter()
+        for barcode_name, field, op, value in self._filters:
+            if barcode_name not in barcode_indexes:
+                raise ValueError(f"Filter refers to unknown barcode {barcode_name}")
+            barcode = barcode_indexes[barcode_name]
+            if op in ("in", "not in"):
+                if field == "label":
+                    value, missing = self._barcodes[barcode].matcher._matcher.find_labels([str(v) for v in value])
+                    # Missing labels can't match any read, so they only matter when a read must be in the collection
+                    if missing and op == "in":
+                        raise ValueError(f"Filter labels not found for barcode {barcode_name}: {sorted(missing)[:5]}")
+                read_filter.add_membership(barcode, value, op == "not in")
+            else:
+                read_filter.add_condition(barcode, field, op, value)
+        return read_filter
+
     def _validate_config(self):
         """
         Validate that the configuration is consistent: 
@@ -144,13 +307,43 @@ class FastqReader:
         # Matchers rely only on valid sequence names
         for m in self._barcodes:
             assert m.sequence_name in self._inputs
+            assert m.i5_sequence_name is None or m.i5_sequence_name in self._inputs
 
         # Output pattern relies only on valid barcode names
         barcode_names = [b.barcode_name for b in self._barcodes]
         for var in self._barcode_name_to_index:
             assert var in barcode_names or var in self._parsed_attributes or var == "read_name"
 
+        # Demultiplexed outputs route reads by the labels of a barcode field, which need not appear in output names
+        for barcode_name, *_ in self._demux.values():
+            if barcode_name not in barcode_names:
+                raise ValueError(f"Output path template refers to unknown barcode {barcode_name}")
+            if barcode_name not in self._barcode_name_to_index:
+                self._barcode_name_to_index[barcode_name] = max(self._barcode_name_to_index.values(), default=-1) + 1
+
+        for a, b in self._joint_count_names:
+            if a not in barcode_names or b not in barcode_names:
+                raise ValueError(f"Joint counts refer to unknown barcode {a if a not in barcode_names else b}")
+
+        for (cell, feature), (umi_sequence_name, _, _) in self._umi_count_configs.items():
+            if cell not in barcode_names or feature not in barcode_names:
+                raise ValueError(f"UMI counts refer to unknown barcode {cell if cell not in barcode_names else feature}")
+            if umi_sequence_name not in self._inputs:
+                raise ValueError(f"UMI counts refer to unknown sequence {umi_sequence_name}")
+
         self._init_cpp_objects()
+        if self._filters:
+            self._read_filter = self._make_read_filter()
+        for b in self._barcodes:
+            if b.count:
+                self._counters[b.barcode_name] = _matcha.MatchCounter(b.matcher._matcher)
+        for pair in self._joint_count_names:
+            self._joint_counters[pair] = _matcha.JointCounter()
+        matchers = {b.barcode_name: b.matcher for b in self._barcodes}
+        for (cell, feature), (_, umi_start, umi_length) in self._umi_count_configs.items():
+            self._umi_counters[(cell, feature)] = _matcha.UmiCounter(
+                matchers[cell]._matcher, matchers[feature]._matcher, umi_start, umi_length
+            )
 
         self._started_reading = True
 
@@ -160,8 +353,18 @@ class FastqReader:
                 self._inputs[read_name], 
                 self._name_literals, 
                 self._name_field_indexes, 
-                self._outputs[read_name]
+                "" if read_name in self._demux else self._outputs[read_name],
+                self._input_threads[read_name],
+                self._prefetch,
+                *self._output_options[read_name]
             )
+            if read_name in self._demux:
+                barcode_name, prefix, suffix, max_open_files, create_empty_files = self._demux[read_name]
+                matcher = next(b.matcher for b in self._barcodes if b.barcode_name == barcode_name)
+                fastq_file.set_demux_output(
+                    prefix, suffix, self._barcode_name_to_index[barcode_name], matcher._matcher, 
+                    max_open_files, *self._output_options[read_name], create_empty_files
+                )
             self._fastq_files[read_name] = fastq_file
     
     def _read_fastq(self, sequence_name, max_chunk_size):
@@ -171,9 +374,24 @@ class FastqReader:
     def _match_barcode(self, barcode):
         b = barcode
         fastq_file = self._fastq_files[b.sequence_name]
-        match_results = fastq_file.match(b.matcher._matcher, b.match_start, b.match_start + b.matcher.sequence_length)
+        if b.i5_sequence_name is not None:
+            match_results = b.matcher._matcher.match_files(
+                fastq_file, b.match_start, self._fastq_files[b.i5_sequence_name], b.i5_match_start, b.threads
+            )
+        else:
+            match_results = fastq_file.match(b.matcher._matcher, b.match_start, b.match_start + b.matcher.sequence_length, b.threads)
+        self._raw_matches[b.barcode_name] = match_results
+        if b.barcode_name in self._counters:
+            self._counters[b.barcode_name].add(match_results)
         self.matches[b.barcode_name] =  b.matcher.process_matches(match_results)
 
+    @staticmethod
+    def _match_end(barcode):
+        """End of the matched window in the barcode's (first) sequence. For indexes matched from two reads, this is the end of the i7"""
+        if barcode.i5_sequence_name is not None:
+            return barcode.match_start + barcode.matcher.i7_length
+        return barcode.match_start + barcode.matcher.sequence_length
+
     def read_chunk(self, max_chunk_size):
         """
         Read and match barcodes on a chunk of data 
@@ -196,10 +414,26 @@ class FastqReader:
         if any(r != records_read for r in all_records_read):
             raise Exception("Unequal number of records read from input fastq files") 
         
+        self._chunk_size = records_read
         if records_read == 0:
+            if self._read_filter is not None:
+                self.passed_filters = np.zeros(0, dtype=bool)
             return 0
 
         self._map(self._match_barcode, self._barcodes)
+
+        if self._read_filter is not None:
+            self.passed_filters = self._read_filter.evaluate(
+                [self._raw_matches[b.barcode_name] for b in self._barcodes],
+                [self._fastq_files[b.sequence_name] for b in self._barcodes],
+                [b.match_start for b in self._barcodes],
+                [self._match_end(b) for b in self._barcodes]
+            )
+        for (a, b), counter in self._joint_counters.items():
+            counter.add(self._raw_matches[a], self._raw_matches[b], self.passed_filters)
+        for (cell, feature), counter in self._umi_counters.items():
+            umi_file = self._fastq_files[self._umi_count_configs[(cell, feature)][0]]
+            counter.add_chunk(self._raw_matches[cell], self._raw_matches[feature], umi_file, self.passed_filters)
         
         return records_read
 
@@ -225,7 +459,98 @@ class FastqReader:
         else:
             raise Exception("Invalid field name, must be one of label, dist, second_best_dist, or match")
 
-    def get_sequence_read(self, sequence_name, start=None, end=None):
+    def get_counts(self, barcode_name):
+        """
+        Get counts accumulated for a barcode added with count=True, over all chunks read so far.
+
+        Args:
+            barcode_name (str): Name of the barcode as given in add_barcode
+        
+        Returns:
+            dict with keys:
+                - match: array of read counts for each index in the matcher's valid sequences, 
+                  with one extra final element counting unmatched reads
+                - dist: 64x64 array of read counts, indexed by [dist, second_best_dist]
+        """
+        counter = self._counters[barcode_name]
+        return {"match": counter.get_match_counts(), "dist": counter.get_dist_counts()}
+
+    def get_joint_counts(self, barcode_name_a, barcode_name_b):
+        """
+        Get joint counts accumulated for a pair of barcodes added with add_joint_counts, over all chunks read so far.
+
+        Args:
+            barcode_name_a (str): Name of the first barcode
+            barcode_name_b (str): Name of the second barcode
+
+        Returns:
+            Tuple of arrays (match_a, match_b, count) in coordinate format, sorted by match_a then match_b, giving 
+            the number of reads for each pair of best match indexes that occurred. Unmatched reads have index 2^64-1.
+        """
+        return self._joint_counters[(barcode_name_a, barcode_name_b)].get_counts()
+
+    def get_umi_counts(self, cell_barcode_name, feature_barcode_name, collapse=False, format="coo"):
+        """
+        Get molecule counts for a pair of barcodes added with add_umi_counts, over all chunks read so far.
+
+        Args:
+            cell_barcode_name (str): Name of the cell barcode
+            feature_barcode_name (str): Name of the feature barcode
+            collapse (bool): Merge UMIs at hamming distance 1 from a UMI with at least 2*n - 1 reads
+                (where n is the read count of the merged UMI), as in the directional method of UMI-tools
+            format (str): "coo" or "csr"
+
+        Returns:
+            For format="coo", a dict of arrays sorted by cell then feature: cell and feature (match indexes),
+            umis (unique molecule count), and reads (read count).
+            For format="csr", a dict of data (molecule counts), indices (feature match indexes), indptr, and 
+            shape (number of cell barcodes, number of feature barcodes), which can be passed on as 
+            ``scipy.sparse.csr_matrix((data, indices, indptr), shape=shape)``.
+        """
+        cell, feature, umis, reads = self._umi_counters[(cell_barcode_name, feature_barcode_name)].get_counts(collapse)
+        if format == "coo":
+            return {"cell": cell, "feature": feature, "umis": umis, "reads": reads}
+        elif format == "csr":
+            matchers = {b.barcode_name: b.matcher for b in self._barcodes}
+            shape = (matchers[cell_barcode_name]._matcher.size(), matchers[feature_barcode_name]._matcher.size())
+            indptr = np.zeros(shape[0] + 1, dtype=np.uint64)
+            np.cumsum(np.bincount(cell.astype(np.int64), minlength=shape[0]), out=indptr[1:])
+            return {"data": umis, "indices": feature, "indptr": indptr, "shape": shape}
+        else:
+            raise ValueError("format must be coo or csr")
+
+    def _get_field(self, sequence_name, field, start=None, end=None):
+        """
+        Get a field from the most recent chunk as a numpy bytes array
+
+        Args:
+            field (int): 0 = name, 1 = seq, 2 = qual
+
+        For fixed-length fields (e.g. reads from a single sequencing run), the result is a 
+        zero-copy view of the C++ read buffer. Otherwise strings are copied into a padded array.
+        """
+        data, offsets = self._fastq_files[sequence_name].get_buffers(field)
+        lengths = np.diff(offsets)
+        if len(lengths) == 0:
+            return np.array([], dtype="S1")
+        if np.all(lengths == lengths[0]):
+            width = int(lengths[0])
+            start, stop, _ = slice(start, end).indices(width)
+            if stop <= start:
+                return np.zeros(len(lengths), dtype="S1")
+            return np.ndarray(len(lengths), dtype=f"S{stop-start}", buffer=data, offset=start, strides=(width,))
+        
+        width = int(lengths.max())
+        columns = np.arange(width)
+        in_string = columns < lengths[:,None]
+        padded = np.zeros((len(lengths), width), dtype=np.uint8)
+        padded[in_string] = data[(offsets[:-1,None].astype(np.int64) + columns)[in_string]]
+        padded = padded[:, slice(start, end)]
+        if padded.shape[1] == 0:
+            return np.zeros(len(lengths), dtype="S1")
+        return np.ascontiguousarray(padded).view(f"S{padded.shape[1]}").ravel()
+
+    def get_sequence_read(self, sequence_name, start=None, end=None, as_bytes=False):
         """
         Get raw sequence reads from an input fastq.
 
@@ -233,16 +558,16 @@ class FastqReader:
             sequence_name (str): Name of sequence as given in add_sequence (typically R1, R2, I1, or I2)
             start (int): 0-based start index for extracted bases (default to first base)
             end (int): 0-based end index for extracted bases (default to last base)
+            as_bytes (bool): Return a numpy bytes array. When all reads have the same length, this is a zero-copy
+                view of the reads which remains valid after later calls to read_chunk
         
         Returns:
             numpy array of strings containing corresponding sequences for most recent chunk
         """
-        reads = self._fastq_files[sequence_name].inspect_reads()[1]
-        if start is None and end is None:
-            return np.array(reads)
-        return pd.Series(reads).str.slice(start, end).values
+        reads = self._get_field(sequence_name, 1, start, end)
+        return reads if as_bytes else reads.astype(str)
 
-    def get_sequence_qual(self, sequence_name, start=None, end=None):
+    def get_sequence_qual(self, sequence_name, start=None, end=None, as_bytes=False):
         """
         Get sequence quality strings from an input fastq.
 
@@ -250,40 +575,63 @@ class FastqReader:
             sequence_name (str): Name of sequence as given in add_sequence (typically R1, R2, I1, or I2)
             start (int): 0-based start index for extracted bases (default to first base)
             end (int): 0-based end index for extracted bases (default to last base)
+            as_bytes (bool): Return a numpy bytes array. When all reads have the same length, this is a zero-copy
+                view of the qualities which remains valid after later calls to read_chunk
         
         Returns:
             numpy array of strings containing corresponding qualities for most recent chunk
         """
-        quals = self._fastq_files[sequence_name].inspect_reads()[2]
-        if start is None and end is None:
-            return np.array(quals)
-        return pd.Series(quals).str.slice(start, end).values
+        quals = self._get_field(sequence_name, 2, start, end)
+        return quals if as_bytes else quals.astype(str)
 
-    def get_sequence_name(self, sequence_name):
+    def get_sequence_name(self, sequence_name, as_bytes=False):
         """
         Get sequence name strings from an input fastq.
 
         Args:
             sequence_name (str): Name of sequence as given in add_sequence (typically R1, R2, I1, or I2)
+            as_bytes (bool): Return a numpy bytes array instead of str array
         
         Returns:
             numpy array of strings containing corresponding names for most recent chunk
         """
-        return np.array(self._fastq_files[sequence_name].inspect_reads()[0])
+        names = self._get_field(sequence_name, 0)
+        return names if as_bytes else names.astype(str)
+
+    def get_input_stats(self, sequence_name):
+        """
+        Get decompression throughput for an input fastq.
+
+        Args:
+            sequence_name (str): Name of sequence as given in add_sequence (typically R1, R2, I1, or I2)
+
+        Returns:
+            dict with compressed_bytes, uncompressed_bytes, seconds (wall time since opening the file, up to the 
+            end of the file), decompress_seconds (total time spent decompressing summed across threads), 
+            and mb_per_second (uncompressed MB read per second of wall time)
+        """
+        return self._fastq_files[sequence_name].input_stats()
 
     def _write_fastq(self, read_name, filter, match_indexes, matchers):
         if not self._outputs[read_name]:
             return # Don't write output unless requested
         self._fastq_files[read_name].write_chunk(filter, match_indexes, matchers)
         
-    def write_chunk(self, filter):
+    def write_chunk(self, filter=None):
         """
         Write the current chunk of data in fastq format to output sequence files.
+        Only reads passing the conditions from add_filter (if any) are written.
 
         Args:
             filter (array_like[bool]): Boolean array of same length as last chunk_size. 
                 For each element set to True, the corresponding read from the last-read chunk will be output.
+                If omitted, all reads passing the conditions from add_filter are written.
         """
+        if self.passed_filters is not None:
+            filter = self.passed_filters if filter is None else np.logical_and(filter, self.passed_filters)
+        elif filter is None:
+            filter = np.ones(self._chunk_size, dtype=bool)
+
         # If all reads are masked, return instantly
         if not np.any(filter):
             return
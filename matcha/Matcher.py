@@ -1,5 +1,7 @@
 import collections
+import gzip
 import itertools
+import os
 import re
 import subprocess
 
@@ -7,33 +9,111 @@ import numpy as np
 
 import _matcha
 
+from . import estimate_optimal_bins
+
 class Matcher:
     """
     Barcode matcher python wrapper
 
+    Sequences can be given as a list or array of strings, a path to a plain or gzipped whitelist file with one sequence
+    per line and an optional tab-separated label, or a NumPy ``uint64`` array of binary-encoded sequences (as from
+    ``_matcha.stringToBinary``) with shape (n,), or (n, words) for sequences longer than 32 bases. Files and encoded
+    arrays are loaded in native code.
+
+    Sequences and labels are stored once, in the native matcher. Without labels, each sequence is its own label,
+    decoded from its binary encoding when needed. The ``sequences``, ``labels``, and ``binary_sequences`` attributes
+    are NumPy copies made on first access, and match result labels are looked up without making them.
+
     Args:
-        sequences (List[str]): Barcode DNA sequences
-        labels (List[str]): Labels for barcode sequences (optional)
+        sequences (List[str]): Barcode DNA sequences, whitelist file path, or encoded sequences
+        labels (List[str]): Labels for barcode sequences (optional). For whitelist files, defaults to the label column
         _matcher (_matcha.Matcher): C++ matcher object to use
+        sequence_length (int): Length of encoded sequences (only used for encoded sequences)
     """
-    def __init__(self, sequences, _matcher, labels=None):     
-        self.sequences = np.array(sequences)
-        self.binary_sequences = np.array([_matcha.stringToBinary(seq) for seq in self.sequences])
-        if labels is None:
-            labels = self.sequences
-        self.labels = np.array(labels)
-        self.sequence_length = len(self.sequences[0])
+    def __init__(self, sequences, _matcher, labels=None, sequence_length=None):
+        self._matcher = _matcher
+        if isinstance(sequences, (str, os.PathLike)):
+            self._matcher.add_sequences_file(os.fspath(sequences), labels is None)
+        elif isinstance(sequences, np.ndarray) and sequences.dtype == np.uint64:
+            if sequence_length is None:
+                raise ValueError("sequence_length is required for encoded sequences")
+            self._matcher.add_encoded_sequences(sequences, sequence_length)
+        else:
+            self._matcher.add_sequences(self._as_sequence(sequences))
+        if labels is not None:
+            self._matcher.add_labels(self._as_sequence(labels))
+        self.sequence_length = self._matcher.sequence_length()
+
+    @staticmethod
+    def _as_sequence(values):
+        """Pass lists, tuples, and arrays through to native code as they are, and make a list of anything else
+        (such as a pandas Series)"""
+        return values if isinstance(values, (list, tuple, np.ndarray)) else list(values)
 
+    @staticmethod
+    def _whitelist_sequence_length(sequences, sequence_length=None):
+        """Length of the barcodes in a list of sequences, whitelist file, or encoded array, without loading them all"""
+        if isinstance(sequences, (str, os.PathLike)):
+            with open(sequences, "rb") as f:
+                gzipped = f.read(2) == b"\x1f\x8b"
+            with (gzip.open if gzipped else open)(sequences, "rt") as f:
+                for line in f:
+                    sequence = line.rstrip("\r\n").split("\t")[0]
+                    if sequence != "":
+                        return len(sequence)
+            raise ValueError(f"No sequences in whitelist file: {sequences}")
+        if isinstance(sequences, np.ndarray) and sequences.dtype == np.uint64:
+            if sequence_length is None:
+                raise ValueError("sequence_length is required for encoded sequences")
+            return sequence_length
+        return len(sequences[0])
+
+    @classmethod
+    def _from_native(cls, _matcher):
+        """Wrap an already-populated C++ matcher, e.g. one loaded from an index file.
+        Python copies of the sequences and labels are only made if they are accessed."""
+        self = cls.__new__(cls)
         self._matcher = _matcher
-        self._matcher.add_sequences(self.sequences)
-        self._matcher.add_labels(labels)
+        self.sequence_length = _matcher.sequence_length()
+        return self
+
+    def __getattr__(self, name):
+        # Lazily fill in attributes skipped by _from_native
+        if name == "sequences":
+            self.sequences = np.array(self._matcher.get_sequences())
+        elif name == "binary_sequences":
+            self.binary_sequences = self._binary_encode(self.sequences)
+        elif name == "labels":
+            self.labels = self._match_labels(np.arange(self._matcher.size(), dtype=np.uint64))
+        else:
+            raise AttributeError(name)
+        return self.__dict__[name]
+
+    @staticmethod
+    def _binary_encode(sequences):
+        """Array of (seq, flag) binary encodings, with shape (n, 2). Sequences longer than 32 bases are encoded
+        in multiple 64-bit words, giving shape (n, 2, words)"""
+        if len(sequences) > 0 and len(sequences[0]) > 32:
+            return np.array([_matcha.stringToBinaryWords(seq) for seq in sequences], dtype=np.uint64)
+        return np.array([_matcha.stringToBinary(seq) for seq in sequences])
 
-    def match_all(self, sequences, start=0):
-        """Match all sequences in a list
+    def match_all(self, sequences, start=0, threads=1, out=None, stride=None):
+        """Match all sequences in a list or array
         
+        Sequences can be given in any of these forms. All except lists are read in place without copying.
+
+        - List of ``str``
+        - NumPy array of fixed-width strings (``S`` or ``U`` dtype)
+        - ``bytes``, ``bytearray``, or ``memoryview`` of back-to-back fixed-width strings, with width given by ``stride``
+        - pyarrow ``string`` or ``large_string`` Array or ChunkedArray. Null values are treated as empty strings
+
         Args:
-            sequences (List[str]): Query sequences
+            sequences: Query sequences
             start (int): 0-based position of first base to use in barcode match
+            threads (int): Number of threads to split the queries across
+            out (numpy.ndarray): Optional uint64 array of shape (2, len(sequences)) to write raw results into,
+                to avoid allocating a new result array on each call
+            stride (int): Width in bytes of each sequence, when sequences is a bytes-like object
         
         Returns:
             collections.namedtuple: Named tuple. Field seq is binary encoding of best matching sequence.
@@ -42,48 +122,378 @@ class Matcher:
                     list: dist, second_best_dist -- hamming distance to best and second best matches respectively
         """
         end = start + self.sequence_length
-        result = self._matcher.match_all(sequences, start, end)
+        if isinstance(sequences, (bytes, bytearray, memoryview)):
+            if stride is None:
+                raise ValueError("stride is required for bytes-like input")
+            sequences = np.frombuffer(sequences, dtype=f"S{stride}")
+        
+        if isinstance(sequences, np.ndarray) and sequences.dtype.kind in "SU":
+            if sequences.ndim != 1:
+                raise ValueError("Sequence arrays must be 1-dimensional")
+            if sequences.strides[0] < sequences.itemsize:
+                sequences = np.ascontiguousarray(sequences)
+            char_size = 1 if sequences.dtype.kind == "S" else 4
+            result = self._matcher.match_fixed(sequences, char_size, start, end, threads, out)
+        elif hasattr(sequences, "chunks"):
+            # pyarrow.ChunkedArray: match each chunk into a slice of the output
+            if out is None:
+                out = np.empty((2, len(sequences)), dtype=np.uint64)
+            offset = 0
+            for chunk in sequences.chunks:
+                self._match_arrow(chunk, start, end, threads, out[:, offset:offset + len(chunk)])
+                offset += len(chunk)
+            result = out
+        elif hasattr(sequences, "buffers"):
+            result = self._match_arrow(sequences, start, end, threads, out)
+        else:
+            result = self._matcher.match_all(sequences, start, end, threads, out)
         return self.process_matches(result)
 
+    def _match_arrow(self, array, start, end, threads, out):
+        type_name = str(array.type)
+        if type_name not in ("string", "large_string"):
+            raise ValueError(f"Arrow arrays must have string or large_string type, not {type_name}")
+        offset_size = 4 if type_name == "string" else 8
+        validity, offsets, data = array.buffers()
+        if data is None:
+            data = b""
+        return self._matcher.match_arrow(offsets, offset_size, data, validity, array.offset, len(array), start, end, threads, out)
+
+    def _match_labels(self, match):
+        """Array of labels for an array of match indexes, looked up in the native matcher. Unmatched reads get empty labels"""
+        return np.array(self._matcher.get_labels(match), dtype=str)
+
     def process_matches(self, match_result):
         """Process a match result quality based on the type of algorithm used"""
-        best_match, raw_quality = match_result[0], match_result[1]
-        return MatchResult(best_match, raw_quality & 63, np.right_shift(raw_quality, 6), self.labels)
+        return MatchResult._from_raw(match_result[0], match_result[1], self)
    
 class ListMatcher(Matcher):
     """
     List matcher iterates through possible matches in a list. Slow for many valid barcodes,
-    but has no limits on the maximum number of mismatches. As a rule of thumb, this is the best choice if you
-    have under 20 valid sequences, but you should probably not use it to match over 100 sequences
+    but has no limits on the maximum number of mismatches. Queries are compared to barcodes in batches
+    using AVX2 or AVX-512 instructions when available, so this stays usable into the thousands of valid sequences.
+    Barcodes longer than 32 bases are compared one 32-base word at a time instead
+
+    Args:
+        sequences (List[str]): Barcode DNA sequences, whitelist file path, or encoded sequences (see `Matcher`)
+        labels (List[str]): Labels for barcode sequences (optional)
+        sequence_length (int): Length of encoded sequences (only used for encoded sequences)
+        max_mismatches (int): If given, report matches like `HashMatcher`: queries with no barcode within
+            max_mismatches are unmatched, and distances over max_mismatches are reported as 63
+    """
+    def __init__(self, sequences, labels=None, sequence_length=None, max_mismatches=None):   
+        _matcher = _matcha.ListMatcher() if max_mismatches is None else _matcha.ListMatcher(max_mismatches)
+        super().__init__(sequences, _matcher, labels, sequence_length)  
+
+class TableMatcher(Matcher):
+    """
+    Table matcher precomputes the best match for every possible query sequence, so matching is a single
+    table lookup. The table has 4^k entries of 8 bytes for barcodes of length k, so this is best for short barcodes
+    such as 8bp sample indexes or 10-12bp feature barcodes. Queries containing N's fall back to list matching.
+    Like ListMatcher, there is no limit on the maximum number of mismatches.
 
     Args:
-        sequences (List[str]): Barcode DNA sequences
+        sequences (List[str]): Barcode DNA sequences, whitelist file path, or encoded sequences (see `Matcher`)
         labels (List[str]): Labels for barcode sequences (optional)
+        max_table_size (int): Maximum number of table entries. Raises an error if 4^k is larger.
+            Building the table temporarily uses 16 bytes per entry on top of the table itself.
+        threads (int): Number of threads to use while building the table
+        sequence_length (int): Length of encoded sequences (only used for encoded sequences)
     """
-    def __init__(self, sequences, labels=None):   
-        _matcher = _matcha.ListMatcher()
-        super().__init__(sequences, _matcher, labels)  
+    def __init__(self, sequences, labels=None, max_table_size=4**12, threads=1, sequence_length=None):
+        _matcher = _matcha.TableMatcher(max_table_size, threads)
+        super().__init__(sequences, _matcher, labels, sequence_length)
 
 class MatchResult:
     """
     Container type for match results.
 
     Attributes:
-        label (numpy.ndarray): String array of labels for the best match. Only valid if labels were provided while creating the matcher object
+        label (numpy.ndarray): String array of labels for the best match. Labels are the barcode sequences if none were provided while creating the matcher object, and empty for unmatched reads
         dist (numpy.ndarray): Integer array of distances (number of mismatches) to the best match
         second_best_dist (numpy.ndarray): Integer array of distances (number of mismatches) to the second-best match
         match (numpy.ndarray): Integer array of indexes of the best match in the Matcher object's list of valid sequences
     """
     def __init__(self, match, dist, second_best_dist, labels):
         self.match = match
-        self.dist = dist
-        self.second_best_dist = second_best_dist
+        self._dist = dist
+        self._second_best_dist = second_best_dist
         self._labels = labels
+        self._raw_quality = None
+
+    @classmethod
+    def _from_raw(cls, match, raw_quality, labels):
+        """Wrap raw match results, unpacking dist and second_best_dist from the packed quality only when accessed"""
+        self = cls(match, None, None, labels)
+        self._raw_quality = raw_quality
+        return self
+
+    @property
+    def dist(self):
+        if self._dist is None:
+            self._dist = self._raw_quality & 63
+        return self._dist
+
+    @property
+    def second_best_dist(self):
+        if self._second_best_dist is None:
+            self._second_best_dist = np.right_shift(self._raw_quality, 6) & 63
+        return self._second_best_dist
     
     @property
     def label(self):
+        if isinstance(self._labels, Matcher):
+            return self._labels._match_labels(self.match)
         return self._labels[self.match]
 
+class CombinatorialMatcher(Matcher):
+    """
+    Combinatorial matcher for split-pool barcodes, where a cell barcode is built from several rounds
+    of shorter barcodes at fixed offsets in the read. Each round is matched by its own matcher, and all
+    rounds are matched together in a single pass over the reads.
+
+    Each combination of round barcodes gets a single match index, with the first round varying fastest:
+    ``match = m0 + n0 * (m1 + n1 * (m2 + ...))``, where ``m`` is the match index and ``n`` the number of
+    sequences for each round. Reads are unmatched if any round is unmatched. ``dist`` is the total distance over
+    all rounds, and ``second_best_dist`` is the total distance of the next-best combination.
+    Labels are the round labels joined by ``separator``, so read names and demultiplexed outputs can use
+    the full combination.
+
+    Args:
+        rounds (List[Tuple[Matcher, int]]): Matcher for each round, with the 0-based offset of the round within the
+            matched window. Up to 8 rounds are supported, and rounds can't be combinatorial or position search matchers
+        separator (str): Separator between round labels
+    """
+    def __init__(self, rounds, separator="_"):
+        if len(rounds) == 0:
+            raise ValueError("CombinatorialMatcher needs at least one round")
+        self.rounds = [matcher for matcher, _ in rounds]
+        self.offsets = [offset for _, offset in rounds]
+        self.separator = separator
+        self._matcher = _matcha.CombinatorialMatcher(separator)
+        for matcher, offset in rounds:
+            self._matcher.add_round(matcher._matcher, offset)
+        self.sequence_length = self._matcher.sequence_length()
+
+    def __getattr__(self, name):
+        if name == "labels":
+            self.labels = self.decode_labels(np.arange(self._matcher.size(), dtype=np.uint64))
+            return self.labels
+        raise AttributeError(name)
+
+    def decode(self, match):
+        """Split combination match indexes into the match index for each round
+
+        Args:
+            match (numpy.ndarray): Combination match indexes
+        
+        Returns:
+            List[numpy.ndarray]: Match index in each round. Unmatched combinations give 2^64-1 in every round
+        """
+        match = np.asarray(match, dtype=np.uint64)
+        unmatched = match >= self._matcher.size()
+        ret = []
+        for matcher in self.rounds:
+            n = np.uint64(matcher._matcher.size())
+            ret.append(np.where(unmatched, np.iinfo(np.uint64).max, match % n))
+            match = match // n
+        return ret
+
+    def decode_labels(self, match):
+        """Get labels for combination match indexes, joining the round labels with the separator.
+        Unmatched indexes give empty labels"""
+        round_matches = self.decode(match)
+        matched = round_matches[0] != np.iinfo(np.uint64).max
+        labels = np.full(len(matched), "", dtype=object)
+        for r, (matcher, m) in enumerate(zip(self.rounds, round_matches)):
+            round_labels = matcher._match_labels(m[matched]).astype(object)
+            labels[matched] = round_labels if r == 0 else labels[matched] + self.separator + round_labels
+        return labels.astype(str)
+
+    def process_matches(self, match_result):
+        return CombinatorialMatchResult(self, match_result[0], match_result[1])
+
+class CombinatorialMatchResult(MatchResult):
+    """
+    Match results from a `CombinatorialMatcher`, with per-round results in addition to the `MatchResult` attributes
+
+    Attributes:
+        round_matches (List[numpy.ndarray]): Match index for each round
+        round_dists (List[numpy.ndarray]): Distance to the best match for each round
+    """
+    def __init__(self, matcher, match, raw_quality):
+        super().__init__(match, None, None, None)
+        self._raw_quality = raw_quality
+        self._matcher = matcher
+        self._round_matches = None
+        self._round_dists = None
+
+    @property
+    def round_matches(self):
+        if self._round_matches is None:
+            self._round_matches = self._matcher.decode(self.match)
+        return self._round_matches
+
+    @property
+    def round_dists(self):
+        if self._round_dists is None:
+            self._round_dists = [
+                np.right_shift(self._raw_quality, 12 + 6 * r) & 63 for r in range(len(self._matcher.rounds))
+            ]
+        return self._round_dists
+
+    @property
+    def label(self):
+        return self._matcher.decode_labels(self.match)
+
+class DualIndexMatcher(Matcher):
+    """
+    Dual index matcher for unique dual index (UDI) sample sheets. Each (i7, i5) pair is scored by the combined
+    distance of both indexes, and a read only matches a pair if each index is within its own mismatch limit.
+    Distances to each distinct i7 and i5 are computed once per read, then only pairs with a close enough i7 are scored.
+
+    Use with ``FastqReader.add_barcode`` by giving a pair of sequence names, such as ``("I1", "I2")``, to match
+    the i7 and i5 from separate reads. With a single sequence name, the i7 and i5 are matched from one window
+    holding the i7 followed by the i5.
+
+    Results have ``dist`` and ``second_best_dist`` giving the combined distance to the best and second-best pairs,
+    plus per-index distances. Reads with no pair within both limits are unmatched.
+
+    Args:
+        pairs (List[Tuple[str, str]]): (i7, i5) sequence pairs, with i5 sequences as listed in the sample sheet
+        labels (List[str]): Labels for pairs, such as sample names (optional, defaults to ``i7+i5``)
+        max_i7_mismatches (int): Maximum mismatches in the i7
+        max_i5_mismatches (int): Maximum mismatches in the i5
+        i5_orientation (str): How i5 reads relate to the given i5 sequences. ``forward`` to match them as given,
+            ``reverse_complement`` for instruments and chemistries that read the i5 on the opposite strand, 
+            or ``both`` to take whichever orientation is closer for each read
+    """
+    def __init__(self, pairs, labels=None, max_i7_mismatches=1, max_i5_mismatches=1, i5_orientation="forward"):
+        i7_lengths = {len(i7) for i7, _ in pairs}
+        i5_lengths = {len(i5) for _, i5 in pairs}
+        if len(i7_lengths) != 1 or len(i5_lengths) != 1:
+            raise ValueError("All i7 sequences and all i5 sequences must have the same length")
+        self.i7_length = i7_lengths.pop()
+        self.i5_length = i5_lengths.pop()
+        if labels is None:
+            labels = [f"{i7}+{i5}" for i7, i5 in pairs]
+        _matcher = _matcha.DualIndexMatcher(self.i7_length, self.i5_length, max_i7_mismatches, max_i5_mismatches, i5_orientation)
+        super().__init__([i7 + i5 for i7, i5 in pairs], _matcher, labels)
+
+    def process_matches(self, match_result):
+        return DualIndexMatchResult._from_raw(match_result[0], match_result[1], self)
+
+class DualIndexMatchResult(MatchResult):
+    """
+    Match results from a `DualIndexMatcher`, with per-index results in addition to the `MatchResult` attributes.
+    For unmatched reads, the per-index distances are to the closest i7 and i5 sequences.
+
+    Attributes:
+        i7_dist (numpy.ndarray): Distance from the i7 read to the i7 of the best pair
+        i5_dist (numpy.ndarray): Distance from the i5 read to the i5 of the best pair
+        i5_reverse_complement (numpy.ndarray): Boolean array of whether the i5 matched as its reverse complement
+    """
+    @property
+    def i7_dist(self):
+        return np.right_shift(self._raw_quality, 12) & 63
+
+    @property
+    def i5_dist(self):
+        return np.right_shift(self._raw_quality, 18) & 63
+
+    @property
+    def i5_reverse_complement(self):
+        return (np.right_shift(self._raw_quality, 24) & 1).astype(bool)
+
+class PositionSearchMatcher(Matcher):
+    """
+    Position search matcher for barcodes whose start position varies, such as after variable-length spacers
+    or staggered primers. Wraps another matcher, and searches barcode start offsets 0 to ``max_offset`` from
+    the ``match_start`` given to ``FastqReader.add_barcode`` in a single pass over the reads.
+
+    By default the barcode is matched at every offset, and the offset with the closest match is chosen (ties go to
+    the lowest offset). ``second_best_dist`` covers other barcodes at any offset. If an ``anchor`` sequence is given,
+    the anchor is found first, at the offset with fewest mismatches, and the barcode is matched once at
+    ``barcode_offset`` bases from the start of the anchor. Reads where the anchor has more than
+    ``max_anchor_mismatches`` mismatches are unmatched.
+
+    Match results are those of the wrapped matcher, with an extra ``offset`` attribute giving the chosen barcode start
+    relative to ``match_start``. The wrapped matcher can be a ``ListMatcher``, ``HashMatcher``, ``TableMatcher``,
+    ``IndelMatcher`` or ``DualIndexMatcher`` with barcodes of up to 32 bases. ``CombinatorialMatcher`` and
+    ``PositionSearchMatcher`` can't be wrapped.
+
+    Args:
+        matcher (Matcher): Matcher holding the valid barcodes
+        max_offset (int): Largest offset to search (at most 65535). In anchor mode, this is the largest anchor offset
+        anchor (str): Constant sequence to locate first (optional)
+        barcode_offset (int): Start of the barcode relative to the start of the anchor. Negative if the barcode
+            comes before the anchor, in which case offsets where the barcode would start before ``match_start``
+            are unmatched
+        max_anchor_mismatches (int): Maximum mismatches in the anchor
+    """
+    def __init__(self, matcher, max_offset, anchor=None, barcode_offset=0, max_anchor_mismatches=1):
+        self.matcher = matcher
+        self._matcher = _matcha.PositionSearchMatcher(matcher._matcher, max_offset)
+        if anchor is not None:
+            self._matcher.set_anchor(anchor, barcode_offset, max_anchor_mismatches)
+        self.sequence_length = self._matcher.sequence_length()
+
+    def __getattr__(self, name):
+        if name in ("sequences", "binary_sequences", "labels"):
+            return getattr(self.matcher, name)
+        raise AttributeError(name)
+
+    def process_matches(self, match_result):
+        result = self.matcher.process_matches(match_result)
+        result.offset = np.right_shift(match_result[1], 48)
+        return result
+
+class IndelMatcher(Matcher):
+    """
+    Indel matcher scores barcodes by edit distance, allowing insertions and deletions as well as substitutions,
+    for chemistries where synthesis errors shift the barcode. Reads are matched on a window of ``extra_bases``
+    more bases than the barcode, and the distance is the smallest edit distance from the barcode to any prefix
+    of the window, so bases after the barcode are free.
+
+    Candidates are found with a deletion-neighborhood index (as in SymSpell), which holds every string made by
+    deleting up to ``max_edits`` bases from each barcode, and are verified with a bit-parallel edit distance algorithm.
+    The index holds roughly ``k^max_edits / max_edits!`` strings per barcode of length k, so ``max_edits=2`` is
+    best kept to whitelists of up to a few hundred thousand barcodes. Barcodes plus ``extra_bases`` can be at most
+    32 bases.
+
+    Results have ``dist`` and ``second_best_dist`` as edit distances, with ``max_edits + 1`` or more treated as
+    unmatched, plus ``aligned_length`` giving the number of window bases aligned to the best barcode.
+
+    Args:
+        sequences (List[str]): Barcode DNA sequences, whitelist file path, or encoded sequences (see `Matcher`)
+        max_edits (int): Maximum edit distance to match (1 or 2)
+        extra_bases (int): Bases past the end of the barcode to include in the read window
+            (optional, defaults to ``max_edits``)
+        labels (List[str]): Labels for barcode sequences (optional)
+        sequence_length (int): Length of encoded sequences (only used for encoded sequences)
+    """
+    def __init__(self, sequences, max_edits=1, extra_bases=None, labels=None, sequence_length=None):
+        if extra_bases is None:
+            extra_bases = max_edits
+        _matcher = _matcha.IndelMatcher(max_edits, extra_bases)
+        super().__init__(sequences, _matcher, labels, sequence_length)
+        self.sequence_length = self._matcher.query_length()
+
+    def process_matches(self, match_result):
+        return IndelMatchResult._from_raw(match_result[0], match_result[1], self)
+
+class IndelMatchResult(MatchResult):
+    """
+    Match results from an `IndelMatcher`, with the `MatchResult` attributes plus the alignment length.
+
+    Attributes:
+        aligned_length (numpy.ndarray): Number of bases from the start of the read window aligned to the best match,
+            which is the barcode length shifted by any insertions or deletions. 0 for unmatched reads
+    """
+    @property
+    def aligned_length(self):
+        return np.right_shift(self._raw_quality, 12) & 63
+
 class HashMatcher(Matcher):
     """
     Hash matcher uses hash tables of subsequences for barcode search, using the algorithm of Norouzi et al. https://arxiv.org/pdf/1307.2982.pdf. 
@@ -91,18 +501,23 @@ class HashMatcher(Matcher):
     10x-style barcodes (16bp, ~1M valid barcodes), recommended settings are max_mismatches=1, subsequence_count=2
 
     Args:
-        sequences (List[str]): Barcode DNA sequences
+        sequences (List[str]): Barcode DNA sequences, whitelist file path, or encoded sequences (see `Matcher`)
         max_mismatches (int): Maximum mismatches to match against
         subsequence_count (int): Number of subsequence indexes to use. 
             In general, use lower subsequence_count for larger number of valid labels,
             and higher subsequence_count for searching against a larger number of mismatches.
+            Each subsequence can cover at most 32 bases, so barcodes longer than 32 bases need at least
+            ``ceil(length / 32)`` subsequences.
         labels (List[str]): Labels for barcode sequences (optional)
+        threads (int): Number of threads to build the subsequence indexes with
+        sequence_length (int): Length of encoded sequences (only used for encoded sequences)
 
     """
-    def __init__(self, sequences, max_mismatches, subsequence_count, labels=None):   
+    def __init__(self, sequences, max_mismatches, subsequence_count, labels=None, threads=1, sequence_length=None):   
         # Get masks for extracting subsequences
         # Stripe base indexes for each subsequence, in case there are contiguous chunks of similarity in valid barcodes
-        valid_bases = list(range(len(sequences[0])))
+        sequence_length = self._whitelist_sequence_length(sequences, sequence_length)
+        valid_bases = list(range(sequence_length))
         subsequence_indexes = [valid_bases[i::subsequence_count] for i in range(subsequence_count)]
         subsequence_indexes.sort(key = lambda l: len(l))
         subsequence_masks = [self.get_mask(indexes) for indexes in subsequence_indexes]
@@ -116,8 +531,37 @@ class HashMatcher(Matcher):
             mismatch_range = r_prime if i <= a else r_prime - 1
             mismatch_masks.append(self.get_mismatch_masks(subsequence_indexes[i], mismatch_range))
 
-        _matcher = _matcha.HashMatcher(subsequence_masks, mismatch_masks, max_mismatches)
-        super().__init__(sequences, _matcher, labels)  
+        if sequence_length > 32:
+            # Barcodes longer than 32 bases have masks split into 64-bit words of 32 bases each
+            words = (sequence_length + 31) // 32
+            split = lambda mask: [(mask >> (64 * w)) & (2**64 - 1) for w in range(words)]
+            subsequence_masks = [split(m) for m in subsequence_masks]
+            mismatch_masks = [[split(m) for m in masks] for masks in mismatch_masks]
+
+        _matcher = _matcha.HashMatcher(subsequence_masks, mismatch_masks, max_mismatches, threads)
+        super().__init__(sequences, _matcher, labels, sequence_length)  
+
+    def save(self, path):
+        """Save the matcher and its index to a binary file, for fast loading with `HashMatcher.load`
+        
+        Args:
+            path (str): Output path
+        """
+        self._matcher.save(path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a matcher saved with `HashMatcher.save`. The index is memory-mapped from the file rather than
+        rebuilt, so loading is fast and multiple processes loading the same file share its memory.
+        Index files are specific to the version of matcha and machine byte order that created them.
+
+        Args:
+            path (str): Path of saved index file
+        
+        Returns:
+            HashMatcher: Loaded matcher
+        """
+        return cls._from_native(_matcha.HashMatcher.load(path))
 
     @staticmethod
     def get_mask(indexes):
@@ -140,4 +584,67 @@ class HashMatcher(Matcher):
                 for p, v in zip(pos, vals):
                     mask |= v << (p*2)
                 mismatch_masks.append(mask)
-        return mismatch_masks
\ No newline at end of file
+        return mismatch_masks
+
+AutoMatcherResult = collections.namedtuple("AutoMatcherResult", ["matcher", "queries_per_second", "memory_usage", "benchmarks"])
+
+def auto_matcher(sequences, max_mismatches, sample_queries=None, labels=None, threads=1, max_candidates=3, min_seconds=0.1, seed=0,
+                 sequence_length=None):
+    """Choose a matcher for a whitelist by timing candidate configurations on sample queries
+
+    Candidates are `ListMatcher` and `HashMatcher` with each usable ``subsequence_count``. A cost model
+    (in ``matcha.estimate_optimal_bins``) ranks them by estimated lookups and candidate checks per query, then the
+    ``max_candidates`` lowest-cost configurations are built and timed natively on the sample queries, and the fastest
+    is returned. The list candidate applies the same ``max_mismatches`` cutoff as the hash candidates, so all
+    candidates give the same results for every read.
+
+    Args:
+        sequences (List[str]): Barcode DNA sequences, whitelist file path, or encoded sequences (see `Matcher`)
+        max_mismatches (int): Maximum mismatches to match against
+        sample_queries (List[str]): Representative queries, such as barcode windows from the first reads of a run.
+            Defaults to 10,000 whitelist barcodes with up to ``max_mismatches`` random substitutions
+        labels (List[str]): Labels for barcode sequences (optional)
+        threads (int): Number of threads to build indexes and time matching with
+        max_candidates (int): Number of configurations to build and time
+        min_seconds (float): Minimum time to spend matching for each configuration
+        seed (int): Random seed for generating default sample queries
+        sequence_length (int): Length of encoded sequences (only used for encoded sequences)
+
+    Returns:
+        AutoMatcherResult: Named tuple with fields ``matcher`` (the fastest matcher), ``queries_per_second``,
+            ``memory_usage`` (bytes used by its sequences and index), and ``benchmarks``, a list of
+            ``(description, queries_per_second, memory_usage)`` for each timed configuration, fastest first
+    """
+    # The list matcher has no index to build, so it is made first to load the whitelist in any supported form
+    list_matcher = ListMatcher(sequences, labels, sequence_length, max_mismatches)
+    n = list_matcher._matcher.size()
+    k = list_matcher.sequence_length
+    if sample_queries is None:
+        rng = np.random.default_rng(seed)
+        bases = np.array(list("ACGT"))
+        sample_queries = []
+        for i in rng.integers(n, size=10000):
+            query = np.array(list(list_matcher.sequences[i]))
+            positions = rng.choice(k, size=rng.integers(max_mismatches + 1), replace=False)
+            query[positions] = bases[rng.integers(4, size=len(positions))]
+            sample_queries.append("".join(query))
+
+    candidates = [(estimate_optimal_bins.list_cost(n), "list", lambda: list_matcher)]
+    for b in estimate_optimal_bins.bin_range(k, max_mismatches):
+        candidates.append((
+            estimate_optimal_bins.cost(n, k, b, max_mismatches),
+            f"hash(subsequence_count={b})",
+            lambda b=b: HashMatcher(sequences, max_mismatches, b, labels, threads, sequence_length)
+        ))
+    candidates.sort(key=lambda c: c[0])
+
+    best, benchmarks = None, []
+    for _, description, build in candidates[:max_candidates]:
+        matcher = build()
+        qps = matcher._matcher.benchmark(sample_queries, 0, k, threads, min_seconds)
+        memory = matcher._matcher.memory_usage()
+        benchmarks.append((description, qps, memory))
+        if best is None or qps > best.queries_per_second:
+            best = AutoMatcherResult(matcher, qps, memory, None)
+    benchmarks.sort(key=lambda b: -b[1])
+    return best._replace(benchmarks=benchmarks)
@@ -0,0 +1,73 @@
+import _matcha
+
+from .FastqReader import FastqReader
+
+class Pipeline(FastqReader):
+    """
+    Native barcode matching pipeline. Configure inputs, barcodes, and output names as for a FastqReader, add filters,
+    then call run to read, match, filter, and write all reads in native threads without returning to python per chunk.
+
+    Reading, matching, and writing run as separate stages on their own threads, connected by queues, so the
+    stages overlap. Matching for each barcode is split across the threads given in add_barcode.
+
+    Args:
+        prefetch (int): Number of chunks to read ahead on a background thread for each input fastq.
+    """
+    def __init__(self, prefetch=0):
+        super().__init__(prefetch=prefetch)
+
+    def run(self, chunk_size=100000, queue_depth=2):
+        """
+        Process all reads, then close the output files.
+
+        Args:
+            chunk_size (int): Number of reads to process per batch
+            queue_depth (int): Maximum number of batches waiting between stages
+
+        Returns:
+            dict with summary statistics: reads, reads_passed, chunks, seconds, reads_per_second, 
+            stage_seconds (dict of busy seconds for the read, match, and write stages), and barcodes
+            (dict from barcode_name to a dict holding dist_counts, the number of reads at each best-match distance).
+            Counts from add_barcode(count=True), add_joint_counts, and add_umi_counts are available afterwards from 
+            get_counts, get_joint_counts, and get_umi_counts.
+        """
+        self._validate_config()
+        
+        sequence_names = list(self._fastq_files)
+        pipeline = _matcha.Pipeline([self._fastq_files[s] for s in sequence_names], chunk_size, queue_depth)
+        for b in self._barcodes:
+            if b.i5_sequence_name is not None:
+                pipeline.add_dual_barcode(
+                    b.barcode_name,
+                    b.matcher._matcher,
+                    sequence_names.index(b.sequence_name),
+                    b.match_start,
+                    sequence_names.index(b.i5_sequence_name),
+                    b.i5_match_start,
+                    b.threads,
+                    self._barcode_name_to_index.get(b.barcode_name, -1)
+                )
+                continue
+            pipeline.add_barcode(
+                b.barcode_name,
+                b.matcher._matcher,
+                sequence_names.index(b.sequence_name),
+                b.match_start,
+                b.match_start + b.matcher.sequence_length,
+                b.threads,
+                self._barcode_name_to_index.get(b.barcode_name, -1)
+            )
+        pipeline.set_filter(self._make_read_filter())
+        barcode_indexes = {b.barcode_name: i for i, b in enumerate(self._barcodes)}
+        for barcode_name, counter in self._counters.items():
+            pipeline.add_counter(barcode_indexes[barcode_name], counter)
+        for (a, b), counter in self._joint_counters.items():
+            pipeline.add_joint_counter(barcode_indexes[a], barcode_indexes[b], counter)
+        for (cell, feature), counter in self._umi_counters.items():
+            umi_sequence_name = self._umi_count_configs[(cell, feature)][0]
+            pipeline.add_umi_counter(barcode_indexes[cell], barcode_indexes[feature], sequence_names.index(umi_sequence_name), counter)
+
+        try:
+            return pipeline.run()
+        finally:
+            self.close()
@@ -1,2 +1,3 @@
 from .Matcher import *
-from .FastqReader import *
\ No newline at end of file
+from .FastqReader import *
+from .Pipeline import *
@@ -0,0 +1,161 @@
+"""Command line interface. ``matcha run config.yaml`` runs a native Pipeline configured from a YAML file:
+
+.. code-block:: yaml
+
+    chunk_size: 100000          # optional
+    prefetch: 2                 # optional
+    sequences:
+      R1: {input: R1.fastq.gz, output: out/R1.fastq.gz, input_threads: 1, output_threads: 2}
+      R2: {input: R2.fastq.gz, output: "out/{sample}_R2.fastq.gz"}  # one file per sample label
+      I1: {input: I1.fastq.gz}
+    barcodes:
+      sample:
+        sequence: I1
+        matcher: list           # list, hash, table, indel, or dual
+        whitelist: samples.tsv  # one sequence per line, with an optional tab-separated label
+        max_mismatches: 1       # hash matcher only
+        subsequence_count: 2    # hash matcher only
+        max_edits: 1            # indel matcher only
+        match_start: 0
+        threads: 1
+      udi:
+        sequence: [I1, I2]      # i7 and i5 reads
+        matcher: dual
+        whitelist: udi.tsv      # i7, i5, and optional label per line, tab-separated
+        max_i7_mismatches: 1
+        max_i5_mismatches: 1
+        i5_orientation: forward # forward, reverse_complement, or both
+    output_names: "{sample}:{read_name}"
+    filters:
+      - sample.dist <= 1
+      - sample.second_best_dist > 1
+      - sample.min_qual >= 20
+      - "sample.label not in ['undetermined']"
+
+Barcodes can give their valid sequences inline as ``sequences`` (and optional ``labels``) instead of a
+``whitelist`` file (or inline ``pairs`` for dual matchers), or an ``index`` file saved by ``HashMatcher.save``. Filters take any expression accepted by
+``FastqReader.add_filter``.
+"""
+import argparse
+import gzip
+import json
+import sys
+
+from .Matcher import DualIndexMatcher, HashMatcher, IndelMatcher, ListMatcher, TableMatcher
+from .Pipeline import Pipeline
+
+def read_index_pairs(path):
+    """Read (i7, i5) pairs and labels from a text file with tab-separated i7, i5, and optional label on each line"""
+    opener = gzip.open if str(path).endswith(".gz") else open
+    pairs, labels = [], []
+    with opener(path, "rt") as f:
+        for line in f:
+            fields = line.rstrip("\r\n").split("\t")
+            if fields[0] == "":
+                continue
+            if len(fields) < 2:
+                raise ValueError(f"Index pair file lines need tab-separated i7 and i5 sequences: {path}")
+            pairs.append((fields[0], fields[1]))
+            labels.append(fields[2] if len(fields) > 2 else f"{fields[0]}+{fields[1]}")
+    return pairs, labels
+
+def make_matcher(config):
+    """Create a matcher from a barcode config dict"""
+    kind = config.get("matcher", "hash")
+    if "index" in config:
+        if kind != "hash":
+            raise ValueError("Index files are only supported for hash matchers")
+        return HashMatcher.load(config["index"])
+    
+    if kind == "dual":
+        if "whitelist" in config:
+            pairs, labels = read_index_pairs(config["whitelist"])
+        else:
+            pairs = [tuple(p) for p in config["pairs"]]
+            labels = config.get("labels")
+        return DualIndexMatcher(
+            pairs, labels, config.get("max_i7_mismatches", 1), config.get("max_i5_mismatches", 1), 
+            config.get("i5_orientation", "forward")
+        )
+
+    if "whitelist" in config:
+        # Whitelist files are read natively by the matcher, including any label column
+        sequences, labels = config["whitelist"], None
+    else:
+        sequences = config["sequences"]
+        labels = config.get("labels")
+
+    if kind == "list":
+        return ListMatcher(sequences, labels)
+    elif kind == "table":
+        return TableMatcher(sequences, labels, threads=config.get("threads", 1))
+    elif kind == "hash":
+        return HashMatcher(
+            sequences, config.get("max_mismatches", 1), config.get("subsequence_count", 2), labels, 
+            threads=config.get("threads", 1)
+        )
+    elif kind == "indel":
+        return IndelMatcher(sequences, config.get("max_edits", 1), config.get("extra_bases"), labels)
+    raise ValueError(f"Unknown matcher type {kind}, must be list, hash, table, indel, or dual")
+
+def pipeline_from_config(config):
+    """Build a Pipeline from a config dict (as loaded from YAML)"""
+    p = Pipeline(prefetch=config.get("prefetch", 0))
+    for name, seq in config["sequences"].items():
+        p.add_sequence(
+            name, 
+            seq["input"], 
+            seq.get("output", ""), 
+            input_threads=seq.get("input_threads", 1),
+            output_threads=seq.get("output_threads", 1),
+            compression_level=seq.get("compression_level", 6),
+            max_open_files=seq.get("max_open_files", 256),
+            create_empty_files=seq.get("create_empty_files", False)
+        )
+    for name, barcode in config.get("barcodes", {}).items():
+        p.add_barcode(
+            name, 
+            make_matcher(barcode), 
+            barcode["sequence"], 
+            match_start=barcode.get("match_start", 0), 
+            threads=barcode.get("threads", 1)
+        )
+    if "output_names" in config:
+        p.set_output_names(config["output_names"])
+    for expression in config.get("filters", []):
+        p.add_filter(expression)
+    return p
+
+def run(config_path, stats_path=None):
+    try:
+        import yaml
+    except ImportError:
+        raise ImportError("matcha run requires PyYAML (pip install matcha[yaml])")
+    with open(config_path) as f:
+        config = yaml.safe_load(f)
+    
+    pipeline = pipeline_from_config(config)
+    stats = pipeline.run(chunk_size=config.get("chunk_size", 100000), queue_depth=config.get("queue_depth", 2))
+    
+    text = json.dumps(stats, indent=2)
+    if stats_path:
+        with open(stats_path, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="matcha", description="Fast barcode matching for fastq files")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    run_parser = subcommands.add_parser("run", help="Match and filter reads as described in a YAML config file")
+    run_parser.add_argument("config", help="Path of YAML config file")
+    run_parser.add_argument("--stats", help="Write summary statistics as JSON to this path instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        run(args.config, args.stats)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
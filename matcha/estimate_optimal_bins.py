@@ -1,3 +1,7 @@
+# Relative costs per query, in units of one hamming distance check of a HashMatcher candidate
+LOOKUP_COST = 4 # Hash table lookup (usually a cache miss)
+LIST_CHECK_COST = 0.05 # Hamming distance check of one barcode by ListMatcher, which compares barcodes in SIMD batches
+
 def choose(n, k):
     """n choose k"""
     prod = 1
@@ -6,9 +10,9 @@ def choose(n, k):
         prod /= i
     return prod
 
-def cost(n, k, b, r):
+def cost(n, k, b, r, lookup_cost=LOOKUP_COST, check_cost=1):
     """n = # index elements, k = bp length, b = # of bins to use, r = Max # mismatches to tolerate
-    Note: assumes cost of mismatch check = cost of hash table lookup
+    lookup_cost = cost of a hash table lookup, check_cost = cost of checking one candidate barcode
     """
     rprime = r // b
     a = r % b
@@ -19,26 +23,31 @@ def cost(n, k, b, r):
     #
     assert short_b * s + long_b * (s+1) == k
     #
+    # As in HashMatcher, the first a + 1 bins (shortest first) are searched within r' mismatches, and the rest within r' - 1
     bin_len = [s] * short_b + [s+1] * long_b
-    local_r = [r] * (a + 1) + [r-1] * (b - a - 1)
+    local_r = [rprime] * (a + 1) + [rprime-1] * (b - a - 1)
     #
     def cost_per_bin(b, r):
-        """Cost for lookups in bin b, radius r"""
-        return (1 + n/4**b) * sum(3 * choose(b, i) for i in range(r+1))
+        """Cost for lookups in bin of length b, radius r"""
+        lookups = sum(3**i * choose(b, i) for i in range(r+1))
+        return lookups * (lookup_cost + check_cost * n/4**b)
     #
     return sum(cost_per_bin(b, r) for b, r in zip(bin_len, local_r))
 
+def list_cost(n, check_cost=LIST_CHECK_COST):
+    """Cost of checking a query against all n valid barcodes, as ListMatcher does"""
+    return n * check_cost
+
+def bin_range(k, r):
+    """Usable numbers of bins for barcodes of length k. Each bin covers at most 32bp,
+    and more than r+1 bins only shortens the bins that are searched"""
+    min_bins = (k + 31) // 32
+    return range(min_bins, max(min_bins, min(k, r + 1)) + 1)
+
 def optimal_bins(n, k, r):
     """Estimate the optimal number of bins to use for a barcode matching algorithm
     n = # of valid barcodes to match against
     k = bp length of barcode
     r = Maximum number of mismatches to tolerate
     """
-    best_cost = cost(n, k, 1, r)
-    b = 1
-    while True:
-        b += 1
-        if cost(n, k, b, r) < best_cost:
-            best_cost = cost(n, k, b, r)
-        else:
-            return b - 1
\ No newline at end of file
+    return min(bin_range(k, r), key=lambda b: cost(n, k, b, r))
@@ -29,10 +29,25 @@ ext_modules = [
             'src/main.cpp', 
             'src/Matcher.cpp', 
             'src/ListMatcher.cpp',
+            'src/HammingKernels.cpp',
             'src/HashMatcher.cpp',
+            'src/TableMatcher.cpp',
+            'src/CombinatorialMatcher.cpp',
+            'src/DualIndexMatcher.cpp',
+            'src/PositionSearchMatcher.cpp',
+            'src/IndelMatcher.cpp',
+            'src/FlatIndex.cpp',
+            'src/MappedFile.cpp',
             'src/BinaryConverter.cpp', 
             'src/FastqFile.cpp', 
-            'src/gzstream/gzstream.C'
+            'src/RecordFormatter.cpp',
+            'src/ReadFilter.cpp',
+            'src/Pipeline.cpp',
+            'src/GzipReader.cpp',
+            'src/GzipWriter.cpp',
+            'src/DemuxWriter.cpp',
+            'src/MatchCounter.cpp',
+            'src/UmiCounter.cpp',
         ],
         include_dirs=[
             # Path to pybind11 headers
@@ -78,11 +93,11 @@ class BuildExt(build_ext):
     """A custom build extension for adding compiler-specific options."""
     c_opts = {
         'msvc': ['/EHsc'],
-        'unix': [],
+        'unix': ['-pthread'],
     }
     l_opts = {
         'msvc': [],
-        'unix': ["-lz"],
+        'unix': ["-lz", "-pthread"],
     }
 
     if sys.platform == 'darwin':
@@ -117,6 +132,8 @@ setup(
     ext_modules=ext_modules,
     packages=["matcha"],
     install_requires=['pybind11>=2.4', 'numpy', 'pandas'],
+    extras_require={'yaml': ['pyyaml']},
+    entry_points={'console_scripts': ['matcha = matcha.cli:main']},
     setup_requires=['pybind11>=2.4'],
     cmdclass={'build_ext': BuildExt},
     zip_safe=False,
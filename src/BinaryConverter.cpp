@@ -1,5 +1,7 @@
 #include "BinaryConverter.h"
 
+#include <algorithm>
+
 // Adapted from kallisto
 // https://github.com/pachterlab/kallisto/blob/master/src/BUSData.cpp However,
 // flag is a 2-bit encoded binary mask: 00 if base != N, 01 if base == N
@@ -22,7 +24,7 @@ uint64_t stringToBinary(const char *s, const size_t len, uint64_t &flag) {
     for (size_t i = 0; i < k; i++) {
         uint64_t x = ((*s) & 4) >> 1;
         if (((*s) & 3) == 2) {
-            flag |= 1 << (2 * i);
+            flag |= (uint64_t) 1 << (2 * i);
         }
         r |= (x + ((x ^ (*s & 2)) >> 1)) << (2 * i);
         s++;
@@ -54,9 +56,24 @@ string binaryToString(const uint64_t seq, const size_t len, const uint64_t flag)
     string s(k,'N');
 
     for (size_t i = 0; i < k; i++) {
-        if (flag & 1 << (2*i)) continue; // We have an N flagged, so leave as N
+        if (flag & (uint64_t) 1 << (2*i)) continue; // We have an N flagged, so leave as N
         else s[i] = binary_decoder[seq >> (2*i) & 3];
     }
 
     return s;
-}
\ No newline at end of file
+}
+
+void stringToBinaryWords(const char *s, const size_t len, uint64_t *seq, uint64_t *flag) {
+    for (size_t w = 0; w < binary_words(len); w++) {
+        size_t start = 32 * w;
+        seq[w] = stringToBinary(s + start, std::min(len - start, (size_t) 32), flag[w]);
+    }
+}
+
+string binaryWordsToString(const uint64_t *seq, const size_t len, const uint64_t *flag) {
+    string s;
+    for (size_t w = 0; w < binary_words(len); w++) {
+        s += binaryToString(seq[w], std::min(len - 32 * w, (size_t) 32), flag[w]);
+    }
+    return s;
+}
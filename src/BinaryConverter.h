@@ -22,4 +22,13 @@ py::array_t<uint64_t> stringsToBinary(vector<string> strings, const size_t start
 
 string binaryToString(const uint64_t seq, const size_t len, const uint64_t flag);
 
+// Sequences longer than 32 bases are encoded in multiple 64-bit words, with bases [32*w, 32*w + 32) in word w
+// using the single-word layout. Sequences of at most 32 bases use one word
+inline size_t binary_words(size_t len) {return len <= 32 ? 1 : (len + 31) / 32;}
+
+// Encode len bases of s into binary_words(len) words of seq and flag
+void stringToBinaryWords(const char *s, const size_t len, uint64_t *seq, uint64_t *flag);
+
+string binaryWordsToString(const uint64_t *seq, const size_t len, const uint64_t *flag);
+
 #endif // MATCHA_BINARY_CONVERTER_H
\ No newline at end of file
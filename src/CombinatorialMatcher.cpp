@@ -0,0 +1,86 @@
+#include "CombinatorialMatcher.h"
+
+#include <algorithm>
+#include <limits>
+
+using namespace std;
+
+static const uint64_t unmatched = numeric_limits<uint64_t>::max();
+
+CombinatorialMatcher::CombinatorialMatcher(string separator) : separator(separator) {}
+
+void CombinatorialMatcher::add_round(Matcher *matcher, size_t offset) {
+    if (matcher == nullptr) throw invalid_argument("Missing matcher for round");
+    if (!matcher->has_match_block()) throw invalid_argument("Rounds can't use combinatorial or position search matchers");
+    if (rounds.size() == max_rounds) throw invalid_argument("At most " + std::to_string(max_rounds) + " rounds are supported");
+    if (matcher->size() == 0) throw invalid_argument("Round matchers must have at least one sequence");
+    if (matcher->sequence_words() > 1) throw invalid_argument("Round barcodes must be at most 32 bases");
+    if (combinations > numeric_limits<uint64_t>::max() / (matcher->size() + 1)) {
+        throw invalid_argument("Too many barcode combinations to index in 64 bits");
+    }
+    rounds.push_back(Round{matcher, offset, combinations});
+    combinations *= matcher->size();
+    k = std::max(k, offset + matcher->query_length());
+}
+
+size_t CombinatorialMatcher::memory_usage() {
+    size_t ret = Matcher::memory_usage();
+    for (const Round &r : rounds) ret += r.matcher->memory_usage();
+    return ret;
+}
+
+void CombinatorialMatcher::append_label(vector<char> &out, uint64_t index) const {
+    if (index >= combinations) return;
+    for (size_t r = 0; r < rounds.size(); r++) {
+        if (r > 0) out.insert(out.end(), separator.begin(), separator.end());
+        rounds[r].matcher->append_label(out, index / rounds[r].stride % rounds[r].matcher->size());
+    }
+}
+
+void CombinatorialMatcher::_matchAll(const StringColumn &strings, const size_t start, const size_t end, uint64_t *out_match, uint64_t *out_qual, size_t threads) {
+    if (rounds.empty()) throw runtime_error("CombinatorialMatcher has no rounds");
+    size_t n = strings.size();
+    parallel_for(n, threads, [&](size_t begin, size_t finish) {
+        uint64_t seqs[match_block_size], flags[match_block_size];
+        uint64_t matches[match_block_size], quals[match_block_size];
+        for (size_t block = begin; block < finish; block += match_block_size) {
+            size_t count = std::min(match_block_size, finish - block);
+            uint64_t *block_match = out_match + block, *block_qual = out_qual + block;
+            std::fill(block_match, block_match + count, 0);
+            std::fill(block_qual, block_qual + count, 0);
+            // Total distance over rounds, and the smallest extra distance of any round's second-best match,
+            // which gives the second-best combination
+            uint64_t total[match_block_size], second_gap[match_block_size];
+            std::fill(total, total + count, 0);
+            std::fill(second_gap, second_gap + count, (uint64_t) max_dist);
+
+            for (size_t r = 0; r < rounds.size(); r++) {
+                const Round &round = rounds[r];
+                size_t round_start = start + round.offset;
+                size_t round_len = round.matcher->query_length();
+                for (size_t i = 0; i < count; i++) {
+                    flags[i] = 0;
+                    seqs[i] = strings.encode(block + i, round_start, round_len, flags[i]);
+                }
+                round.matcher->match_block(seqs, flags, count, matches, quals);
+                for (size_t i = 0; i < count; i++) {
+                    uint64_t dist = quals[i] & max_dist;
+                    uint64_t second = quals[i] >> dist_bits & max_dist;
+                    if (matches[i] >= round.matcher->size() || block_match[i] == unmatched) {
+                        block_match[i] = unmatched;
+                    } else {
+                        block_match[i] += matches[i] * round.stride;
+                    }
+                    total[i] += dist;
+                    block_qual[i] |= dist << (2 + r) * dist_bits;
+                    second_gap[i] = std::min(second_gap[i], second > dist ? second - dist : 0);
+                }
+            }
+            for (size_t i = 0; i < count; i++) {
+                uint64_t best = std::min(total[i], (uint64_t) max_dist);
+                uint64_t second = std::min(total[i] + second_gap[i], (uint64_t) max_dist);
+                block_qual[i] |= second << dist_bits | best;
+            }
+        }
+    });
+}
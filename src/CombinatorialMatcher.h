@@ -0,0 +1,38 @@
+#ifndef MATCHA_COMBINATORIAL_MATCHER_H
+#define MATCHA_COMBINATORIAL_MATCHER_H
+
+#include "Matcher.h"
+
+// Matcher for split-pool barcodes made of several rounds at fixed offsets in a read, each matched by its own
+// sub-matcher. All rounds are matched in a single pass over each block of reads.
+// The match index packs the round matches into one combination index, with round 0 varying fastest:
+//   index = m_0 + n_0 * (m_1 + n_1 * (m_2 + ...)) where m_r is the match and n_r the size of round r.
+// Reads with any unmatched round are unmatched. The qual holds the total distance over all rounds and the
+// distance of the second-best combination in the usual bits, followed by the distance of each round in turn
+// (6 bits each, starting at bit 12). Labels are the round labels joined by a separator.
+// Sub-matchers are held by pointer, and must outlive this matcher
+class CombinatorialMatcher: public Matcher {
+private:
+    struct Round {
+        Matcher *matcher;
+        size_t offset;
+        uint64_t stride; // Product of the sizes of earlier rounds
+    };
+    vector<Round> rounds;
+    string separator;
+    uint64_t combinations = 1;
+public:
+    static const size_t max_rounds = 8;
+
+    CombinatorialMatcher(string separator = "_");
+    // Add a round matched on bases [offset, offset + query_length) of the window being matched
+    void add_round(Matcher *matcher, size_t offset);
+    size_t round_count() const {return rounds.size();}
+    size_t size() const override {return combinations;}
+    size_t memory_usage() override;
+    void append_label(vector<char> &out, uint64_t index) const override;
+    bool has_match_block() const override {return false;}
+    void _matchAll(const StringColumn &strings, const size_t start, const size_t end, uint64_t *out_match, uint64_t *out_qual, size_t threads) override;
+};
+
+#endif // MATCHA_COMBINATORIAL_MATCHER_H
@@ -0,0 +1,147 @@
+#include "DemuxWriter.h"
+
+#include <stdexcept>
+#include <unordered_map>
+
+#include "GzipWriter.h"
+#include "ThreadPool.h"
+
+using namespace std;
+
+static const size_t plain_block_size = 1 << 16;
+static const size_t max_buffered_bytes = 1 << 26; // Flush partial blocks too once buffers hold this much in total
+
+static bool ends_with(const string &s, const string &suffix) {
+    return s.size() >= suffix.size() && s.compare(s.size() - suffix.size(), suffix.size(), suffix) == 0;
+}
+
+DemuxWriter::DemuxWriter(string prefix, string suffix, const StringArena &labels, size_t max_open_files,
+        size_t threads, int level, bool create_empty) :
+        max_open_files(max_open_files), compress(ends_with(suffix, ".gz")), threads(threads), level(level),
+        create_empty(create_empty) {
+    if (level < -1 || level > 9) throw invalid_argument("Compression level must be between -1 and 9");
+    if (max_open_files == 0) throw invalid_argument("max_open_files must be positive");
+
+    unordered_map<string, uint32_t> label_outputs;
+    for (size_t i = 0; i < labels.size(); i++) {
+        string label = labels.str(i);
+        auto it = label_outputs.find(label);
+        if (it == label_outputs.end()) {
+            it = label_outputs.emplace(label, outputs.size()).first;
+            outputs.emplace_back();
+            outputs.back().path = prefix + label + suffix;
+        }
+        output_of_match.push_back(it->second);
+    }
+    // Unmatched reads share the output of any barcode labeled "unmatched"
+    auto unmatched = label_outputs.find("unmatched");
+    if (unmatched != label_outputs.end()) {
+        unmatched_output = unmatched->second;
+    } else {
+        unmatched_output = outputs.size();
+        outputs.emplace_back();
+        outputs.back().path = prefix + "unmatched" + suffix;
+    }
+}
+
+DemuxWriter::~DemuxWriter() {
+    try {
+        close();
+    } catch (...) {}
+}
+
+FILE *DemuxWriter::open_file(size_t o) {
+    Output &out = outputs[o];
+    if (out.file != nullptr) {
+        open_files.splice(open_files.begin(), open_files, out.lru_pos);
+        return out.file;
+    }
+    if (open_files.size() >= max_open_files) {
+        Output &oldest = outputs[open_files.back()];
+        open_files.pop_back();
+        int ret = fclose(oldest.file);
+        oldest.file = nullptr;
+        if (ret != 0) throw runtime_error("Error writing file: " + oldest.path);
+    }
+    out.file = fopen(out.path.c_str(), out.started ? "ab" : "wb");
+    if (out.file == nullptr) throw runtime_error("Could not open file: " + out.path);
+    out.started = true;
+    open_files.push_front(o);
+    out.lru_pos = open_files.begin();
+    return out.file;
+}
+
+void DemuxWriter::flush_outputs(bool all) {
+    size_t block_size = compress ? bgzf_block_size : plain_block_size;
+    vector<size_t> ready;
+    for (size_t o : active_outputs) {
+        size_t len = outputs[o].buffer.size();
+        if (all ? len > 0 : len >= block_size) ready.push_back(o);
+    }
+    if (ready.empty()) return;
+
+    // Compress whole blocks (or everything, if all is set), keeping any partial block buffered
+    parallel_for(ready.size(), std::max(threads, (size_t) 1), [&](size_t begin, size_t end) {
+        for (size_t r = begin; r < end; r++) {
+            Output &out = outputs[ready[r]];
+            size_t len = all ? out.buffer.size() : out.buffer.size() - out.buffer.size() % block_size;
+            if (!compress) {
+                out.compressed.assign(out.buffer.begin(), out.buffer.begin() + len);
+            } else {
+                for (size_t pos = 0; pos < len; pos += bgzf_block_size) {
+                    compress_bgzf_block(out.buffer.data() + pos, std::min(bgzf_block_size, len - pos), level, out.compressed);
+                }
+            }
+            out.buffer.erase(out.buffer.begin(), out.buffer.begin() + len);
+        }
+    }, compress ? 1 : ready.size());
+
+    for (size_t o : ready) {
+        Output &out = outputs[o];
+        FILE *f = open_file(o);
+        if (fwrite(out.compressed.data(), 1, out.compressed.size(), f) != out.compressed.size()) {
+            throw runtime_error("Error writing file: " + out.path);
+        }
+        out.compressed.clear();
+    }
+
+    // Drop outputs whose buffers are now empty from the active list
+    size_t kept = 0;
+    for (size_t o : active_outputs) {
+        if (outputs[o].buffer.empty()) {
+            outputs[o].active = false;
+        } else {
+            active_outputs[kept++] = o;
+        }
+    }
+    active_outputs.resize(kept);
+}
+
+void DemuxWriter::flush_full() {
+    flush_outputs(false);
+    size_t buffered = 0;
+    for (size_t o : active_outputs) buffered += outputs[o].buffer.size();
+    if (buffered >= max_buffered_bytes) flush_outputs(true);
+}
+
+void DemuxWriter::close() {
+    if (closed) return;
+    closed = true;
+    flush_outputs(true);
+    for (size_t o = 0; o < outputs.size(); o++) {
+        Output &out = outputs[o];
+        if (out.started ? compress : create_empty) {
+            FILE *f = open_file(o);
+            if (compress && fwrite(bgzf_eof, 1, sizeof(bgzf_eof), f) != sizeof(bgzf_eof)) {
+                throw runtime_error("Error writing file: " + out.path);
+            }
+        }
+    }
+    for (size_t o : open_files) {
+        Output &out = outputs[o];
+        int ret = fclose(out.file);
+        out.file = nullptr;
+        if (ret != 0) throw runtime_error("Error writing file: " + out.path);
+    }
+    open_files.clear();
+}
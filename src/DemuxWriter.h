@@ -0,0 +1,76 @@
+#ifndef MATCHA_DEMUX_WRITER_H
+#define MATCHA_DEMUX_WRITER_H
+
+#include <cstdint>
+#include <cstdio>
+#include <list>
+#include <string>
+#include <vector>
+
+#include <zlib.h>
+
+#include "StringArena.h"
+
+using std::string;
+using std::vector;
+
+// Writes records to one output file per barcode label, with paths from a template of the form
+// <prefix><label><suffix>. Matches with the same label share an output, and unmatched reads go to
+// the output for the label "unmatched".
+// Records are collected in a memory buffer per output. Full buffers are compressed in parallel as independent
+// BGZF blocks (for .gz paths), then appended to their files. Files are opened on demand, and at most
+// max_open_files are kept open at once by closing the least recently used one. Only outputs holding buffered
+// records are visited when flushing, so the cost per chunk doesn't grow with the number of labels.
+class DemuxWriter {
+private:
+    struct Output {
+        string path;
+        FILE *file = nullptr;
+        bool started = false; // Set once the file has been created, so later opens append
+        bool active = false; // Set while listed in active_outputs
+        std::list<size_t>::iterator lru_pos; // Position in open_files, if file is open
+        vector<char> buffer; // Uncompressed records waiting to be written
+        vector<char> compressed; // Output ready to append to the file
+    };
+    vector<Output> outputs; // One per distinct label, plus one for unmatched reads
+    vector<uint32_t> output_of_match; // Output index for each match index
+    vector<size_t> active_outputs; // Output indexes that may have buffered records
+    size_t unmatched_output;
+    std::list<size_t> open_files; // Output indexes with open files, most recently used first
+    size_t max_open_files;
+    bool compress;
+    size_t threads;
+    int level;
+    bool create_empty;
+    bool closed = false;
+
+    FILE *open_file(size_t o); // Get an open file for output o, closing another if at the limit
+    void flush_outputs(bool all); // Write out full buffers (or all buffers), compressing in parallel
+public:
+    // labels -- Label of each match index of the barcode matcher
+    // threads -- Number of threads for compressing gzipped output. 0 compresses on the calling thread
+    // create_empty -- Create empty files on close for outputs that received no reads
+    DemuxWriter(string prefix, string suffix, const StringArena &labels, size_t max_open_files = 256,
+        size_t threads = 1, int level = Z_DEFAULT_COMPRESSION, bool create_empty = false);
+    ~DemuxWriter();
+    DemuxWriter(const DemuxWriter &) = delete;
+    DemuxWriter &operator=(const DemuxWriter &) = delete;
+
+    // Buffer to append formatted records to, for a read with the given best match index
+    vector<char> &buffer(uint64_t match) {
+        size_t o = match < output_of_match.size() ? output_of_match[match] : unmatched_output;
+        if (!outputs[o].active) {
+            outputs[o].active = true;
+            active_outputs.push_back(o);
+        }
+        return outputs[o].buffer;
+    }
+    // Call after appending a batch of records to buffers, to write out any that are full
+    void flush_full();
+    size_t output_count() const {return outputs.size();}
+    string output_path(size_t o) const {return outputs[o].path;}
+    // Write all buffered data. Files are only created for outputs that received reads, unless create_empty is set
+    void close();
+};
+
+#endif // MATCHA_DEMUX_WRITER_H
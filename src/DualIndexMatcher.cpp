@@ -0,0 +1,170 @@
+#include "DualIndexMatcher.h"
+
+#include <algorithm>
+#include <limits>
+
+using namespace std;
+
+static const uint64_t unmatched = numeric_limits<uint64_t>::max();
+static const uint64_t rc_flag = (uint64_t) 1 << (4*dist_bits);
+
+static uint64_t low_bases(size_t len) {
+    return len >= 32 ? ~(uint64_t) 0 : ((uint64_t) 1 << (2*len)) - 1;
+}
+
+static uint64_t reverse_complement(uint64_t seq, size_t len) {
+    uint64_t ret = 0;
+    for (size_t j = 0; j < len; j++) {
+        ret |= (3 - (seq >> (2*j) & 3)) << (2*(len - 1 - j));
+    }
+    return ret;
+}
+
+// Index of each distinct value in seqs, in order of first appearance
+static vector<uint32_t> distinct_index(const vector<uint64_t> &seqs, vector<uint64_t> &distinct) {
+    unordered_map<uint64_t, uint32_t> index;
+    vector<uint32_t> ret;
+    for (uint64_t s : seqs) {
+        auto it = index.emplace(s, distinct.size());
+        if (it.second) distinct.push_back(s);
+        ret.push_back(it.first->second);
+    }
+    return ret;
+}
+
+DualIndexMatcher::DualIndexMatcher(size_t i7_length, size_t i5_length, uint64_t max_i7_mismatches, uint64_t max_i5_mismatches,
+        string i5_orientation) : i7_length(i7_length), i5_length(i5_length),
+        max_i7_mismatches(max_i7_mismatches), max_i5_mismatches(max_i5_mismatches) {
+    if (i7_length == 0 || i5_length == 0) throw invalid_argument("Index lengths must be positive");
+    if (i7_length + i5_length > 32) throw invalid_argument("Combined i7 and i5 length must be at most 32");
+    if (i5_orientation == "forward") orientation = FORWARD;
+    else if (i5_orientation == "reverse_complement") orientation = REVERSE_COMPLEMENT;
+    else if (i5_orientation == "both") orientation = BOTH;
+    else throw invalid_argument("i5_orientation must be forward, reverse_complement, or both");
+    k = i7_length + i5_length;
+}
+
+void DualIndexMatcher::add_sequence(uint64_t seq) {
+    if (sequences.size() >= numeric_limits<uint32_t>::max()) throw invalid_argument("Too many index pairs");
+    sequences.push_back(seq);
+}
+
+void DualIndexMatcher::build_index() {
+    vector<uint64_t> i7s, i5s;
+    for (uint64_t seq : sequences) {
+        i7s.push_back(seq & low_bases(i7_length));
+        i5s.push_back(seq >> (2*i7_length) & low_bases(i5_length));
+    }
+    i7_seqs.clear();
+    i5_seqs.clear();
+    vector<uint32_t> i7_of_pair = distinct_index(i7s, i7_seqs);
+    vector<uint32_t> i5_of_pair = distinct_index(i5s, i5_seqs);
+    i5_rc_seqs.clear();
+    for (uint64_t s : i5_seqs) i5_rc_seqs.push_back(reverse_complement(s, i5_length));
+
+    // Counting sort of pairs by i7, keeping pairs in match index order within each i7
+    pair_offsets.assign(i7_seqs.size() + 1, 0);
+    for (uint32_t u : i7_of_pair) pair_offsets[u + 1]++;
+    for (size_t u = 0; u < i7_seqs.size(); u++) pair_offsets[u + 1] += pair_offsets[u];
+    vector<uint32_t> next(pair_offsets.begin(), pair_offsets.end() - 1);
+    pair_i5.resize(sequences.size());
+    pair_index.resize(sequences.size());
+    for (size_t p = 0; p < sequences.size(); p++) {
+        uint32_t j = next[i7_of_pair[p]]++;
+        pair_i5[j] = i5_of_pair[p];
+        pair_index[j] = p;
+    }
+}
+
+size_t DualIndexMatcher::memory_usage() {
+    return Matcher::memory_usage() + (i7_seqs.capacity() + i5_seqs.capacity() + i5_rc_seqs.capacity()) * sizeof(uint64_t) +
+        (pair_offsets.capacity() + pair_i5.capacity() + pair_index.capacity()) * sizeof(uint32_t);
+}
+
+uint64_t DualIndexMatcher::match_pair(uint64_t i7, uint64_t i7_flag, uint64_t i5, uint64_t i5_flag, vector<uint8_t> &dist, uint64_t &qual) const {
+    size_t n7 = i7_seqs.size(), n5 = i5_seqs.size();
+    dist.resize(n7 + 2*n5);
+    uint8_t *d7 = dist.data(), *d5 = d7 + n7, *d5_rc = d5 + n5;
+
+    uint64_t closest_i7 = max_dist;
+    for (size_t u = 0; u < n7; u++) {
+        d7[u] = hammingDistance(i7, i7_flag, i7_seqs[u]);
+        closest_i7 = std::min(closest_i7, (uint64_t) d7[u]);
+    }
+    uint64_t closest_i5 = max_dist;
+    for (size_t v = 0; v < n5; v++) {
+        d5[v] = orientation == REVERSE_COMPLEMENT ? max_dist : hammingDistance(i5, i5_flag, i5_seqs[v]);
+        d5_rc[v] = orientation == FORWARD ? max_dist : hammingDistance(i5, i5_flag, i5_rc_seqs[v]);
+        closest_i5 = std::min(closest_i5, (uint64_t) std::min(d5[v], d5_rc[v]));
+    }
+
+    uint64_t best = unmatched, best_dist = max_dist, second_dist = max_dist, best_i7 = closest_i7, best_i5 = closest_i5;
+    bool best_rc = false;
+    if (closest_i7 <= max_i7_mismatches && closest_i5 <= max_i5_mismatches) {
+        for (size_t u = 0; u < n7; u++) {
+            if (d7[u] > max_i7_mismatches) continue;
+            for (uint32_t j = pair_offsets[u]; j < pair_offsets[u + 1]; j++) {
+                uint32_t v = pair_i5[j];
+                bool rc = d5_rc[v] < d5[v];
+                uint64_t i5_dist = rc ? d5_rc[v] : d5[v];
+                if (i5_dist > max_i5_mismatches) continue;
+                uint64_t total = d7[u] + i5_dist;
+                // Ties keep the lowest match index, as for the other matchers
+                if (best == unmatched || total < best_dist || (total == best_dist && pair_index[j] < best)) {
+                    if (best != unmatched) second_dist = std::min(second_dist, best_dist);
+                    best = pair_index[j];
+                    best_dist = total;
+                    best_i7 = d7[u];
+                    best_i5 = i5_dist;
+                    best_rc = rc;
+                } else {
+                    second_dist = std::min(second_dist, total);
+                }
+            }
+        }
+    }
+    qual = best_dist | second_dist << dist_bits | best_i7 << (2*dist_bits) | best_i5 << (3*dist_bits) | (best_rc ? rc_flag : 0);
+    return best;
+}
+
+uint64_t DualIndexMatcher::match(uint64_t seq, uint64_t flag, uint64_t &qual) {
+    vector<uint8_t> dist;
+    uint64_t i7_mask = low_bases(i7_length), i5_mask = low_bases(i5_length);
+    return match_pair(seq & i7_mask, flag & i7_mask, seq >> (2*i7_length) & i5_mask, flag >> (2*i7_length) & i5_mask, dist, qual);
+}
+
+void DualIndexMatcher::match_block(const uint64_t *seqs, const uint64_t *flags, size_t n, uint64_t *out_match, uint64_t *out_qual) {
+    vector<uint8_t> dist;
+    uint64_t i7_mask = low_bases(i7_length), i5_mask = low_bases(i5_length);
+    for (size_t i = 0; i < n; i++) {
+        out_match[i] = match_pair(seqs[i] & i7_mask, flags[i] & i7_mask,
+            seqs[i] >> (2*i7_length) & i5_mask, flags[i] >> (2*i7_length) & i5_mask, dist, out_qual[i]);
+    }
+}
+
+void DualIndexMatcher::match_columns(const StringColumn &i7_strings, size_t i7_start, const StringColumn &i5_strings, size_t i5_start,
+        uint64_t *out_match, uint64_t *out_qual, size_t threads) {
+    if (i7_strings.size() != i5_strings.size()) throw invalid_argument("i7 and i5 reads must have the same count");
+    parallel_for(i7_strings.size(), threads, [&](size_t begin, size_t end) {
+        vector<uint8_t> dist;
+        for (size_t i = begin; i < end; i++) {
+            uint64_t i7_flag = 0, i5_flag = 0;
+            uint64_t i7 = i7_strings.encode(i, i7_start, i7_length, i7_flag);
+            uint64_t i5 = i5_strings.encode(i, i5_start, i5_length, i5_flag);
+            out_match[i] = match_pair(i7, i7_flag, i5, i5_flag, dist, out_qual[i]);
+        }
+    });
+}
+
+py::array_t<uint64_t> DualIndexMatcher::match_files(FastqFile &i7_file, size_t i7_start, FastqFile &i5_file, size_t i5_start, size_t threads) {
+    StringColumn i7_strings = i7_file.current_chunk().seq.column();
+    StringColumn i5_strings = i5_file.current_chunk().seq.column();
+    py::array_t<uint64_t> result({(size_t) 2, i7_strings.size()});
+    uint64_t *out_match = result.mutable_data();
+    uint64_t *out_qual = out_match + result.strides(0) / sizeof(uint64_t);
+    {
+        py::gil_scoped_release release;
+        match_columns(i7_strings, i7_start, i5_strings, i5_start, out_match, out_qual, threads);
+    }
+    return result;
+}
@@ -0,0 +1,50 @@
+#ifndef MATCHA_DUAL_INDEX_MATCHER_H
+#define MATCHA_DUAL_INDEX_MATCHER_H
+
+#include "FastqFile.h"
+#include "Matcher.h"
+
+// Matcher for unique dual index (UDI) pairs, scoring each (i7, i5) pair in the whitelist by the combined
+// distance of both indexes, with a separate mismatch limit for each index.
+// Sequences are stored as the i7 followed by the i5, so a window holding both indexes back to back can be
+// matched like any other barcode, and match_columns matches indexes held in two separate reads.
+// Distances to each distinct i7 and i5 are computed once per read, then only pairs whose i7 is within
+// its limit are scored.
+// The qual holds the total distance of the best and second-best pairs in the usual bits, then the i7 distance
+// (bits 12-17), the i5 distance (bits 18-23), and bit 24 set if the i5 matched as its reverse complement.
+// Reads with no pair within both limits are unmatched, with i7 and i5 distances to their closest sequences
+class DualIndexMatcher: public Matcher {
+public:
+    enum Orientation {FORWARD, REVERSE_COMPLEMENT, BOTH};
+private:
+    size_t i7_length, i5_length;
+    uint64_t max_i7_mismatches, max_i5_mismatches;
+    Orientation orientation;
+    vector<uint64_t> i7_seqs, i5_seqs; // Distinct sequences of each index, with i5s as they appear in reads
+    vector<uint64_t> i5_rc_seqs; // Reverse complement of each i5 in i5_seqs
+    // Pairs grouped by i7: pairs with i7 u have i5 pair_i5[j] and match index pair_index[j], for j in [pair_offsets[u], pair_offsets[u+1])
+    vector<uint32_t> pair_offsets, pair_i5, pair_index;
+
+    // Match one read's indexes, using dist as scratch space for the i7 and i5 distances
+    uint64_t match_pair(uint64_t i7, uint64_t i7_flag, uint64_t i5, uint64_t i5_flag, vector<uint8_t> &dist, uint64_t &qual) const;
+public:
+    // i5_orientation -- "forward" to match i5 reads to the i5 sequences as given, "reverse_complement" to match
+    //   them to the reverse complement, or "both" to take whichever orientation is closer for each read
+    DualIndexMatcher(size_t i7_length, size_t i5_length, uint64_t max_i7_mismatches, uint64_t max_i5_mismatches,
+        string i5_orientation = "forward");
+    void add_sequence(uint64_t seq) override;
+    void build_index() override;
+    size_t memory_usage() override;
+    uint64_t match(uint64_t seq, uint64_t flag, uint64_t &qual) override; // seq holds the i7 in its low bits, followed by the i5
+    void match_block(const uint64_t *seqs, const uint64_t *flags, size_t n, uint64_t *out_match, uint64_t *out_qual) override;
+
+    // Match i7s from bases [i7_start, i7_start + i7_length) of i7_strings, and i5s from i5_strings starting at i5_start
+    void match_columns(const StringColumn &i7_strings, size_t i7_start, const StringColumn &i5_strings, size_t i5_start,
+        uint64_t *out_match, uint64_t *out_qual, size_t threads);
+    // Match the most recent chunks of two fastq files, returning a (2, n) array of match indexes and quals
+    py::array_t<uint64_t> match_files(FastqFile &i7_file, size_t i7_start, FastqFile &i5_file, size_t i5_start, size_t threads = 1);
+    size_t i7_sequence_length() const {return i7_length;}
+    size_t i5_sequence_length() const {return i5_length;}
+};
+
+#endif // MATCHA_DUAL_INDEX_MATCHER_H
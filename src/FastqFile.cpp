@@ -8,144 +8,280 @@ static bool endsWith(const std::string& str, const std::string& suffix)
     return str.size() >= suffix.size() && 0 == str.compare(str.size()-suffix.size(), suffix.size(), suffix);
 }
 
-FastqFile::FastqFile(string in_path, vector<string> literals, vector<int> fields, string out_path) {
-    in.open(in_path.c_str());
-    if (in.fail()) throw invalid_argument("Could not open file: " + in_path);
+static const size_t input_buffer_size = 1 << 20;
+static const size_t output_buffer_size = 1 << 22;
+static const size_t max_unlabeled_demux_outputs = 10000; // Demultiplexing by decoded sequences beyond this is almost surely a mistake
+
+FastqFile::FastqFile(string in_path, vector<string> literals, vector<int> fields, string out_path, size_t input_threads, size_t prefetch, 
+        size_t output_threads, int compression_level) :
+        prefetch_depth(prefetch) {
+    in.reset(new GzipReader(in_path, input_threads));
+    chunk = std::make_shared<FastqChunk>();
+    in_buf.resize(input_buffer_size);
     if (out_path.size() > 0) {
-        if (endsWith(out_path, ".gz")) {
-            use_out_gz = true;
-            out_gz.open(out_path.c_str());
-            if (out_gz.fail()) throw invalid_argument("Could not open file: " + out_path);
-        } else {
-            use_out_gz = false;
-            out_txt.open(out_path.c_str());
-            if (out_txt.fail()) throw invalid_argument("Could not open file: " + out_path);
-        }
+        writer.reset(new GzipWriter(out_path, endsWith(out_path, ".gz"), output_threads, compression_level));
+    }
+
+    formatter = RecordFormatter(literals, fields);
+}
+
+void FastqFile::set_demux_output(string prefix, string suffix, int field, Matcher &matcher, size_t max_open_files,
+        size_t threads, int compression_level, bool create_empty_files) {
+    if (writer) throw invalid_argument("Can't demultiplex a file that already has a single output");
+    if (field < 0) throw invalid_argument("Invalid barcode field for demultiplexing");
+    if (!matcher.has_labels() && matcher.size() > max_unlabeled_demux_outputs) {
+        throw invalid_argument("Can't demultiplex by a barcode without labels that has more than " +
+            to_string(max_unlabeled_demux_outputs) + " sequences; give labels to group barcodes into outputs");
     }
+    demux.reset(new DemuxWriter(prefix, suffix, matcher.label_strings(), max_open_files, threads, compression_level, create_empty_files));
+    demux_field = field;
+}
+
+vector<int> FastqFile::required_fields() const {
+    vector<int> ret = formatter.barcode_fields();
+    if (demux) ret.push_back(demux_field);
+    return ret;
+}
 
-    pattern_literals = literals;
-    pattern_fields = fields;
-    for (auto f : fields) {
-        if (f < -1) {
-            size_t field_idx = -f - 2;
-            //Double-check this name field hasn't been seen already
-            if(std::find(name_fields.begin(), name_fields.end(), field_idx) != name_fields.end()) continue;
-            name_fields.push_back(field_idx);
+FastqFile::~FastqFile() {
+    close();
+}
+
+bool FastqFile::next_line(const char *&line, size_t &len) {
+    size_t search_start = in_start;
+    while (true) {
+        char *newline = (char *) memchr(in_buf.data() + search_start, '\n', in_end - search_start);
+        if (newline != nullptr) {
+            line = in_buf.data() + in_start;
+            len = newline - line;
+            in_start += len + 1;
+            return true;
+        }
+        if (in_eof) {
+            // Last line of the file may lack a trailing newline
+            if (in_start == in_end) return false;
+            line = in_buf.data() + in_start;
+            len = in_end - in_start;
+            in_start = in_end;
+            return true;
         }
+        // Move the partial line to the front of the buffer, then refill
+        size_t partial = in_end - in_start;
+        memmove(in_buf.data(), in_buf.data() + in_start, partial);
+        in_start = 0;
+        in_end = partial;
+        search_start = partial;
+        if (in_end == in_buf.size()) in_buf.resize(in_buf.size() * 2);
+        size_t bytes_read = in->read(in_buf.data() + in_end, in_buf.size() - in_end);
+        if (bytes_read == 0) in_eof = true;
+        in_end += bytes_read;
     }
-    if (name_fields.size() == 0) return;
-    
-    // Ensure name_fields[name_fields_lookup[x]] = x for all used fields
-    sort(name_fields.begin(), name_fields.end());
-    name_fields_lookup.resize(name_fields[name_fields.size() - 1]);
-    
-    size_t current_field = 0;
-    for (size_t i = 0; i < name_fields.size(); i++) {
-        if (i == (size_t) name_fields[current_field]) {
-            name_fields_lookup[i] = current_field;
-            current_field += 1;
+}
+
+size_t FastqFile::read_into(FastqChunk &c, size_t max_records) {
+    c.clear();
+    c.name.reserve(max_records, 0);
+    c.seq.reserve(max_records, 0);
+    c.qual.reserve(max_records, 0);
+
+    size_t records_read = 0;
+    const char *line;
+    size_t len;
+
+    for (;records_read < max_records; records_read++) {
+        if (!next_line(line, len)) break;
+        c.name.push_back(line + std::min(len, (size_t) 1), len - std::min(len, (size_t) 1));
+        if (!next_line(line, len)) break;
+        c.seq.push_back(line, len);
+        if (!next_line(line, len)) break; // Skip the + line
+        if (!next_line(line, len)) break;
+        c.qual.push_back(line, len);
+    }
+
+    // Drop any partial record at the end of the file
+    c.name.truncate(records_read);
+    c.seq.truncate(records_read);
+    c.end_of_file = records_read < max_records;
+    return records_read;
+}
+
+std::shared_ptr<FastqChunk> FastqFile::get_free_chunk() {
+    std::lock_guard<std::mutex> l(free_chunks_lock);
+    if (free_chunks.empty()) return std::make_shared<FastqChunk>();
+    auto c = free_chunks.back();
+    free_chunks.pop_back();
+    return c;
+}
+
+void FastqFile::recycle_chunk(std::shared_ptr<FastqChunk> &c) {
+    if (c && c.use_count() == 1) {
+        std::lock_guard<std::mutex> l(free_chunks_lock);
+        free_chunks.push_back(c);
+    }
+    c.reset();
+}
+
+void FastqFile::prefetch_loop() {
+    try {
+        while (true) {
+            auto c = get_free_chunk();
+            read_into(*c, prefetch_size);
+            bool end_of_file = c->end_of_file;
+            if (!prefetched->push(std::move(c)) || end_of_file) break;
         }
+    } catch (...) {
+        prefetch_error = std::current_exception();
+    }
+    prefetched->close();
+}
+
+bool FastqFile::pop_prefetched(std::shared_ptr<FastqChunk> &c) {
+    if (prefetch_finished) return false;
+    if (!prefetched->pop(c)) {
+        prefetch_finished = true;
+        if (prefetch_error) std::rethrow_exception(prefetch_error);
+        return false;
     }
+    return true;
 }
 
 size_t FastqFile::read_chunk(size_t max_records) {
-    if (name.size() != max_records) {
-        name.resize(max_records);
-        seq.resize(max_records);
-        qual.resize(max_records);
+    if (prefetch_depth == 0) {
+        // Reuse the chunk storage unless python still holds views into it
+        if (chunk.use_count() > 1) recycle_chunk(chunk);
+        if (!chunk) chunk = get_free_chunk();
+        return read_into(*chunk, max_records);
     }
-    size_t lines_read = 0;
-    string temp_name, temp_seq, temp_qual;
 
-    for (;lines_read < max_records; lines_read++) {
-        getline(in, temp_name);
-        getline(in, temp_seq);
-        getline(in, temp_qual); // Dummy to read the + symbol
-        getline(in, temp_qual);
+    prefetch_size = max_records;
+    if (!prefetched) {
+        prefetched.reset(new BoundedQueue<std::shared_ptr<FastqChunk>>(prefetch_depth));
+        prefetcher = std::thread([this]{ prefetch_loop(); });
+    }
+    recycle_chunk(chunk);
 
-        if(in.eof()) {
-            break;
+    // Fast path: hand over a prefetched chunk of the requested size
+    if (!pending) {
+        if (!pop_prefetched(pending)) {
+            chunk = get_free_chunk();
+            chunk->clear();
+            return 0;
+        }
+        pending_pos = 0;
+        if (pending->size() == max_records || (pending->end_of_file && pending->size() < max_records)) {
+            chunk = std::move(pending);
+            return chunk->size();
         }
-
-        name[lines_read] = temp_name.substr(1);
-        seq[lines_read] = temp_seq;
-        qual[lines_read] = temp_qual;
     }
 
-    if (lines_read != max_records) {
-        name.resize(lines_read);
-        seq.resize(lines_read);
-        qual.resize(lines_read);
+    // Requested size changed, so assemble the chunk from records of the prefetched chunks
+    chunk = get_free_chunk();
+    chunk->clear();
+    while (chunk->size() < max_records) {
+        if (!pending) {
+            if (!pop_prefetched(pending)) break;
+            pending_pos = 0;
+        }
+        size_t count = std::min(max_records - chunk->size(), pending->size() - pending_pos);
+        chunk->append(*pending, pending_pos, count);
+        pending_pos += count;
+        if (pending_pos == pending->size()) recycle_chunk(pending);
     }
-    return lines_read;
+    return chunk->size();
+}
+
+std::shared_ptr<FastqChunk> FastqFile::next_chunk(size_t max_records) {
+    read_chunk(max_records);
+    return std::move(chunk);
+}
+
+void FastqFile::release_chunk(std::shared_ptr<FastqChunk> &c) {
+    recycle_chunk(c);
 }
 
-py::array_t<uint64_t> FastqFile::match(Matcher &m, const size_t start, const size_t end) {
-    return m.matchAll(seq, start, end);
+map<string, double> FastqFile::input_stats() {
+    return in->stats();
+}
+
+py::array_t<uint64_t> FastqFile::match(Matcher &m, const size_t start, const size_t end, size_t threads) {
+    return m.matchAll(chunk->seq.column(), start, end, threads);
 }
 
 tuple<vector<string>, vector<string>, vector<string> > FastqFile::inspect_reads() {
-    return make_tuple(name, seq, qual);
+    return make_tuple(chunk->name.strings(), chunk->seq.strings(), chunk->qual.strings());
 }
 
-void FastqFile::write_chunk(py::array_t<bool> mask, vector<py::array_t<uint64_t>> raw_matches, vector<Matcher> matchers) {
-    //Make a buffer to read in parts of the read name
-    vector<string> parsed_name_fields(name_fields.size());
-    
-    vector<py::detail::unchecked_reference<uint64_t,1>> matches;
-    matches.reserve(raw_matches.size());
-    for (size_t i = 0; i < raw_matches.size(); i++) {
-        matches.push_back(raw_matches[i].unchecked<1>());
-    }
+tuple<py::array_t<uint8_t>, py::array_t<uint64_t> > FastqFile::get_buffers(int field) {
+    StringArena *arena;
+    if (field == 0) arena = &chunk->name;
+    else if (field == 1) arena = &chunk->seq;
+    else if (field == 2) arena = &chunk->qual;
+    else throw invalid_argument("Field must be 0 (name), 1 (seq), or 2 (qual)");
 
-    ostream *out;
-    if (use_out_gz) out = &out_gz;
-    else out = &out_txt;
+    // The arrays hold a reference to the chunk, so it won't be reused for the next read_chunk while they exist
+    py::capsule owner(new std::shared_ptr<FastqChunk>(chunk), [](void *p) {
+        delete reinterpret_cast<std::shared_ptr<FastqChunk> *>(p);
+    });
+    py::array_t<uint8_t> data(arena->data.size(), (const uint8_t *) arena->data.data(), owner);
+    py::array_t<uint64_t> offsets(arena->offsets.size(), arena->offsets.data(), owner);
+    return std::make_tuple(data, offsets);
+}
 
-    auto m = mask.unchecked<1>();
+void FastqFile::write_chunk(py::array_t<bool, py::array::c_style | py::array::forcecast> mask, vector<py::array_t<uint64_t, py::array::c_style | py::array::forcecast>> raw_matches, vector<Matcher*> matchers) {
+    if (!has_output()) return;
+    if (mask.ndim() != 1) throw invalid_argument("Mask must be 1-dimensional");
+    size_t n = std::min((size_t) mask.shape(0), chunk->size());
 
-    py::gil_scoped_release release;
-    for (int i = 0; i < m.shape(0); i++) {
-        if (!m[i]) continue;
-        // Make the output name
-        *out << "@" << pattern_literals[0];
-
-        // Parse fields from the read name
-        if (name_fields.size()) {
-            int current_field = 0;
-            size_t pos = 0;
-            for (int j = 0; j < name_fields[name_fields.size() - 1]; j++) {
-                size_t nextpos = name[i].find(":", pos);
-                if (name_fields[current_field] == j) {
-                    parsed_name_fields[current_field] = name[i].substr(pos, nextpos);
-                }
-                pos = nextpos;
-            }
+    // Matchers are held by pointer, and labels are read straight from each matcher
+    vector<const Matcher *> field_matchers(matchers.size(), nullptr);
+    vector<const uint64_t *> matches(raw_matches.size(), nullptr);
+    for (int f : required_fields()) {
+        if ((size_t) f >= matchers.size() || matchers[f] == nullptr || (size_t) f >= raw_matches.size()) {
+            throw invalid_argument("Missing matcher for output name field " + std::to_string(f));
         }
-        for (size_t j = 0; j < pattern_fields.size(); j++) {
-            //output field
-            int f = pattern_fields[j];
-            if (f == -1) {
-                *out << name[i];
-            } else if (f < -1) {
-                *out << parsed_name_fields[name_fields_lookup[-f - 2]];
-            } else {
-                *out << matchers[f].get_label(matches[f][i]);
-            }
-            //output final literal
-            *out << pattern_literals[j+1];
+        if (raw_matches[f].ndim() != 1 || (size_t) raw_matches[f].shape(0) < n) {
+            throw invalid_argument("Match array is shorter than the chunk");
         }
+        field_matchers[f] = matchers[f];
+        matches[f] = raw_matches[f].data();
+    }
 
-        *out << "\n" << seq[i] << "\n+\n" << qual[i] << "\n";
+    py::gil_scoped_release release;
+    write_records(*chunk, (const uint8_t *) mask.data(), n, field_matchers, matches);
+}
+
+void FastqFile::write_records(const FastqChunk &c, const uint8_t *mask, size_t n, 
+        const vector<const Matcher *> &matchers, const vector<const uint64_t *> &matches) {
+    if (demux) {
+        // Records are formatted straight into the buffer of their output, then full buffers are written out together
+        const uint64_t *routes = matches[demux_field];
+        for (size_t i = 0; i < n; i++) {
+            if (!mask[i]) continue;
+            formatter.append(demux->buffer(routes[i]), c.name, c.seq, c.qual, i, matchers, matches);
+        }
+        demux->flush_full();
+        return;
+    }
+    if (!writer) return;
+    // Records are formatted into a reusable buffer, which is handed to the writer in large blocks.
+    // The writer is not flushed, so compressed blocks stay full-size across chunks
+    out_buf.clear();
+    for (size_t i = 0; i < n; i++) {
+        if (!mask[i]) continue;
+        formatter.append(out_buf, c.name, c.seq, c.qual, i, matchers, matches);
+        if (out_buf.size() >= output_buffer_size) {
+            writer->write(out_buf.data(), out_buf.size());
+            out_buf.clear();
+        }
     }
-    *out << flush;
-    py::gil_scoped_acquire acquire;   
+    writer->write(out_buf.data(), out_buf.size());
+    out_buf.clear();
 }
 
 void FastqFile::close() {
-    in.close();
-    if (use_out_gz)
-        out_gz.close();
-    else
-        out_txt.close();
+    if (prefetched) prefetched->close();
+    if (prefetcher.joinable()) prefetcher.join();
+    in->close();
+    if (writer) writer->close();
+    if (demux) demux->close();
 }
\ No newline at end of file
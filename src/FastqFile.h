@@ -2,50 +2,119 @@
 #define MATCHA_FASTQ_FILE_H
 
 #include <algorithm>
+#include <atomic>
 #include <cstdint>
+#include <cstring>
 #include <iostream>
-#include <fstream>
+#include <map>
+#include <memory>
 #include <string>
+#include <thread>
 #include <tuple>
 #include <vector>
 
 #include <pybind11/stl.h>
 #include <pybind11/numpy.h>
 
-#include "gzstream/gzstream.h"
+#include "DemuxWriter.h"
+#include "GzipReader.h"
+#include "GzipWriter.h"
 #include "Matcher.h"
+#include "RecordFormatter.h"
+#include "StringArena.h"
 
 namespace py = pybind11;
 
 using std::string;
 using std::vector;
 using std::tuple;
-using std::istream;
+using std::map;
 using std::ostream;
-using std::ofstream;
 
 namespace py = pybind11;
 
+// Storage for one chunk of fastq records, with each field held in a reusable contiguous arena
+struct FastqChunk {
+    StringArena name; // Read names, without the leading @
+    StringArena seq;
+    StringArena qual;
+    bool end_of_file = false; // Set if the input file ended while reading this chunk
+
+    size_t size() const {return seq.size();}
+    void clear() {
+        name.clear();
+        seq.clear();
+        qual.clear();
+        end_of_file = false;
+    }
+    // Append records [start, start+count) from another chunk
+    void append(const FastqChunk &other, size_t start, size_t count) {
+        name.append(other.name, start, count);
+        seq.append(other.seq, start, count);
+        qual.append(other.qual, start, count);
+    }
+};
+
 class FastqFile {
 protected: 
-    vector<string> name;
-    vector<string> seq;
-    vector<string> qual;
-    igzstream in;
-    bool use_out_gz;
-    ofstream out_txt;
-    ogzstream out_gz;
-    vector<string> pattern_literals;
-    vector<int> pattern_fields;
-    vector<int> name_fields;
-    vector<int> name_fields_lookup;
+    std::shared_ptr<FastqChunk> chunk; // Most recently read chunk. Shared with any numpy views from get_buffers
+    std::unique_ptr<GzipReader> in;
+    vector<char> in_buf; // Decompressed input waiting to be parsed
+    size_t in_start = 0; // Start of unparsed data in in_buf
+    size_t in_end = 0; // End of valid data in in_buf
+    bool in_eof = false;
+
+    // Background prefetching of chunks
+    size_t prefetch_depth; // Max number of chunks to read ahead (0 to disable prefetch)
+    std::unique_ptr<BoundedQueue<std::shared_ptr<FastqChunk>>> prefetched;
+    std::thread prefetcher;
+    std::atomic<size_t> prefetch_size{0}; // Records per prefetched chunk
+    std::exception_ptr prefetch_error;
+    std::mutex free_chunks_lock;
+    vector<std::shared_ptr<FastqChunk>> free_chunks; // Chunks available for reuse by the prefetcher
+    std::shared_ptr<FastqChunk> pending; // Partially consumed prefetched chunk
+    size_t pending_pos = 0;
+    bool prefetch_finished = false;
+
+    std::unique_ptr<GzipWriter> writer; // Output file, if any
+    std::unique_ptr<DemuxWriter> demux; // Per-label output files, if demultiplexing
+    int demux_field = -1; // Barcode field whose labels choose the demultiplexed output
+    RecordFormatter formatter; // Compiled output name pattern
+    vector<char> out_buf; // Formatted records waiting to be written
+
+    bool next_line(const char *&line, size_t &len); // Get the next input line (without newline). Valid until the next call
+    size_t read_into(FastqChunk &c, size_t max_records); // Parse up to max_records from the input into c
+    std::shared_ptr<FastqChunk> get_free_chunk(); // Get an unused chunk, or allocate a new one
+    void recycle_chunk(std::shared_ptr<FastqChunk> &c); // Make c available for reuse unless python still holds views into it
+    void prefetch_loop();
+    bool pop_prefetched(std::shared_ptr<FastqChunk> &c);
 public:
-    FastqFile(string in_path, vector<string> literals, vector<int> fields, string out_path = "");
+    FastqFile(string in_path, vector<string> literals, vector<int> fields, string out_path = "", size_t input_threads = 1, size_t prefetch = 0, 
+        size_t output_threads = 1, int compression_level = Z_DEFAULT_COMPRESSION);
+    ~FastqFile();
     size_t read_chunk(size_t max_records);
-    py::array_t<uint64_t> match(Matcher &m, const size_t start, const size_t end); // Match all sequences from last chunk read
+    // Read a chunk and take ownership of it, for pipelines that process several chunks at once. 
+    // Pass the chunk to release_chunk once done with it so its memory can be reused.
+    std::shared_ptr<FastqChunk> next_chunk(size_t max_records);
+    void release_chunk(std::shared_ptr<FastqChunk> &c);
+    map<string, double> input_stats(); // Decompression throughput stats for the input file
+    py::array_t<uint64_t> match(Matcher &m, const size_t start, const size_t end, size_t threads = 1); // Match all sequences from last chunk read
 
     tuple<vector<string>, vector<string>, vector<string> > inspect_reads(); // Returns a tuple of the (name, seq, qual) vectors
-    void write_chunk(py::array_t<bool> mask, vector<py::array_t<uint64_t>> sequence_matches, vector<Matcher> matchers);
+    tuple<py::array_t<uint8_t>, py::array_t<uint64_t> > get_buffers(int field); // Zero-copy (data, offsets) arrays for field 0 = name, 1 = seq, 2 = qual
+    void write_chunk(py::array_t<bool, py::array::c_style | py::array::forcecast> mask, vector<py::array_t<uint64_t, py::array::c_style | py::array::forcecast>> sequence_matches, vector<Matcher*> matchers);
+    // Write records from c where mask[i] is set, for i < n. Safe to call without the GIL.
+    // matchers[f] and matches[f] give the matcher and match indexes for barcode field f of the output name pattern
+    void write_records(const FastqChunk &c, const uint8_t *mask, size_t n, 
+        const vector<const Matcher *> &matchers, const vector<const uint64_t *> &matches);
+    const FastqChunk &current_chunk() const {return *chunk;} // Most recently read chunk
+    // Write records to one file per label of the barcode at the given output name field, instead of to a single output.
+    // Paths are prefix + label + suffix. Files are only created for labels that receive reads, unless create_empty_files is set
+    void set_demux_output(string prefix, string suffix, int field, Matcher &matcher, size_t max_open_files = 256,
+        size_t threads = 1, int compression_level = Z_DEFAULT_COMPRESSION, bool create_empty_files = false);
+    bool has_output() const {return writer || demux;}
+    vector<int> required_fields() const; // Barcode fields that write_records needs labels and matches for
+    const RecordFormatter &output_formatter() const {return formatter;}
     void close();
 };
 
@@ -0,0 +1,171 @@
+#include "FlatIndex.h"
+
+#include <algorithm>
+
+#include "ThreadPool.h"
+
+using namespace std;
+
+static const uint32_t max_direct_bits = 26; // Largest dense key for direct addressing (256MB of offsets)
+
+static uint64_t pext_portable(uint64_t x, uint64_t mask) {
+    uint64_t ret = 0;
+    for (uint64_t bit = 1; mask; bit <<= 1) {
+        if (x & mask & -mask) ret |= bit;
+        mask &= mask - 1;
+    }
+    return ret;
+}
+
+#if defined(__x86_64__) && (defined(__GNUC__) || defined(__clang__))
+#include <immintrin.h>
+
+__attribute__((target("bmi2")))
+static uint64_t pext_bmi2(uint64_t x, uint64_t mask) {
+    return _pext_u64(x, mask);
+}
+
+static const bool has_bmi2 = []{
+    __builtin_cpu_init();
+    return __builtin_cpu_supports("bmi2");
+}();
+
+uint64_t pext(uint64_t x, uint64_t mask) {
+    return has_bmi2 ? pext_bmi2(x, mask) : pext_portable(x, mask);
+}
+#else
+uint64_t pext(uint64_t x, uint64_t mask) {
+    return pext_portable(x, mask);
+}
+#endif
+
+FlatIndex::FlatIndex(uint64_t mask) : mask(mask) {
+    key_bits = __builtin_popcountll(mask);
+    build(nullptr, 0);
+}
+
+// Sort v using up to `threads` threads: blocks are sorted concurrently, then merged pairwise in rounds
+template <class T>
+static void parallel_sort(vector<T> &v, size_t threads) {
+    size_t parts = std::min(threads, v.size() / 4096 + 1);
+    if (parts <= 1) {
+        sort(v.begin(), v.end());
+        return;
+    }
+    vector<size_t> bounds(parts + 1);
+    for (size_t p = 0; p <= parts; p++) bounds[p] = v.size() * p / parts;
+    parallel_for(parts, threads, [&](size_t begin, size_t end) {
+        for (size_t p = begin; p < end; p++) sort(v.begin() + bounds[p], v.begin() + bounds[p + 1]);
+    }, 1);
+    for (size_t width = 1; width < parts; width *= 2) {
+        size_t merges = (parts + 2*width - 1) / (2*width);
+        parallel_for(merges, threads, [&](size_t begin, size_t end) {
+            for (size_t m = begin; m < end; m++) {
+                size_t lo = 2*width*m, mid = std::min(lo + width, parts), hi = std::min(lo + 2*width, parts);
+                inplace_merge(v.begin() + bounds[lo], v.begin() + bounds[mid], v.begin() + bounds[hi]);
+            }
+        }, 1);
+    }
+}
+
+void FlatIndex::build(const uint64_t *keys, size_t n, size_t threads) {
+    vector<uint64_t> dense(n);
+    parallel_for(n, threads, [&](size_t begin, size_t end) {
+        for (size_t i = begin; i < end; i++) {
+            dense[i] = compact(keys[i]);
+        }
+    });
+
+    size_t direct_size = key_bits <= max_direct_bits ? (size_t) 1 << key_bits : 0;
+    direct = key_bits <= max_direct_bits && direct_size <= std::max(4 * n, (size_t) 1 << 16);
+    vector<uint32_t> new_values(n);
+    vector<uint32_t> new_offsets;
+    vector<Slot> new_slots;
+
+    if (direct) {
+        // Counting sort of indexes by dense key
+        new_offsets.assign(direct_size + 1, 0);
+        for (size_t i = 0; i < n; i++) new_offsets[dense[i] + 1]++;
+        for (size_t k = 0; k < direct_size; k++) new_offsets[k + 1] += new_offsets[k];
+        vector<uint32_t> next(new_offsets.begin(), new_offsets.end() - 1);
+        for (size_t i = 0; i < n; i++) new_values[next[dense[i]]++] = i;
+        offsets = std::move(new_offsets);
+        values = std::move(new_values);
+        slots = MappedArray<Slot>();
+        return;
+    }
+
+    vector<std::pair<uint64_t, uint32_t>> pairs(n);
+    for (size_t i = 0; i < n; i++) pairs[i] = {dense[i], (uint32_t) i};
+    parallel_sort(pairs, threads);
+
+    size_t unique_keys = 0;
+    for (size_t i = 0; i < n; i++) {
+        new_values[i] = pairs[i].second;
+        if (i == 0 || pairs[i].first != pairs[i-1].first) unique_keys++;
+    }
+
+    size_t capacity = 2;
+    hash_shift = 63;
+    while (capacity < 2 * unique_keys) {
+        capacity *= 2;
+        hash_shift--;
+    }
+    new_slots.assign(capacity, Slot{0, 0, 0});
+    for (size_t begin = 0; begin < n;) {
+        size_t end = begin + 1;
+        while (end < n && pairs[end].first == pairs[begin].first) end++;
+        size_t i = hash(pairs[begin].first) >> hash_shift;
+        while (new_slots[i].end != 0) i = (i + 1) & (capacity - 1);
+        new_slots[i] = Slot{pairs[begin].first, (uint32_t) begin, (uint32_t) end};
+        begin = end;
+    }
+    slots = std::move(new_slots);
+    values = std::move(new_values);
+    offsets = MappedArray<uint32_t>();
+}
+
+size_t FlatIndex::memory_usage() const {
+    return offsets.memory_usage() + slots.memory_usage() + values.memory_usage();
+}
+
+void FlatIndex::save(IndexWriter &w) const {
+    w.value<uint64_t>(mask);
+    w.value<uint32_t>(key_bits);
+    w.value<uint32_t>(direct);
+    w.value<uint32_t>(hash_shift);
+    w.array(offsets.data(), offsets.size());
+    w.array(slots.data(), slots.size());
+    w.array(values.data(), values.size());
+}
+
+void FlatIndex::load(IndexReader &r, size_t value_limit) {
+    mask = r.value<uint64_t>();
+    key_bits = r.value<uint32_t>();
+    direct = r.value<uint32_t>();
+    hash_shift = r.value<uint32_t>();
+    offsets = r.array<uint32_t>();
+    slots = r.array<Slot>();
+    values = r.array<uint32_t>();
+
+    // Check everything lookups rely on, so a damaged file can't cause reads out of bounds
+    bool valid = key_bits == (uint32_t) __builtin_popcountll(mask);
+    for (size_t i = 0; valid && i < values.size(); i++) valid = values[i] < value_limit;
+    if (valid && direct) {
+        valid = key_bits <= max_direct_bits && offsets.size() == ((size_t) 1 << key_bits) + 1 && offsets[0] == 0 &&
+            offsets[offsets.size() - 1] <= values.size();
+        for (size_t k = 1; valid && k < offsets.size(); k++) valid = offsets[k - 1] <= offsets[k];
+    } else if (valid) {
+        // Slots are a power of two, addressed by the top bits of the hash, with at least one empty slot to end probing
+        size_t n = slots.size();
+        valid = n >= 2 && (n & (n - 1)) == 0 && hash_shift > 0 && hash_shift < 64 && ((size_t) 1 << (64 - hash_shift)) == n;
+        bool has_empty = false;
+        for (size_t i = 0; valid && i < n; i++) {
+            const Slot &s = slots[i];
+            if (s.end == 0) has_empty = true;
+            else valid = s.begin < s.end && s.end <= values.size();
+        }
+        valid = valid && has_empty;
+    }
+    if (!valid) throw runtime_error("Corrupt index file");
+}
@@ -0,0 +1,70 @@
+#ifndef MATCHA_FLAT_INDEX_H
+#define MATCHA_FLAT_INDEX_H
+
+#include <cstddef>
+#include <cstdint>
+#include <utility>
+#include <vector>
+
+#include "MappedFile.h"
+
+using std::uint32_t;
+using std::uint64_t;
+using std::vector;
+
+// Gather the bits of x selected by mask into the low bits of the result (as in the BMI2 pext instruction)
+uint64_t pext(uint64_t x, uint64_t mask);
+
+// Read-only multimap from masked 64-bit keys to uint32 values, stored in flat arrays.
+// Keys are compacted to dense keys by gathering the bits selected by the mask. Each key's values
+// are stored contiguously in a single candidate array, with ranges found in one of two ways:
+//  - direct: an offsets array indexed by the dense key, when the dense key has few bits
+//  - hashed: an open addressing hash table from dense key to range, for wider keys
+class FlatIndex {
+private:
+    struct Slot {
+        uint64_t key;
+        uint32_t begin;
+        uint32_t end; // end == 0 marks an empty slot
+    };
+    uint64_t mask = 0;
+    uint32_t key_bits = 0;
+    bool direct = true;
+    uint32_t hash_shift = 64;
+    MappedArray<uint32_t> offsets; // direct mode: values for dense key k are values[offsets[k], offsets[k+1])
+    MappedArray<Slot> slots; // hashed mode
+    MappedArray<uint32_t> values;
+
+    static uint64_t hash(uint64_t key) {return key * 0x9E3779B97F4A7C15ull;}
+public:
+    FlatIndex(uint64_t mask = 0);
+
+    // Build the index with keys[i] -> i for each i. Values for each key are in increasing order.
+    // Key compaction and sorting are split across up to `threads` threads
+    void build(const uint64_t *keys, size_t n, size_t threads = 1);
+
+    uint64_t compact(uint64_t key) const {return pext(key, mask);}
+    uint64_t key_mask() const {return mask;}
+
+    // Find the range of values with the given dense key. Empty range if not found
+    std::pair<const uint32_t *, const uint32_t *> find_dense(uint64_t dense_key) const {
+        if (direct) {
+            return {values.data() + offsets[dense_key], values.data() + offsets[dense_key + 1]};
+        }
+        size_t slot_mask = slots.size() - 1;
+        for (size_t i = hash(dense_key) >> hash_shift; ; i = (i + 1) & slot_mask) {
+            const Slot &s = slots[i];
+            if (s.end == 0) return {nullptr, nullptr};
+            if (s.key == dense_key) return {values.data() + s.begin, values.data() + s.end};
+        }
+    }
+
+    size_t memory_usage() const; // Bytes of memory used by the index
+
+    void save(IndexWriter &w) const;
+    // Arrays are memory-mapped from the file rather than copied. Throws if the index is inconsistent,
+    // or holds values of value_limit or more
+    void load(IndexReader &r, size_t value_limit);
+};
+
+#endif // MATCHA_FLAT_INDEX_H
@@ -0,0 +1,290 @@
+#include "GzipReader.h"
+
+#include <algorithm>
+#include <cstring>
+#include <stdexcept>
+
+using namespace std;
+
+static const size_t block_size = 1 << 20; // Target decompressed bytes per block handed to the reader
+static const size_t bgzf_header_size = 18; // Size of the gzip header written by bgzip, including the BC extra field
+static const size_t bgzf_footer_size = 8; // CRC32 and uncompressed size after the deflated data
+static const size_t bgzf_max_block_size = 1 << 16;
+
+static uint64_t elapsed_nanos(chrono::steady_clock::time_point start) {
+    return chrono::duration_cast<chrono::nanoseconds>(chrono::steady_clock::now() - start).count();
+}
+
+// Return the total size of a BGZF block given its header, or 0 if the header is not a BGZF header
+static size_t bgzf_block_size(const unsigned char *h, size_t len) {
+    if (len < bgzf_header_size) return 0;
+    if (h[0] != 31 || h[1] != 139 || h[2] != 8 || !(h[3] & 4)) return 0;
+    size_t xlen = h[10] | (h[11] << 8);
+    if (xlen != 6 || h[12] != 'B' || h[13] != 'C' || h[14] != 2 || h[15] != 0) return 0;
+    return (h[16] | (h[17] << 8)) + 1;
+}
+
+template <class T>
+static future<T> ready_future(T value) {
+    std::promise<T> p;
+    p.set_value(std::move(value));
+    return p.get_future();
+}
+
+GzipReader::GzipReader(string path, size_t threads) : path(path), threads(threads) {
+    file = fopen(path.c_str(), "rb");
+    if (file == nullptr) throw invalid_argument("Could not open file: " + path);
+    open_time = chrono::steady_clock::now();
+
+    peeked.resize(bgzf_header_size);
+    peeked.resize(fread(peeked.data(), 1, peeked.size(), file));
+    compressed_bytes += peeked.size();
+
+    if (bgzf_block_size(peeked.data(), peeked.size())) {
+        format = BGZF;
+    } else if (peeked.size() >= 2 && peeked[0] == 31 && peeked[1] == 139) {
+        format = GZIP;
+        memset(&strm, 0, sizeof(strm));
+        if (inflateInit2(&strm, 15 + 32) != Z_OK) throw runtime_error("Could not initialize zlib");
+        strm_init = true;
+        in_buf.resize(block_size);
+    } else {
+        format = PLAIN;
+    }
+
+    if (threads > 0) {
+        if (format == BGZF) pool.reset(new ThreadPool(threads));
+        ready_blocks.reset(new BoundedQueue<future<vector<char>>>(2 * threads + 2));
+        producer = std::thread([this]{ producer_loop(); });
+    }
+}
+
+GzipReader::~GzipReader() {
+    close();
+}
+
+size_t GzipReader::read_raw(void *out, size_t len) {
+    size_t copied = 0;
+    if (peeked_pos < peeked.size()) {
+        copied = min(len, peeked.size() - peeked_pos);
+        memcpy(out, peeked.data() + peeked_pos, copied);
+        peeked_pos += copied;
+    }
+    if (copied < len) {
+        size_t n = fread((char *) out + copied, 1, len - copied, file);
+        compressed_bytes += n;
+        copied += n;
+    }
+    return copied;
+}
+
+bool GzipReader::inflate_gzip(vector<char> &out) {
+    auto start = chrono::steady_clock::now();
+    out.resize(block_size);
+    strm.next_out = (unsigned char *) out.data();
+    strm.avail_out = out.size();
+    while (strm.avail_out > 0) {
+        if (strm.avail_in == 0) {
+            strm.avail_in = read_raw(in_buf.data(), in_buf.size());
+            strm.next_in = in_buf.data();
+            if (strm.avail_in == 0) {
+                if (in_member) throw runtime_error("Unexpected end of gzip file: " + path);
+                break;
+            }
+        }
+        in_member = true;
+        int ret = inflate(&strm, Z_NO_FLUSH);
+        if (ret == Z_STREAM_END) {
+            // Continue on to the next member of a multi-member gzip file, if there is one
+            in_member = false;
+            if (strm.avail_in == 0) {
+                strm.avail_in = read_raw(in_buf.data(), in_buf.size());
+                strm.next_in = in_buf.data();
+            }
+            if (strm.avail_in == 0) break;
+            if (strm.next_in[0] != 31) {
+                // Only zero padding (as written by some tape and block devices) may follow the last member
+                while (strm.avail_in > 0) {
+                    if (std::any_of(strm.next_in, strm.next_in + strm.avail_in, [](unsigned char c) {return c != 0;})) {
+                        throw runtime_error("Trailing garbage after gzip member: " + path);
+                    }
+                    strm.avail_in = read_raw(in_buf.data(), in_buf.size());
+                    strm.next_in = in_buf.data();
+                }
+                break;
+            }
+            inflateReset(&strm);
+        } else if (ret != Z_OK) {
+            throw runtime_error("Error decompressing gzip file: " + path);
+        }
+    }
+    out.resize(out.size() - strm.avail_out);
+    decompress_nanos += elapsed_nanos(start);
+    return out.size() > 0;
+}
+
+// Read whole BGZF blocks until block_size compressed bytes are collected
+bool GzipReader::read_bgzf_blocks(vector<unsigned char> &raw, vector<size_t> &block_starts) {
+    while (raw.size() < block_size) {
+        size_t start = raw.size();
+        raw.resize(start + bgzf_header_size);
+        size_t n = read_raw(raw.data() + start, bgzf_header_size);
+        if (n == 0) {
+            raw.resize(start);
+            break;
+        }
+        size_t total = bgzf_block_size(raw.data() + start, n);
+        if (total == 0) throw runtime_error("Invalid BGZF block header in file: " + path);
+        if (total < bgzf_header_size + bgzf_footer_size || total > bgzf_max_block_size) {
+            throw runtime_error("Invalid BGZF block size in file: " + path);
+        }
+        raw.resize(start + total);
+        if (read_raw(raw.data() + start + bgzf_header_size, total - bgzf_header_size) != total - bgzf_header_size) {
+            throw runtime_error("Unexpected end of BGZF file: " + path);
+        }
+        block_starts.push_back(start);
+    }
+    return !block_starts.empty();
+}
+
+vector<char> GzipReader::inflate_bgzf(const vector<unsigned char> &raw, const vector<size_t> &block_starts) {
+    auto start = chrono::steady_clock::now();
+    vector<char> out;
+    z_stream s;
+    memset(&s, 0, sizeof(s));
+    if (inflateInit2(&s, -15) != Z_OK) throw runtime_error("Could not initialize zlib");
+
+    for (size_t i = 0; i < block_starts.size(); i++) {
+        size_t block_end = i + 1 < block_starts.size() ? block_starts[i+1] : raw.size();
+        const unsigned char *block = raw.data() + block_starts[i];
+        const unsigned char *footer = raw.data() + block_end - 8;
+        uint32_t crc = footer[0] | footer[1] << 8 | footer[2] << 16 | (uint32_t) footer[3] << 24;
+        uint32_t isize = footer[4] | footer[5] << 8 | footer[6] << 16 | (uint32_t) footer[7] << 24;
+
+        if (isize == 0) {
+            // Empty blocks (such as the BGZF EOF marker) have nothing to inflate, and zlib rejects a null output buffer
+            if (crc != 0) {
+                inflateEnd(&s);
+                throw runtime_error("Error decompressing BGZF file: " + path);
+            }
+            continue;
+        }
+        size_t out_start = out.size();
+        out.resize(out_start + isize);
+        inflateReset(&s);
+        s.next_in = (unsigned char *) block + bgzf_header_size;
+        s.avail_in = footer - s.next_in;
+        s.next_out = (unsigned char *) out.data() + out_start;
+        s.avail_out = isize;
+        int ret = inflate(&s, Z_FINISH);
+        if (ret != Z_STREAM_END || s.avail_out != 0 ||
+                crc32(0, (unsigned char *) out.data() + out_start, isize) != crc) {
+            inflateEnd(&s);
+            throw runtime_error("Error decompressing BGZF file: " + path);
+        }
+    }
+    inflateEnd(&s);
+    decompress_nanos += elapsed_nanos(start);
+    return out;
+}
+
+bool GzipReader::produce(future<vector<char>> &block) {
+    if (format == BGZF) {
+        vector<unsigned char> raw;
+        vector<size_t> block_starts;
+        if (!read_bgzf_blocks(raw, block_starts)) return false;
+        if (pool) {
+            block = pool->submit([this, raw = std::move(raw), block_starts = std::move(block_starts)]{
+                return inflate_bgzf(raw, block_starts);
+            });
+        } else {
+            block = ready_future(inflate_bgzf(raw, block_starts));
+        }
+        return true;
+    }
+
+    vector<char> out;
+    if (format == GZIP) {
+        if (!inflate_gzip(out)) return false;
+    } else {
+        out.resize(block_size);
+        out.resize(read_raw(out.data(), out.size()));
+        if (out.empty()) return false;
+    }
+    block = ready_future(std::move(out));
+    return true;
+}
+
+void GzipReader::producer_loop() {
+    try {
+        future<vector<char>> block;
+        while (produce(block)) {
+            if (!ready_blocks->push(std::move(block))) return;
+        }
+    } catch (...) {
+        // Pass errors on to the reading thread
+        std::promise<vector<char>> p;
+        p.set_exception(std::current_exception());
+        ready_blocks->push(p.get_future());
+    }
+    ready_blocks->close();
+}
+
+bool GzipReader::next_block() {
+    current.clear();
+    current_pos = 0;
+    while (!finished && current.empty()) {
+        future<vector<char>> block;
+        bool more = producer.joinable() ? ready_blocks->pop(block) : produce(block);
+        if (!more) {
+            finished = true;
+            end_time = chrono::steady_clock::now();
+            break;
+        }
+        current = block.get();
+        uncompressed_bytes += current.size();
+    }
+    return !current.empty();
+}
+
+size_t GzipReader::read(char *out, size_t len) {
+    size_t copied = 0;
+    while (copied < len) {
+        if (current_pos == current.size() && !next_block()) break;
+        size_t n = min(len - copied, current.size() - current_pos);
+        memcpy(out + copied, current.data() + current_pos, n);
+        current_pos += n;
+        copied += n;
+    }
+    return copied;
+}
+
+void GzipReader::close() {
+    if (ready_blocks) ready_blocks->close();
+    if (producer.joinable()) producer.join();
+    pool.reset();
+    if (strm_init) {
+        inflateEnd(&strm);
+        strm_init = false;
+    }
+    if (file) {
+        fclose(file);
+        file = nullptr;
+    }
+    if (!finished) {
+        finished = true;
+        end_time = chrono::steady_clock::now();
+    }
+}
+
+map<string, double> GzipReader::stats() {
+    auto end = finished ? end_time : chrono::steady_clock::now();
+    double seconds = chrono::duration<double>(end - open_time).count();
+    map<string, double> ret;
+    ret["compressed_bytes"] = compressed_bytes;
+    ret["uncompressed_bytes"] = uncompressed_bytes;
+    ret["seconds"] = seconds;
+    ret["decompress_seconds"] = decompress_nanos / 1e9;
+    ret["mb_per_second"] = seconds > 0 ? uncompressed_bytes / 1e6 / seconds : 0;
+    return ret;
+}
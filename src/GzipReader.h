@@ -0,0 +1,75 @@
+#ifndef MATCHA_GZIP_READER_H
+#define MATCHA_GZIP_READER_H
+
+#include <atomic>
+#include <chrono>
+#include <cstdint>
+#include <cstdio>
+#include <map>
+#include <memory>
+#include <string>
+#include <thread>
+#include <vector>
+
+#include <zlib.h>
+
+#include "ThreadPool.h"
+
+using std::string;
+using std::vector;
+using std::map;
+using std::future;
+
+// Buffered reader for plain or gzipped files, with decompression done on background threads.
+//  - BGZF files (e.g. from bgzip) have their blocks inflated in parallel on a pool of threads
+//  - Other gzip files (single or multi-member) are inflated by one read-ahead thread
+//  - Uncompressed files are read ahead by one background thread
+// With threads == 0, all reading and decompression happens inline during calls to read()
+class GzipReader {
+private:
+    enum Format {PLAIN, GZIP, BGZF};
+
+    string path;
+    FILE *file = nullptr;
+    Format format = PLAIN;
+    size_t threads;
+    vector<unsigned char> peeked; // Bytes read from the start of the file during format detection
+    size_t peeked_pos = 0;
+
+    // Inflate state for (non-BGZF) gzip input
+    z_stream strm;
+    bool strm_init = false;
+    bool in_member = false;
+    vector<unsigned char> in_buf;
+
+    // Decompressed blocks are delivered in order through ready_blocks
+    std::unique_ptr<ThreadPool> pool;
+    std::unique_ptr<BoundedQueue<future<vector<char>>>> ready_blocks;
+    std::thread producer;
+    vector<char> current;
+    size_t current_pos = 0;
+    bool finished = false;
+
+    // Throughput stats
+    std::atomic<uint64_t> compressed_bytes{0};
+    std::atomic<uint64_t> uncompressed_bytes{0};
+    std::atomic<uint64_t> decompress_nanos{0};
+    std::chrono::steady_clock::time_point open_time;
+    std::chrono::steady_clock::time_point end_time;
+
+    size_t read_raw(void *out, size_t len); // Read compressed bytes from the file
+    bool produce(future<vector<char>> &block); // Read and start decompressing the next block. Returns false at end of file
+    bool inflate_gzip(vector<char> &out);
+    bool read_bgzf_blocks(vector<unsigned char> &raw, vector<size_t> &block_starts);
+    vector<char> inflate_bgzf(const vector<unsigned char> &raw, const vector<size_t> &block_starts);
+    void producer_loop();
+    bool next_block();
+public:
+    GzipReader(string path, size_t threads = 1);
+    ~GzipReader();
+    size_t read(char *out, size_t len); // Read up to len decompressed bytes. Returns 0 at end of file
+    void close();
+    map<string, double> stats(); // Bytes read, time taken, and throughput in MB/s
+};
+
+#endif // MATCHA_GZIP_READER_H
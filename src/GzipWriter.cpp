@@ -0,0 +1,152 @@
+#include "GzipWriter.h"
+
+#include <cstring>
+#include <stdexcept>
+
+using namespace std;
+
+static const size_t plain_block_size = 1 << 20;
+static const size_t bgzf_header_size = 18;
+const char bgzf_eof[28] = {
+    31, (char) 139, 8, 4, 0, 0, 0, 0, 0, (char) 255, 6, 0, 66, 67, 2, 0, 27, 0, 3, 0, 0, 0, 0, 0, 0, 0, 0, 0
+};
+
+// A BGZF block is a gzip member with the compressed size stored in a BC extra field
+void compress_bgzf_block(const char *data, size_t len, int level, vector<char> &out) {
+    z_stream s;
+    memset(&s, 0, sizeof(s));
+    if (deflateInit2(&s, level, Z_DEFLATED, -15, 8, Z_DEFAULT_STRATEGY) != Z_OK) {
+        throw runtime_error("Could not initialize zlib");
+    }
+    size_t out_start = out.size();
+    out.resize(out_start + bgzf_header_size + deflateBound(&s, len) + 8);
+    char *block = out.data() + out_start;
+    s.next_in = (unsigned char *) data;
+    s.avail_in = len;
+    s.next_out = (unsigned char *) block + bgzf_header_size;
+    s.avail_out = out.size() - out_start - bgzf_header_size - 8;
+    int ret = deflate(&s, Z_FINISH);
+    deflateEnd(&s);
+    if (ret != Z_STREAM_END) throw runtime_error("Error compressing BGZF block");
+
+    size_t total = bgzf_header_size + s.total_out + 8;
+    out.resize(out_start + total);
+    const unsigned char header[bgzf_header_size] = {
+        31, 139, 8, 4, 0, 0, 0, 0, 0, 255, 6, 0, 'B', 'C', 2, 0,
+        (unsigned char) ((total - 1) & 0xff), (unsigned char) ((total - 1) >> 8)
+    };
+    memcpy(block, header, bgzf_header_size);
+
+    uint32_t crc = crc32(0, (const unsigned char *) data, len);
+    uint32_t isize = len;
+    unsigned char *footer = (unsigned char *) block + total - 8;
+    for (int i = 0; i < 4; i++) {
+        footer[i] = (crc >> (8*i)) & 0xff;
+        footer[4 + i] = (isize >> (8*i)) & 0xff;
+    }
+}
+
+GzipWriter::GzipWriter(string path, bool compress, size_t threads, int level) :
+        path(path), compress(compress), level(level) {
+    if (level < -1 || level > 9) throw invalid_argument("Compression level must be between -1 and 9");
+    file = fopen(path.c_str(), "wb");
+    if (file == nullptr) throw invalid_argument("Could not open file: " + path);
+
+    buffer.resize(compress ? bgzf_block_size : plain_block_size);
+    setp(buffer.data(), buffer.data() + buffer.size());
+    if (compress && threads > 0) pool.reset(new ThreadPool(threads));
+    max_pending = 4 * threads;
+}
+
+GzipWriter::~GzipWriter() {
+    try {
+        close();
+    } catch (...) {}
+}
+
+void GzipWriter::write_raw(const char *data, size_t len) {
+    if (fwrite(data, 1, len, file) != len) throw runtime_error("Error writing file: " + path);
+}
+
+void GzipWriter::write_pending(size_t keep) {
+    while (pending.size() > keep) {
+        vector<char> block = pending.front().get();
+        pending.pop_front();
+        write_raw(block.data(), block.size());
+    }
+}
+
+void GzipWriter::write_block() {
+    size_t len = pptr() - pbase();
+    if (len == 0) return;
+    setp(buffer.data(), buffer.data() + buffer.size());
+
+    if (!compress) {
+        write_raw(buffer.data(), len);
+        return;
+    }
+    vector<char> data(buffer.data(), buffer.data() + len);
+    if (pool) {
+        int block_level = level;
+        pending.push_back(pool->submit([data = std::move(data), block_level]{
+            vector<char> block;
+            compress_bgzf_block(data.data(), data.size(), block_level, block);
+            return block;
+        }));
+        write_pending(max_pending);
+    } else {
+        vector<char> block;
+        compress_bgzf_block(data.data(), data.size(), level, block);
+        write_raw(block.data(), block.size());
+    }
+}
+
+void GzipWriter::write(const char *data, size_t len) {
+    while (len > 0) {
+        size_t space = epptr() - pptr();
+        if (space == 0) {
+            write_block();
+            continue;
+        }
+        size_t n = std::min(space, len);
+        memcpy(pptr(), data, n);
+        pbump(n);
+        data += n;
+        len -= n;
+    }
+}
+
+int GzipWriter::overflow(int c) {
+    write_block();
+    if (c != EOF) {
+        *pptr() = c;
+        pbump(1);
+    }
+    return c == EOF ? 0 : c;
+}
+
+std::streamsize GzipWriter::xsputn(const char *s, std::streamsize n) {
+    write(s, n);
+    return n;
+}
+
+int GzipWriter::sync() {
+    flush();
+    return 0;
+}
+
+void GzipWriter::flush() {
+    if (file == nullptr) return;
+    write_block();
+    write_pending(0);
+    fflush(file);
+}
+
+void GzipWriter::close() {
+    if (file == nullptr) return;
+    flush();
+    if (compress) write_raw(bgzf_eof, sizeof(bgzf_eof));
+    fclose(file);
+    file = nullptr;
+    pool.reset();
+}
@@ -0,0 +1,56 @@
+#ifndef MATCHA_GZIP_WRITER_H
+#define MATCHA_GZIP_WRITER_H
+
+#include <cstdio>
+#include <deque>
+#include <memory>
+#include <streambuf>
+#include <string>
+#include <vector>
+
+#include <zlib.h>
+
+#include "ThreadPool.h"
+
+using std::string;
+using std::vector;
+using std::deque;
+using std::future;
+
+static const size_t bgzf_block_size = 0xff00; // Max uncompressed bytes per BGZF block, as used by bgzip
+extern const char bgzf_eof[28]; // Empty BGZF block marking the end of a file
+
+// Compress data as one BGZF block of at most bgzf_block_size bytes, appending it to out
+void compress_bgzf_block(const char *data, size_t len, int level, vector<char> &out);
+
+// Buffered writer for plain or BGZF-compressed output files. Usable directly or as an ostream buffer.
+// BGZF output is a series of independent gzip members of up to 64KB, so blocks are compressed
+// in parallel on a pool of threads, then written in order. Output is readable by zcat, gzip, bgzip, and samtools.
+// With threads == 0, compression happens inline during writes.
+class GzipWriter : public std::streambuf {
+private:
+    string path;
+    FILE *file = nullptr;
+    bool compress;
+    int level;
+    vector<char> buffer; // Data waiting to be written or compressed
+    std::unique_ptr<ThreadPool> pool;
+    deque<future<vector<char>>> pending; // Blocks being compressed, in output order
+    size_t max_pending;
+
+    void write_block(); // Compress or write out the current buffer
+    void write_pending(size_t keep); // Write out finished compressed blocks until at most keep are pending
+    void write_raw(const char *data, size_t len);
+protected:
+    int overflow(int c) override;
+    std::streamsize xsputn(const char *s, std::streamsize n) override;
+    int sync() override;
+public:
+    GzipWriter(string path, bool compress, size_t threads = 1, int level = Z_DEFAULT_COMPRESSION);
+    ~GzipWriter();
+    void write(const char *data, size_t len);
+    void flush(); // Write all buffered data to the file, ending the current BGZF block
+    void close();
+};
+
+#endif // MATCHA_GZIP_WRITER_H
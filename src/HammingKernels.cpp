@@ -0,0 +1,195 @@
+#include "HammingKernels.h"
+
+#include <stdexcept>
+
+#include "Matcher.h"
+
+using namespace std;
+
+static const uint64_t no_match = UINT64_MAX;
+
+typedef void (*kernel_fn)(const uint64_t *, size_t, const uint64_t *, const uint64_t *, size_t, uint64_t *, uint64_t *);
+
+// Reference implementation, same logic as the original ListMatcher::match
+static void best2_scalar(const uint64_t *barcodes, size_t n_barcodes, const uint64_t *seqs, const uint64_t *flags, size_t n,
+        uint64_t *out_match, uint64_t *out_qual) {
+    for (size_t q = 0; q < n; q++) {
+        uint64_t best_match = no_match;
+        uint64_t best_dist = max_dist;
+        uint64_t next_dist = max_dist;
+        for (size_t i = 0; i < n_barcodes; i++) {
+            uint64_t mismatches = hammingDistance(seqs[q], flags[q], barcodes[i]);
+            if (mismatches < best_dist) {
+                best_match = (uint64_t) i;
+                next_dist = best_dist;
+                best_dist = mismatches;
+            } else if (mismatches < next_dist) {
+                next_dist = mismatches;
+            }
+        }
+        out_match[q] = best_match;
+        out_qual[q] = next_dist << dist_bits | best_dist;
+    }
+}
+
+// The SIMD kernels compare a vector of queries against one barcode at a time, so each lane sees barcodes in the same order
+// as the scalar loop. The branchy update of the scalar loop is equivalent to:
+//   next = min(next, max(best, mismatches)); if (mismatches < best) {best = mismatches; best_match = i;}
+
+#if defined(__x86_64__) && (defined(__GNUC__) || defined(__clang__))
+#include <immintrin.h>
+
+// Popcount of each 64-bit lane, via 4-bit lookups of byte popcounts summed by sad
+__attribute__((target("avx2")))
+static inline __m256i popcount_avx2(__m256i x) {
+    const __m256i lut = _mm256_setr_epi8(0,1,1,2,1,2,2,3,1,2,2,3,2,3,3,4, 0,1,1,2,1,2,2,3,1,2,2,3,2,3,3,4);
+    const __m256i low_nibble = _mm256_set1_epi8(0x0f);
+    __m256i lo = _mm256_shuffle_epi8(lut, _mm256_and_si256(x, low_nibble));
+    __m256i hi = _mm256_shuffle_epi8(lut, _mm256_and_si256(_mm256_srli_epi16(x, 4), low_nibble));
+    return _mm256_sad_epu8(_mm256_add_epi8(lo, hi), _mm256_setzero_si256());
+}
+
+__attribute__((target("avx2")))
+static void best2_avx2(const uint64_t *barcodes, size_t n_barcodes, const uint64_t *seqs, const uint64_t *flags, size_t n,
+        uint64_t *out_match, uint64_t *out_qual) {
+    const __m256i low_bits = _mm256_set1_epi64x(0x5555555555555555);
+    size_t q = 0;
+    // Two vectors of 4 queries per barcode, for more independent work per loop iteration
+    for (; q + 8 <= n; q += 8) {
+        __m256i s0 = _mm256_loadu_si256((const __m256i *) (seqs + q));
+        __m256i s1 = _mm256_loadu_si256((const __m256i *) (seqs + q + 4));
+        __m256i f0 = _mm256_loadu_si256((const __m256i *) (flags + q));
+        __m256i f1 = _mm256_loadu_si256((const __m256i *) (flags + q + 4));
+        __m256i best0 = _mm256_set1_epi64x(max_dist), best1 = best0;
+        __m256i next0 = best0, next1 = best0;
+        __m256i match0 = _mm256_set1_epi64x(-1), match1 = match0;
+        for (size_t i = 0; i < n_barcodes; i++) {
+            __m256i b = _mm256_set1_epi64x(barcodes[i]);
+            __m256i idx = _mm256_set1_epi64x(i);
+            __m256i d0 = _mm256_xor_si256(b, s0);
+            __m256i d1 = _mm256_xor_si256(b, s1);
+            d0 = _mm256_and_si256(_mm256_or_si256(_mm256_or_si256(d0, _mm256_srli_epi64(d0, 1)), f0), low_bits);
+            d1 = _mm256_and_si256(_mm256_or_si256(_mm256_or_si256(d1, _mm256_srli_epi64(d1, 1)), f1), low_bits);
+            __m256i mm0 = popcount_avx2(d0);
+            __m256i mm1 = popcount_avx2(d1);
+            // Distances are small, so signed comparison is safe
+            __m256i lt0 = _mm256_cmpgt_epi64(best0, mm0);
+            __m256i lt1 = _mm256_cmpgt_epi64(best1, mm1);
+            __m256i max0 = _mm256_blendv_epi8(mm0, best0, lt0);
+            __m256i max1 = _mm256_blendv_epi8(mm1, best1, lt1);
+            next0 = _mm256_blendv_epi8(next0, max0, _mm256_cmpgt_epi64(next0, max0));
+            next1 = _mm256_blendv_epi8(next1, max1, _mm256_cmpgt_epi64(next1, max1));
+            best0 = _mm256_blendv_epi8(best0, mm0, lt0);
+            best1 = _mm256_blendv_epi8(best1, mm1, lt1);
+            match0 = _mm256_blendv_epi8(match0, idx, lt0);
+            match1 = _mm256_blendv_epi8(match1, idx, lt1);
+        }
+        _mm256_storeu_si256((__m256i *) (out_match + q), match0);
+        _mm256_storeu_si256((__m256i *) (out_match + q + 4), match1);
+        _mm256_storeu_si256((__m256i *) (out_qual + q), _mm256_or_si256(_mm256_slli_epi64(next0, dist_bits), best0));
+        _mm256_storeu_si256((__m256i *) (out_qual + q + 4), _mm256_or_si256(_mm256_slli_epi64(next1, dist_bits), best1));
+    }
+    best2_scalar(barcodes, n_barcodes, seqs + q, flags + q, n - q, out_match + q, out_qual + q);
+}
+
+// AVX-512 kernel using the native 64-bit popcount of VPOPCNTDQ. CPUs with AVX-512 but no VPOPCNTDQ use the AVX2 kernel
+__attribute__((target("avx512f,avx512vpopcntdq")))
+static void best2_avx512(const uint64_t *barcodes, size_t n_barcodes, const uint64_t *seqs, const uint64_t *flags, size_t n,
+        uint64_t *out_match, uint64_t *out_qual) {
+    const __m512i low_bits = _mm512_set1_epi64(0x5555555555555555);
+    size_t q = 0;
+    for (; q + 16 <= n; q += 16) {
+        __m512i s0 = _mm512_loadu_si512(seqs + q);
+        __m512i s1 = _mm512_loadu_si512(seqs + q + 8);
+        __m512i f0 = _mm512_loadu_si512(flags + q);
+        __m512i f1 = _mm512_loadu_si512(flags + q + 8);
+        __m512i best0 = _mm512_set1_epi64(max_dist), best1 = best0;
+        __m512i next0 = best0, next1 = best0;
+        __m512i match0 = _mm512_set1_epi64(-1), match1 = match0;
+        for (size_t i = 0; i < n_barcodes; i++) {
+            __m512i b = _mm512_set1_epi64(barcodes[i]);
+            __m512i idx = _mm512_set1_epi64(i);
+            __m512i d0 = _mm512_xor_si512(b, s0);
+            __m512i d1 = _mm512_xor_si512(b, s1);
+            // 0xFE is the ternary logic truth table for a | b | c
+            d0 = _mm512_and_si512(_mm512_ternarylogic_epi64(d0, _mm512_srli_epi64(d0, 1), f0, 0xFE), low_bits);
+            d1 = _mm512_and_si512(_mm512_ternarylogic_epi64(d1, _mm512_srli_epi64(d1, 1), f1, 0xFE), low_bits);
+            __m512i mm0 = _mm512_popcnt_epi64(d0);
+            __m512i mm1 = _mm512_popcnt_epi64(d1);
+            __mmask8 lt0 = _mm512_cmplt_epu64_mask(mm0, best0);
+            __mmask8 lt1 = _mm512_cmplt_epu64_mask(mm1, best1);
+            next0 = _mm512_min_epu64(next0, _mm512_max_epu64(best0, mm0));
+            next1 = _mm512_min_epu64(next1, _mm512_max_epu64(best1, mm1));
+            best0 = _mm512_min_epu64(best0, mm0);
+            best1 = _mm512_min_epu64(best1, mm1);
+            match0 = _mm512_mask_mov_epi64(match0, lt0, idx);
+            match1 = _mm512_mask_mov_epi64(match1, lt1, idx);
+        }
+        _mm512_storeu_si512(out_match + q, match0);
+        _mm512_storeu_si512(out_match + q + 8, match1);
+        _mm512_storeu_si512(out_qual + q, _mm512_or_si512(_mm512_slli_epi64(next0, dist_bits), best0));
+        _mm512_storeu_si512(out_qual + q + 8, _mm512_or_si512(_mm512_slli_epi64(next1, dist_bits), best1));
+    }
+    best2_scalar(barcodes, n_barcodes, seqs + q, flags + q, n - q, out_match + q, out_qual + q);
+}
+
+struct Kernel {
+    const char *name;
+    kernel_fn fn;
+    bool supported;
+};
+
+static vector<Kernel> all_kernels() {
+    __builtin_cpu_init();
+    return {
+        {"scalar", best2_scalar, true},
+        {"avx2", best2_avx2, (bool) __builtin_cpu_supports("avx2")},
+        {"avx512", best2_avx512, __builtin_cpu_supports("avx512f") && __builtin_cpu_supports("avx512vpopcntdq")},
+    };
+}
+#else
+struct Kernel {
+    const char *name;
+    kernel_fn fn;
+    bool supported;
+};
+
+static vector<Kernel> all_kernels() {
+    return {{"scalar", best2_scalar, true}};
+}
+#endif
+
+static vector<Kernel> supported_kernels() {
+    vector<Kernel> ret;
+    for (const Kernel &k : all_kernels()) {
+        if (k.supported) ret.push_back(k);
+    }
+    return ret;
+}
+
+static Kernel active_kernel = supported_kernels().back();
+
+void hamming_best2(const uint64_t *barcodes, size_t n_barcodes, const uint64_t *seqs, const uint64_t *flags, size_t n,
+        uint64_t *out_match, uint64_t *out_qual) {
+    active_kernel.fn(barcodes, n_barcodes, seqs, flags, n, out_match, out_qual);
+}
+
+vector<string> hamming_kernels() {
+    vector<string> ret;
+    for (const Kernel &k : supported_kernels()) ret.push_back(k.name);
+    return ret;
+}
+
+string get_hamming_kernel() {
+    return active_kernel.name;
+}
+
+void set_hamming_kernel(string name) {
+    for (const Kernel &k : supported_kernels()) {
+        if (name == k.name) {
+            active_kernel = k;
+            return;
+        }
+    }
+    throw invalid_argument("Hamming kernel not supported on this CPU: " + name);
+}
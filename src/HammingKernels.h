@@ -0,0 +1,25 @@
+#ifndef MATCHA_HAMMING_KERNELS_H
+#define MATCHA_HAMMING_KERNELS_H
+
+#include <cstddef>
+#include <cstdint>
+#include <string>
+#include <vector>
+
+using std::uint64_t;
+using std::string;
+using std::vector;
+
+// For each of n queries (seqs[i], flags[i]), find the first barcode with the minimum hamming distance, and the
+// second-smallest distance over all barcodes (equal to the best distance when several barcodes tie).
+// out_match[i] is the index of the best barcode (2^64-1 if there are no barcodes), and out_qual[i] has the
+// format next_dist << dist_bits | best_dist, with max_dist for missing values.
+// Uses the fastest SIMD kernel supported by the CPU. All kernels give identical results.
+void hamming_best2(const uint64_t *barcodes, size_t n_barcodes, const uint64_t *seqs, const uint64_t *flags, size_t n,
+    uint64_t *out_match, uint64_t *out_qual);
+
+vector<string> hamming_kernels(); // Names of kernels supported by this CPU, slowest first
+string get_hamming_kernel(); // Name of the kernel in use
+void set_hamming_kernel(string name); // Select a kernel by name, mostly for testing and benchmarking
+
+#endif // MATCHA_HAMMING_KERNELS_H
@@ -1,61 +1,178 @@
 #include "HashMatcher.h"
 
-// #include <iostream>
-// #include <bitset>
-// using std::cerr;
-// using std::endl;
-// using std::bitset;
-
-HashMatcher::HashMatcher(vector<uint64_t> chunk_masks, vector<vector<uint64_t>> mismatch_masks, uint max_mismatches) {
+HashMatcher::HashMatcher(vector<uint64_t> chunk_masks, vector<vector<uint64_t>> mismatch_masks, uint max_mismatches, size_t threads)
+    : threads(threads) {
     this->chunk_masks = chunk_masks;
     this->mismatch_masks = mismatch_masks;
     this->max_mismatches = max_mismatches;
     if (chunk_masks.size() != mismatch_masks.size()) {
-        runtime_error("chunk_masks and mismatch_masks have different lengths");
+        throw runtime_error("chunk_masks and mismatch_masks have different lengths");
+    }
+    init_chunk_indexes();
+    init_mismatch_masks();
+}
+
+HashMatcher::HashMatcher(vector<vector<uint64_t>> chunk_masks, vector<vector<vector<uint64_t>>> mismatch_masks, uint max_mismatches,
+    size_t threads) : threads(threads) {
+    this->max_mismatches = max_mismatches;
+    if (chunk_masks.size() != mismatch_masks.size()) {
+        throw runtime_error("chunk_masks and mismatch_masks have different lengths");
     }
-    // cerr << endl;
+    mask_words = chunk_masks.empty() ? 1 : chunk_masks[0].size();
+    if (mask_words == 0) throw invalid_argument("Masks must have at least one word");
     for (size_t i = 0; i < chunk_masks.size(); i++) {
-        chunk_indexes.push_back(unordered_multimap<uint64_t, uint32_t>());
-        // cerr << "Chunk (" << i << ") = " << binaryToString(chunk_masks[i], 10, chunk_masks[i]) << endl;
-        // cerr << "Mismatch (" << i << ") = " << endl;
-        //for (auto m : mismatch_masks[i]) {
-            // cerr << "\t" << binaryToString(m, 10, ~chunk_masks[i]) << endl;
-        //}
+        if (chunk_masks[i].size() != mask_words) throw invalid_argument("All masks must have the same number of words");
+        this->chunk_masks.insert(this->chunk_masks.end(), chunk_masks[i].begin(), chunk_masks[i].end());
+        this->mismatch_masks.push_back(vector<uint64_t>());
+        for (const vector<uint64_t> &m : mismatch_masks[i]) {
+            if (m.size() != mask_words) throw invalid_argument("All masks must have the same number of words");
+            this->mismatch_masks[i].insert(this->mismatch_masks[i].end(), m.begin(), m.end());
+        }
+    }
+    init_chunk_indexes();
+    init_mismatch_masks();
+}
+
+void HashMatcher::init_chunk_indexes() {
+    chunk_indexes.clear();
+    for (size_t i = 0; i < chunk_masks.size() / mask_words; i++) {
+        if (mask_words == 1) {
+            chunk_indexes.push_back(FlatIndex(chunk_masks[i]));
+            continue;
+        }
+        // Multi-word chunks are compacted by wide_key, so the index sees dense keys with all key bits in use
+        size_t key_bits = 0;
+        for (size_t w = 0; w < mask_words; w++) key_bits += __builtin_popcountll(chunk_masks[i*mask_words + w]);
+        if (key_bits > 64) throw invalid_argument("Each subsequence can cover at most 32 bases");
+        chunk_indexes.push_back(FlatIndex(key_bits == 64 ? ~(uint64_t) 0 : ((uint64_t) 1 << key_bits) - 1));
     }
 }
 
+void HashMatcher::init_mismatch_masks() {
+    // Since compaction is a bitwise gather, compact((seq ^ mask) & chunk_mask) == compact(seq) ^ compact(mask)
+    dense_mismatch_masks.clear();
+    for (size_t i = 0; i < chunk_indexes.size(); i++) {
+        dense_mismatch_masks.push_back(vector<uint64_t>());
+        for (size_t j = 0; j < mismatch_masks[i].size(); j += mask_words) {
+            const uint64_t *m = &mismatch_masks[i][j];
+            dense_mismatch_masks[i].push_back(mask_words == 1 ? chunk_indexes[i].compact(*m) : wide_key(i, m));
+        }
+    }
+}
+
+uint64_t HashMatcher::wide_key(size_t i, const uint64_t *seq) const {
+    uint64_t key = 0;
+    size_t shift = 0;
+    for (size_t w = 0; w < mask_words; w++) {
+        uint64_t mask = chunk_masks[i*mask_words + w];
+        if (mask == 0) continue;
+        key |= pext(seq[w], mask) << shift;
+        shift += __builtin_popcountll(mask);
+    }
+    return key;
+}
+
 void HashMatcher::add_sequence(uint64_t seq)  {
-    size_t seq_index = sequences.size();
     sequences.push_back(seq);
+}
 
-    for (size_t i = 0; i < chunk_masks.size(); i++) {
-        // cerr << "Inserting seq_index " << seq_index << " into chunk " << i << " under " << binaryToString(seq, k, ~chunk_masks[i]) << endl;
-        chunk_indexes[i].insert({seq & chunk_masks[i], seq_index});
+void HashMatcher::add_wide_sequence(const uint64_t *seq) {
+    for (size_t w = 0; w < sequence_words(); w++) sequences.push_back(seq[w]);
+}
+
+void HashMatcher::build_index() {
+    if (mask_words != sequence_words()) throw runtime_error("Subsequence masks do not cover the sequence length");
+    // Indexes are built concurrently, with any threads beyond one per index shared out within each build
+    size_t index_threads = std::max((size_t) 1, threads / std::max((size_t) 1, chunk_indexes.size()));
+    parallel_for(chunk_indexes.size(), threads, [&](size_t begin, size_t end) {
+        for (size_t i = begin; i < end; i++) {
+            if (mask_words == 1) {
+                chunk_indexes[i].build(sequences.data(), sequences.size(), index_threads);
+                continue;
+            }
+            vector<uint64_t> keys(size());
+            parallel_for(keys.size(), index_threads, [&](size_t key_begin, size_t key_end) {
+                for (size_t j = key_begin; j < key_end; j++) keys[j] = wide_key(i, sequences.data() + j*mask_words);
+            });
+            chunk_indexes[i].build(keys.data(), keys.size(), index_threads);
+        }
+    }, 1);
+}
+
+static const char index_magic[8] = {'M', 'A', 'T', 'C', 'H', 'A', 'I', 'X'};
+static const uint32_t index_version = 1;
+static const uint32_t hash_matcher_type = 1;
+
+// Index file layout: magic, version, matcher type, then sections written by Matcher::save_sequences,
+// HashMatcher settings, and one FlatIndex per subsequence. Arrays are 64-byte aligned and stored in native byte order
+void HashMatcher::save(string path) {
+    IndexWriter w(path, index_magic, index_version);
+    w.value<uint32_t>(hash_matcher_type);
+    save_sequences(w);
+    w.value<uint32_t>(max_mismatches);
+    w.array(chunk_masks.data(), chunk_masks.size());
+    for (size_t i = 0; i < chunk_indexes.size(); i++) {
+        w.array(mismatch_masks[i].data(), mismatch_masks[i].size());
+        chunk_indexes[i].save(w);
     }
+    w.close();
+}
+
+HashMatcher *HashMatcher::load(string path) {
+    IndexReader r(path, index_magic, index_version);
+    if (r.value<uint32_t>() != hash_matcher_type) throw runtime_error("Not a HashMatcher index file: " + path);
+
+    std::unique_ptr<HashMatcher> m(new HashMatcher());
+    m->load_sequences(r);
+    m->max_mismatches = r.value<uint32_t>();
+    m->mask_words = m->sequence_words();
+    auto masks = r.array<uint64_t>();
+    m->chunk_masks.assign(masks.begin(), masks.end());
+    if (m->chunk_masks.size() % m->mask_words != 0) throw runtime_error("Corrupt index file: " + path);
+    // Each saved index must use the key mask that the chunk masks give, so lookups stay within its key range
+    try {
+        m->init_chunk_indexes();
+    } catch (const invalid_argument &) {
+        throw runtime_error("Corrupt index file: " + path);
+    }
+    for (size_t i = 0; i < m->chunk_indexes.size(); i++) {
+        auto mismatch_masks = r.array<uint64_t>();
+        if (mismatch_masks.size() % m->mask_words != 0) throw runtime_error("Corrupt index file: " + path);
+        m->mismatch_masks.push_back(vector<uint64_t>(mismatch_masks.begin(), mismatch_masks.end()));
+        uint64_t key_mask = m->chunk_indexes[i].key_mask();
+        m->chunk_indexes[i].load(r, m->size());
+        if (m->chunk_indexes[i].key_mask() != key_mask) throw runtime_error("Corrupt index file: " + path);
+    }
+    m->init_mismatch_masks();
+    return m.release();
+}
+
+size_t HashMatcher::memory_usage() {
+    size_t total = Matcher::memory_usage();
+    for (auto &index : chunk_indexes) {
+        total += index.memory_usage();
+    }
+    return total;
 }
 
 //qual format is: 
 //  - bottom 6 bits = # mismatches to best match, 
 //  - next 6 bits = # mismatches to 2nd best match
 
-uint64_t HashMatcher::match(uint64_t seq, uint64_t flag, uint64_t &qual)  {
+template <class Key, class Dist>
+uint64_t HashMatcher::search(Key key, Dist dist, uint64_t &qual) const {
     uint64_t best_match = -1;
     uint64_t best_dist = max_dist;
     uint64_t next_dist = max_dist;
-    // cerr << "Matching seq = " << binaryToString(seq, k, flag) << endl;
-    for (size_t i = 0; i < chunk_masks.size(); i++) {
-        uint64_t chunk_mask = chunk_masks[i];
-        for (uint64_t mismatch_mask : mismatch_masks[i]) {
-            uint64_t query_seq = (seq ^ mismatch_mask) & chunk_mask;
-                // cerr << "\tmismatch_mask = " << binaryToString(mismatch_mask, k, ~chunk_mask) << 
-                // " query_seq = " << binaryToString(query_seq, k, ~chunk_mask) <<
-                // " count = " << chunk_indexes[i].count(query_seq) << endl;
-            auto ret = chunk_indexes[i].equal_range(query_seq);
-            for (auto it = ret.first; it != ret.second; it++) {
-                uint32_t candidate_idx = it->second;
+    for (size_t i = 0; i < chunk_indexes.size(); i++) {
+        const FlatIndex &index = chunk_indexes[i];
+        uint64_t dense_seq = key(i);
+        for (uint64_t mismatch_mask : dense_mismatch_masks[i]) {
+            auto ret = index.find_dense(dense_seq ^ mismatch_mask);
+            for (const uint32_t *it = ret.first; it != ret.second; it++) {
+                uint32_t candidate_idx = *it;
                 if (candidate_idx == best_match) continue;
-                uint64_t mismatches = hammingDistance(seq, flag, sequences[candidate_idx]);
-                // cerr << "\t\tcandidate_idx = " << candidate_idx << " distance = " << mismatches << endl;
+                uint64_t mismatches = dist(candidate_idx);
                 if (mismatches > max_mismatches) {
                     continue;
                 } else if (mismatches == best_dist) {
@@ -76,3 +193,23 @@ uint64_t HashMatcher::match(uint64_t seq, uint64_t flag, uint64_t &qual)  {
     qual = next_dist << dist_bits | best_dist;
     return best_match;
 }
+
+uint64_t HashMatcher::match(uint64_t seq, uint64_t flag, uint64_t &qual)  {
+    return search(
+        [&](size_t i) {return chunk_indexes[i].compact(seq);},
+        [&](uint32_t candidate) {return hammingDistance(seq, flag, sequences[candidate]);},
+        qual
+    );
+}
+
+void HashMatcher::match_wide_block(const uint64_t *seqs, const uint64_t *flags, size_t n, uint64_t *out_match, uint64_t *out_qual) {
+    size_t words = mask_words;
+    for (size_t q = 0; q < n; q++) {
+        const uint64_t *seq = seqs + q*words, *flag = flags + q*words;
+        out_match[q] = search(
+            [&](size_t i) {return wide_key(i, seq);},
+            [&](uint32_t candidate) {return hammingDistanceWords(seq, flag, sequences.data() + candidate*words, words);},
+            out_qual[q]
+        );
+    }
+}
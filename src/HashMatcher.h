@@ -2,24 +2,45 @@
 #define MATCHA_HASH_MATCHER_H
 
 #include <algorithm>
-#include <unordered_map>
 
+#include "FlatIndex.h"
 #include "Matcher.h"
 
-using std::unordered_multimap;
-
 // Worker backend of HashMatcher algorithm as described here: https://arxiv.org/pdf/1307.2982.pdf
 class HashMatcher: public Matcher {
 private:
     uint max_mismatches; // Only used to limit what matches are returned
-    vector<uint64_t> chunk_masks;
-    vector<vector<uint64_t>> mismatch_masks; // Masks to xor with lookup chunk to get neighboring sequences
-    vector<unordered_multimap<uint64_t, uint32_t>> chunk_indexes;
+    size_t mask_words = 1; // Words per mask. For barcodes longer than 32 bases, masks span the same words as the sequences
+    vector<uint64_t> chunk_masks; // mask_words words per chunk
+    vector<vector<uint64_t>> mismatch_masks; // Masks to xor with lookup chunk to get neighboring sequences (mask_words words each)
+    vector<vector<uint64_t>> dense_mismatch_masks; // mismatch_masks compacted to match the dense keys of chunk_indexes
+    vector<FlatIndex> chunk_indexes;
+    size_t threads = 1; // Threads for building the indexes
+
+    HashMatcher() {}
+    void init_chunk_indexes(); // Create an empty index per chunk
+    void init_mismatch_masks(); // Set dense_mismatch_masks from chunk_indexes and mismatch_masks
+    // Dense key of chunk i of a multi-word sequence: the masked bits of each word gathered and concatenated
+    uint64_t wide_key(size_t i, const uint64_t *seq) const;
+    // Find the best and second-best candidates from the chunk indexes. key(i) gives the dense key of chunk i for the query,
+    // and dist(index) the query's distance to a candidate sequence
+    template <class Key, class Dist>
+    uint64_t search(Key key, Dist dist, uint64_t &qual) const;
 public:
     // chunk_masks -- List of masks to be bitwise-anded to extract chunks of input sequences
     // mismatch_masks -- List lists of masks to be xor-ed with with chunks to get neighboring mismatches
-    HashMatcher(vector<uint64_t> chunk_masks, vector<vector<uint64_t>> mismatch_masks, uint max_mismatches);
+    // threads -- Number of threads for building the indexes, split across chunks and within each chunk's index
+    HashMatcher(vector<uint64_t> chunk_masks, vector<vector<uint64_t>> mismatch_masks, uint max_mismatches, size_t threads = 1);
+    // For barcodes longer than 32 bases, each mask is given as a list of words (see binary_words).
+    // Each chunk can cover at most 32 bases
+    HashMatcher(vector<vector<uint64_t>> chunk_masks, vector<vector<vector<uint64_t>>> mismatch_masks, uint max_mismatches, size_t threads = 1);
     void add_sequence(uint64_t seq) override;
+    void add_wide_sequence(const uint64_t *seq) override;
+    void match_wide_block(const uint64_t *seqs, const uint64_t *flags, size_t n, uint64_t *out_match, uint64_t *out_qual) override;
+    void build_index() override;
+    size_t memory_usage() override;
+    void save(string path); // Save the matcher and its index to a binary file
+    static HashMatcher *load(string path); // Load a saved matcher, memory-mapping the index from the file
     uint64_t match(uint64_t seq, uint64_t flag, uint64_t &qual) override; //qual format is: bottom 6 bits = # mismatches to best match, next 6 bits = # mismatches to 2nd best match
 };
 
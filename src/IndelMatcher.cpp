@@ -0,0 +1,141 @@
+#include "IndelMatcher.h"
+
+#include <algorithm>
+#include <limits>
+
+using namespace std;
+
+static const uint64_t even_bits = 0x5555555555555555ull;
+
+static uint64_t low_bases(size_t len) {
+    return len >= 32 ? ~(uint64_t) 0 : ((uint64_t) 1 << (2*len)) - 1;
+}
+
+static uint64_t delete_base(uint64_t seq, size_t pos) {
+    uint64_t high = pos >= 31 ? 0 : seq >> (2*pos + 2) << (2*pos);
+    return (seq & low_bases(pos)) | high;
+}
+
+// Set out[j] to the distinct strings made by deleting exactly j bases from seq (of length len), for j <= max_deletions
+static void deletion_variants(uint64_t seq, size_t len, uint64_t max_deletions, vector<vector<uint64_t>> &out) {
+    out.resize(max_deletions + 1);
+    out[0].assign(1, seq);
+    for (size_t j = 1; j <= max_deletions; j++) {
+        out[j].clear();
+        for (uint64_t s : out[j - 1]) {
+            for (size_t pos = 0; pos + j <= len; pos++) out[j].push_back(delete_base(s, pos));
+        }
+        sort(out[j].begin(), out[j].end());
+        out[j].erase(unique(out[j].begin(), out[j].end()), out[j].end());
+    }
+}
+
+IndelMatcher::IndelMatcher(uint64_t max_edits, size_t extra_bases) : max_edits(max_edits), extra_bases(extra_bases) {
+    if (max_edits < 1 || max_edits > 2) throw invalid_argument("max_edits must be 1 or 2");
+}
+
+void IndelMatcher::add_sequence(uint64_t seq) {
+    sequences.push_back(seq);
+}
+
+void IndelMatcher::build_index() {
+    window_length = k + extra_bases;
+    if (window_length > 32) throw invalid_argument("Barcode length plus extra_bases must be at most 32");
+    if (k <= max_edits) throw invalid_argument("Barcodes must be longer than max_edits");
+
+    vector<vector<uint64_t>> keys(max_edits + 1), variants;
+    deletion_owners.assign(max_edits + 1, vector<uint32_t>());
+    for (size_t i = 0; i < sequences.size(); i++) {
+        deletion_variants(sequences[i], k, max_edits, variants);
+        for (size_t j = 0; j <= max_edits; j++) {
+            keys[j].insert(keys[j].end(), variants[j].begin(), variants[j].end());
+            deletion_owners[j].insert(deletion_owners[j].end(), variants[j].size(), (uint32_t) i);
+        }
+    }
+    deletion_indexes.clear();
+    for (size_t j = 0; j <= max_edits; j++) {
+        if (keys[j].size() >= numeric_limits<uint32_t>::max()) throw runtime_error("Too many sequences for IndelMatcher");
+        deletion_indexes.push_back(FlatIndex(low_bases(k - j)));
+        deletion_indexes[j].build(keys[j].data(), keys[j].size());
+    }
+}
+
+size_t IndelMatcher::memory_usage() {
+    size_t total = Matcher::memory_usage();
+    for (size_t j = 0; j < deletion_indexes.size(); j++) {
+        total += deletion_indexes[j].memory_usage() + deletion_owners[j].capacity() * sizeof(uint32_t);
+    }
+    return total;
+}
+
+// Myers' bit-parallel algorithm, in the formulation of Hyyro (2001), with one bit per barcode base.
+// Row 0 of the dynamic programming matrix counts up along the window, so each column gives the distance
+// between the barcode and a window prefix
+uint64_t IndelMatcher::edit_distance(uint64_t barcode, uint64_t seq, uint64_t flag, uint64_t &aligned) const {
+    uint64_t rows = ((uint64_t) 1 << k) - 1, high = (uint64_t) 1 << (k - 1);
+    uint64_t peq[4];
+    for (uint64_t c = 0; c < 4; c++) {
+        uint64_t diff = barcode ^ (c * even_bits);
+        peq[c] = pext(~(diff | diff >> 1) & even_bits, even_bits) & rows;
+    }
+    uint64_t pv = rows, mv = 0, score = k, best = k;
+    aligned = 0;
+    for (size_t j = 0; j < window_length; j++) {
+        uint64_t eq = (flag >> (2*j) & 1) ? 0 : peq[seq >> (2*j) & 3];
+        uint64_t xv = eq | mv;
+        uint64_t xh = (((eq & pv) + pv) ^ pv) | eq;
+        uint64_t ph = mv | ~(xh | pv);
+        uint64_t mh = pv & xh;
+        if (ph & high) score++;
+        else if (mh & high) score--;
+        ph = ph << 1 | 1;
+        mh = mh << 1;
+        pv = mh | ~(xv | ph);
+        mv = ph & xv;
+        if (score < best) {
+            best = score;
+            aligned = j + 1;
+        }
+    }
+    return best;
+}
+
+uint64_t IndelMatcher::match(uint64_t seq, uint64_t flag, uint64_t &qual) {
+    // A window prefix within max_edits of a barcode has length within max_edits of the barcode length, and the
+    // two share a string made by deleting at most max_edits bases from each, of length at least k - max_edits
+    vector<uint32_t> candidates;
+    vector<vector<uint64_t>> variants;
+    size_t min_prefix = k - max_edits, max_prefix = std::min(k + max_edits, window_length);
+    for (size_t m = min_prefix; m <= max_prefix; m++) {
+        deletion_variants(seq & low_bases(m), m, max_edits, variants);
+        for (size_t j = 0; j <= max_edits; j++) {
+            if (m - j < min_prefix || m - j > k) continue;
+            const FlatIndex &index = deletion_indexes[k - (m - j)];
+            const vector<uint32_t> &owners = deletion_owners[k - (m - j)];
+            for (uint64_t v : variants[j]) {
+                auto range = index.find_dense(index.compact(v));
+                for (const uint32_t *it = range.first; it != range.second; it++) candidates.push_back(owners[*it]);
+            }
+        }
+    }
+    sort(candidates.begin(), candidates.end());
+    candidates.erase(unique(candidates.begin(), candidates.end()), candidates.end());
+
+    uint64_t best_match = -1, best_dist = max_dist, next_dist = max_dist, best_aligned = 0;
+    for (uint32_t c : candidates) {
+        uint64_t aligned;
+        uint64_t dist = edit_distance(sequences[c], seq, flag, aligned);
+        if (dist > max_edits) continue;
+        // Candidates are in index order, so ties keep the first barcode
+        if (dist < best_dist) {
+            next_dist = best_dist;
+            best_dist = dist;
+            best_match = c;
+            best_aligned = aligned;
+        } else if (dist < next_dist) {
+            next_dist = dist;
+        }
+    }
+    qual = best_aligned << (2*dist_bits) | next_dist << dist_bits | best_dist;
+    return best_match;
+}
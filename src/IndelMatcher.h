@@ -0,0 +1,38 @@
+#ifndef MATCHA_INDEL_MATCHER_H
+#define MATCHA_INDEL_MATCHER_H
+
+#include "FlatIndex.h"
+#include "Matcher.h"
+
+// Matcher scoring barcodes by edit distance (substitutions, insertions, and deletions), for up to 2 edits.
+// Queries are a read window a few bases longer than the barcodes, and the distance is the smallest edit distance
+// between the barcode and any prefix of the window, so trailing bases after an insertion or deletion are free.
+// Candidates are found with a SymSpell-style deletion neighborhood index: every string made by deleting up to
+// max_edits bases from a barcode is indexed, and a window prefix within max_edits of a barcode shares one of
+// these strings with it. Candidates are verified with Myers' bit-parallel edit distance algorithm.
+// The qual has the usual best and second-best distances (max_dist when missing or over max_edits), then
+// in bits 12-17 the number of window bases aligned to the best barcode
+class IndelMatcher: public Matcher {
+private:
+    uint64_t max_edits;
+    size_t window_length = 0; // Query window: barcode length plus extra bases
+    size_t extra_bases;
+    // deletion_indexes[j] holds the strings made by deleting exactly j bases from each barcode (length k - j),
+    // with deletion_owners[j][v] the barcode index of the v-th string
+    vector<FlatIndex> deletion_indexes;
+    vector<vector<uint32_t>> deletion_owners;
+
+    // Edit distance between barcode and the closest prefix of the query window, with the prefix length in aligned
+    uint64_t edit_distance(uint64_t barcode, uint64_t seq, uint64_t flag, uint64_t &aligned) const;
+public:
+    // max_edits -- Maximum edit distance to match (1 or 2)
+    // extra_bases -- Bases in the query window past the end of the barcode, for reads with insertions
+    IndelMatcher(uint64_t max_edits, size_t extra_bases);
+    void add_sequence(uint64_t seq) override;
+    void build_index() override;
+    size_t memory_usage() override;
+    uint64_t match(uint64_t seq, uint64_t flag, uint64_t &qual) override; // seq is the encoded query window
+    size_t query_length() const override {return window_length;} // Bases in the query window
+};
+
+#endif // MATCHA_INDEL_MATCHER_H
@@ -1,4 +1,20 @@
 #include "ListMatcher.h"
+#include "HammingKernels.h"
+
+ListMatcher::ListMatcher(uint64_t max_mismatches) : max_mismatches(max_mismatches) {}
+
+void ListMatcher::apply_cutoff(size_t n, uint64_t *out_match, uint64_t *out_qual) const {
+    if (max_mismatches >= max_dist) return;
+    for (size_t i = 0; i < n; i++) {
+        uint64_t best_dist = out_qual[i] & max_dist, next_dist = out_qual[i] >> dist_bits & max_dist;
+        if (best_dist > max_mismatches) {
+            out_match[i] = -1;
+            best_dist = max_dist;
+        }
+        if (next_dist > max_mismatches) next_dist = max_dist;
+        out_qual[i] = next_dist << dist_bits | best_dist;
+    }
+}
 
 void ListMatcher::add_sequence(uint64_t seq) {
     sequences.push_back(seq);
@@ -6,21 +22,42 @@ void ListMatcher::add_sequence(uint64_t seq) {
 
 uint64_t ListMatcher::match(uint64_t seq, uint64_t flag, uint64_t &qual) {
     uint64_t best_match;
-    uint64_t best_dist = max_dist;
-    uint64_t next_dist = max_dist;
+    ListMatcher::match_block(&seq, &flag, 1, &best_match, &qual);
+    return best_match;
+}
 
-    for (size_t i = 0; i < sequences.size(); i ++) {
-        uint64_t mismatches = hammingDistance(seq, flag, sequences[i]);
-        if (mismatches < best_dist) {
-            best_match = (uint64_t) i;
-            next_dist = best_dist;
-            best_dist = mismatches;
-        } else if (mismatches < next_dist) {
-            next_dist = mismatches;
+void ListMatcher::match_block(const uint64_t *seqs, const uint64_t *flags, size_t n, uint64_t *out_match, uint64_t *out_qual) {
+    // Queries are compared to every barcode using the fastest SIMD kernel for this CPU
+    hamming_best2(sequences.data(), sequences.size(), seqs, flags, n, out_match, out_qual);
+    apply_cutoff(n, out_match, out_qual);
+}
+
+void ListMatcher::add_wide_sequence(const uint64_t *seq) {
+    for (size_t w = 0; w < sequence_words(); w++) sequences.push_back(seq[w]);
+}
+
+void ListMatcher::match_wide_block(const uint64_t *seqs, const uint64_t *flags, size_t n, uint64_t *out_match, uint64_t *out_qual) {
+    // Word-parallel hamming distance to every barcode, stopping early once a barcode can't beat the second-best distance
+    size_t words = sequence_words(), n_barcodes = size();
+    for (size_t i = 0; i < n; i++) {
+        const uint64_t *seq = seqs + i*words, *flag = flags + i*words;
+        uint64_t best_match = -1, best_dist = max_dist, next_dist = max_dist;
+        for (size_t b = 0; b < n_barcodes; b++) {
+            const uint64_t *barcode = sequences.data() + b*words;
+            uint64_t dist = 0;
+            for (size_t w = 0; w < words && dist < next_dist; w++) {
+                dist += hammingDistance(seq[w], flag[w], barcode[w]);
+            }
+            if (dist < best_dist) {
+                next_dist = best_dist;
+                best_dist = dist;
+                best_match = b;
+            } else if (dist < next_dist) {
+                next_dist = dist;
+            }
         }
+        out_match[i] = best_match;
+        out_qual[i] = next_dist << dist_bits | best_dist;
     }
-
-    //qual format is: bottom N bits = # mismatches to best match, next N bits = # mismatches to 2nd best match
-    qual = next_dist << dist_bits | best_dist;
-    return best_match;
-}
\ No newline at end of file
+    apply_cutoff(n, out_match, out_qual);
+}
@@ -4,9 +4,18 @@
 #include "Matcher.h"
 
 class ListMatcher: public Matcher {
+private:
+    uint64_t max_mismatches;
+    // Report distances over max_mismatches as max_dist, leaving queries with no barcode in range unmatched
+    void apply_cutoff(size_t n, uint64_t *out_match, uint64_t *out_qual) const;
 public:
+    // max_mismatches -- Largest distance to report, as in HashMatcher. The default of max_dist reports the nearest barcodes at any distance
+    ListMatcher(uint64_t max_mismatches = max_dist);
     void add_sequence(uint64_t seq) override;
     uint64_t match(uint64_t seq, uint64_t flag, uint64_t &qual) override; //qual format is: bottom 6 bits = # mismatches to best match, next 6 bits = # mismatches to 2nd best match
+    void match_block(const uint64_t *seqs, const uint64_t *flags, size_t n, uint64_t *out_match, uint64_t *out_qual) override;
+    void add_wide_sequence(const uint64_t *seq) override;
+    void match_wide_block(const uint64_t *seqs, const uint64_t *flags, size_t n, uint64_t *out_match, uint64_t *out_qual) override;
 };
 
 #endif // MATCHA_LIST_MATCHER_H
\ No newline at end of file
@@ -0,0 +1,102 @@
+#include "MappedFile.h"
+
+#ifndef _WIN32
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#endif
+
+using namespace std;
+
+static const size_t alignment = 64;
+
+MappedFile::MappedFile(string path) {
+#ifndef _WIN32
+    int fd = open(path.c_str(), O_RDONLY);
+    if (fd < 0) throw invalid_argument("Could not open file: " + path);
+    struct stat st;
+    if (fstat(fd, &st) != 0) {
+        ::close(fd);
+        throw runtime_error("Could not read file size: " + path);
+    }
+    len = st.st_size;
+    if (len > 0) {
+        void *p = mmap(nullptr, len, PROT_READ, MAP_SHARED, fd, 0);
+        if (p == MAP_FAILED) {
+            ::close(fd);
+            throw runtime_error("Could not memory map file: " + path);
+        }
+        ptr = (const char *) p;
+    }
+    ::close(fd);
+#else
+    FILE *f = fopen(path.c_str(), "rb");
+    if (f == nullptr) throw invalid_argument("Could not open file: " + path);
+    char buf[1 << 16];
+    size_t n;
+    while ((n = fread(buf, 1, sizeof(buf), f)) > 0) fallback.insert(fallback.end(), buf, buf + n);
+    fclose(f);
+    ptr = fallback.data();
+    len = fallback.size();
+#endif
+}
+
+MappedFile::~MappedFile() {
+#ifndef _WIN32
+    if (ptr != nullptr) munmap((void *) ptr, len);
+#endif
+}
+
+IndexWriter::IndexWriter(string path, const char magic[8], uint32_t version) : path(path) {
+    file = fopen(path.c_str(), "wb");
+    if (file == nullptr) throw invalid_argument("Could not open file: " + path);
+    write_bytes(magic, 8);
+    value<uint32_t>(version);
+}
+
+IndexWriter::~IndexWriter() {
+    if (file != nullptr) fclose(file);
+}
+
+void IndexWriter::write_bytes(const void *data, size_t len) {
+    if (len > 0 && fwrite(data, 1, len, file) != len) throw runtime_error("Error writing file: " + path);
+    pos += len;
+}
+
+void IndexWriter::align() {
+    static const char zeros[alignment] = {0};
+    write_bytes(zeros, (alignment - pos % alignment) % alignment);
+}
+
+void IndexWriter::close() {
+    if (fclose(file) != 0) {
+        file = nullptr;
+        throw runtime_error("Error writing file: " + path);
+    }
+    file = nullptr;
+}
+
+IndexReader::IndexReader(string path, const char magic[8], uint32_t version) : path(path) {
+    file = std::make_shared<MappedFile>(path);
+    if (file->size() < 12 || memcmp(file->data(), magic, 8) != 0) {
+        throw runtime_error("Not a matcha index file: " + path);
+    }
+    pos = 8;
+    uint32_t file_version = value<uint32_t>();
+    if (file_version != version) {
+        throw runtime_error("Unsupported index file version " + std::to_string(file_version) +
+            " (expected " + std::to_string(version) + "): " + path);
+    }
+}
+
+const char *IndexReader::read_bytes(size_t len) {
+    if (len > file->size() - pos) throw runtime_error("Truncated index file: " + path);
+    const char *ret = file->data() + pos;
+    pos += len;
+    return ret;
+}
+
+void IndexReader::align() {
+    read_bytes((alignment - pos % alignment) % alignment);
+}
@@ -0,0 +1,138 @@
+#ifndef MATCHA_MAPPED_FILE_H
+#define MATCHA_MAPPED_FILE_H
+
+#include <cstdint>
+#include <cstdio>
+#include <cstring>
+#include <memory>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+using std::uint64_t;
+using std::string;
+using std::vector;
+using std::runtime_error;
+
+// Read-only memory map of a whole file. Pages are shared between all processes mapping the same file
+class MappedFile {
+private:
+    const char *ptr = nullptr;
+    size_t len = 0;
+    vector<char> fallback; // File contents on platforms without mmap
+public:
+    MappedFile(string path);
+    ~MappedFile();
+    MappedFile(const MappedFile &) = delete;
+    MappedFile &operator=(const MappedFile &) = delete;
+    const char *data() const {return ptr;}
+    size_t size() const {return len;}
+};
+
+// Array that either owns its data in a vector, or points into a memory-mapped file.
+// Read access is identical either way. Modifying a mapped array first copies it into memory.
+template <class T>
+class MappedArray {
+private:
+    vector<T> owned;
+    const T *ptr = nullptr;
+    size_t n = 0;
+    std::shared_ptr<MappedFile> file; // Keeps the mapping alive while data points into it
+
+    void rebind() {
+        if (!file) {
+            ptr = owned.data();
+            n = owned.size();
+        }
+    }
+    void detach() {
+        if (file) {
+            owned.assign(ptr, ptr + n);
+            file.reset();
+        }
+    }
+public:
+    MappedArray() {}
+    MappedArray(vector<T> v) : owned(std::move(v)) {rebind();}
+    MappedArray(std::shared_ptr<MappedFile> file, const T *ptr, size_t n) : ptr(ptr), n(n), file(file) {}
+    MappedArray(const MappedArray &o) : owned(o.owned), ptr(o.ptr), n(o.n), file(o.file) {rebind();}
+    MappedArray(MappedArray &&o) : owned(std::move(o.owned)), ptr(o.ptr), n(o.n), file(std::move(o.file)) {rebind();}
+    MappedArray &operator=(MappedArray o) {
+        owned = std::move(o.owned);
+        ptr = o.ptr;
+        n = o.n;
+        file = std::move(o.file);
+        rebind();
+        return *this;
+    }
+
+    size_t size() const {return n;}
+    bool empty() const {return n == 0;}
+    const T *data() const {return ptr;}
+    const T *begin() const {return ptr;}
+    const T *end() const {return ptr + n;}
+    const T &operator[](size_t i) const {return ptr[i];}
+    bool is_mapped() const {return (bool) file;}
+    size_t memory_usage() const {return file ? n * sizeof(T) : owned.capacity() * sizeof(T);}
+
+    void push_back(const T &x) {
+        detach();
+        owned.push_back(x);
+        rebind();
+    }
+    void clear() {
+        owned.clear();
+        file.reset();
+        rebind();
+    }
+};
+
+// Writer for versioned binary files of values and arrays, with arrays aligned for direct memory mapping
+class IndexWriter {
+private:
+    FILE *file;
+    string path;
+    size_t pos = 0;
+    void write_bytes(const void *data, size_t len);
+    void align();
+public:
+    IndexWriter(string path, const char magic[8], uint32_t version);
+    ~IndexWriter();
+    template <class T>
+    void value(const T &x) {write_bytes(&x, sizeof(T));}
+    template <class T>
+    void array(const T *data, size_t n) {
+        value<uint64_t>(n);
+        align();
+        write_bytes(data, n * sizeof(T));
+    }
+    void close();
+};
+
+// Reader for files from IndexWriter. Arrays point directly into the mapped file rather than being copied
+class IndexReader {
+private:
+    std::shared_ptr<MappedFile> file;
+    string path;
+    size_t pos = 0;
+    const char *read_bytes(size_t len);
+    void align();
+public:
+    IndexReader(string path, const char magic[8], uint32_t version);
+    template <class T>
+    T value() {
+        T x;
+        memcpy(&x, read_bytes(sizeof(T)), sizeof(T));
+        return x;
+    }
+    template <class T>
+    MappedArray<T> array() {
+        uint64_t n = value<uint64_t>();
+        align();
+        if (n > file->size() / sizeof(T)) throw runtime_error("Corrupt index file: " + path);
+        const T *data = reinterpret_cast<const T *>(read_bytes(n * sizeof(T)));
+        return MappedArray<T>(file, data, n);
+    }
+};
+
+#endif // MATCHA_MAPPED_FILE_H
@@ -0,0 +1,80 @@
+#include "MatchCounter.h"
+
+#include <algorithm>
+#include <limits>
+
+using namespace std;
+
+static const uint64_t dist_bins = max_dist + 1;
+
+static void check_results(const ResultArray &results) {
+    if (results.ndim() != 2 || results.shape(0) != 2) throw invalid_argument("Results must be a (2, n) array");
+}
+
+MatchCounter::MatchCounter(const Matcher &matcher) : dist_counts(dist_bins * dist_bins, 0) {
+    if (matcher.size() > max_match_indexes) {
+        throw invalid_argument("Matcher has too many match indexes to count (" + std::to_string(matcher.size()) + ", limit " +
+            std::to_string(max_match_indexes) + "). Count combinatorial rounds as separate barcodes instead");
+    }
+    match_counts.assign(matcher.size() + 1, 0);
+}
+
+void MatchCounter::add(const uint64_t *matches, const uint64_t *quals, size_t n, const uint8_t *mask) {
+    uint64_t unmatched = match_counts.size() - 1;
+    for (size_t i = 0; i < n; i++) {
+        if (mask != nullptr && !mask[i]) continue;
+        match_counts[std::min(matches[i], unmatched)]++;
+        dist_counts[(quals[i] & max_dist) * dist_bins + (quals[i] >> dist_bits & max_dist)]++;
+    }
+}
+
+void MatchCounter::add_results(ResultArray results) {
+    check_results(results);
+    py::gil_scoped_release release;
+    // Row pointers from the row stride, since indexed access is bounds-checked and fails for empty results
+    add(results.data(), results.data() + results.strides(0) / sizeof(uint64_t), results.shape(1));
+}
+
+py::array_t<uint64_t> MatchCounter::get_match_counts() const {
+    return py::array_t<uint64_t>(match_counts.size(), match_counts.data());
+}
+
+py::array_t<uint64_t> MatchCounter::get_dist_counts() const {
+    return py::array_t<uint64_t>(vector<py::ssize_t>{(py::ssize_t) dist_bins, (py::ssize_t) dist_bins}, dist_counts.data());
+}
+
+void JointCounter::add(const uint64_t *matches_a, const uint64_t *matches_b, size_t n, const uint8_t *mask) {
+    for (size_t i = 0; i < n; i++) {
+        if (mask != nullptr && !mask[i]) continue;
+        counts[make_pair(matches_a[i], matches_b[i])]++;
+    }
+}
+
+void JointCounter::add_results(ResultArray results_a, ResultArray results_b, py::object mask) {
+    check_results(results_a);
+    check_results(results_b);
+    size_t n = results_a.shape(1);
+    if ((size_t) results_b.shape(1) != n) throw invalid_argument("Results must have equal lengths");
+    const uint8_t *mask_data = nullptr;
+    py::array_t<bool, py::array::c_style | py::array::forcecast> mask_array;
+    if (!mask.is_none()) {
+        mask_array = mask.cast<py::array_t<bool, py::array::c_style | py::array::forcecast>>();
+        if (mask_array.ndim() != 1 || (size_t) mask_array.shape(0) != n) throw invalid_argument("Mask must match the results length");
+        mask_data = (const uint8_t *) mask_array.data();
+    }
+    py::gil_scoped_release release;
+    add(results_a.data(), results_b.data(), n, mask_data);
+}
+
+std::tuple<py::array_t<uint64_t>, py::array_t<uint64_t>, py::array_t<uint64_t>> JointCounter::get_counts() const {
+    vector<pair<pair<uint64_t, uint64_t>, uint64_t>> sorted(counts.begin(), counts.end());
+    sort(sorted.begin(), sorted.end());
+    py::array_t<uint64_t> a(sorted.size()), b(sorted.size()), count(sorted.size());
+    uint64_t *a_data = a.mutable_data(), *b_data = b.mutable_data(), *count_data = count.mutable_data();
+    for (size_t i = 0; i < sorted.size(); i++) {
+        a_data[i] = sorted[i].first.first;
+        b_data[i] = sorted[i].first.second;
+        count_data[i] = sorted[i].second;
+    }
+    return std::make_tuple(a, b, count);
+}
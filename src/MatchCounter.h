@@ -0,0 +1,56 @@
+#ifndef MATCHA_MATCH_COUNTER_H
+#define MATCHA_MATCH_COUNTER_H
+
+#include <cstdint>
+#include <tuple>
+#include <unordered_map>
+#include <utility>
+#include <vector>
+
+#include <pybind11/numpy.h>
+
+#include "Matcher.h"
+
+namespace py = pybind11;
+
+using std::uint64_t;
+using std::vector;
+
+typedef py::array_t<uint64_t, py::array::c_style | py::array::forcecast> ResultArray;
+
+// Streaming counts of match results for one barcode: reads per best match index (with a final bin for
+// unmatched reads), and a joint histogram of best and second-best match distances.
+// Match counts are dense, so matchers with more than max_match_indexes indexes (such as CombinatorialMatchers
+// with many rounds) are rejected
+class MatchCounter {
+private:
+    vector<uint64_t> match_counts;
+    vector<uint64_t> dist_counts; // (max_dist+1)^2 bins, indexed by dist * (max_dist+1) + second_best_dist
+public:
+    static const size_t max_match_indexes = 1 << 24; // 128MB of counts
+
+    MatchCounter(const Matcher &matcher);
+    // Count n results. mask is optional, and if given only reads with mask[i] set are counted
+    void add(const uint64_t *matches, const uint64_t *quals, size_t n, const uint8_t *mask = nullptr);
+    void add_results(ResultArray results); // Count a (2, n) result array, as from Matcher.match_all
+    py::array_t<uint64_t> get_match_counts() const;
+    py::array_t<uint64_t> get_dist_counts() const; // (max_dist+1, max_dist+1) array of [dist, second_best_dist]
+};
+
+// Streaming sparse counts of reads for each pair of best match indexes between two barcodes (e.g. cell x feature)
+class JointCounter {
+private:
+    struct PairHash {
+        size_t operator()(const std::pair<uint64_t, uint64_t> &p) const {
+            return std::hash<uint64_t>()(p.first * 0x9E3779B97F4A7C15ULL ^ p.second);
+        }
+    };
+    std::unordered_map<std::pair<uint64_t, uint64_t>, uint64_t, PairHash> counts; // Key is (match_a, match_b)
+public:
+    void add(const uint64_t *matches_a, const uint64_t *matches_b, size_t n, const uint8_t *mask = nullptr);
+    void add_results(ResultArray results_a, ResultArray results_b, py::object mask = py::none());
+    // Arrays of (match_a, match_b, count) for each pair seen, sorted by match_a then match_b. Unmatched is 2^64-1
+    std::tuple<py::array_t<uint64_t>, py::array_t<uint64_t>, py::array_t<uint64_t>> get_counts() const;
+};
+
+#endif // MATCHA_MATCH_COUNTER_H
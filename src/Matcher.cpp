@@ -1,24 +1,149 @@
 #include "Matcher.h"
 
-void Matcher::add_sequences(vector<string> new_sequences) {
+#include <chrono>
+#include <cstring>
+
+#include "GzipReader.h"
+
+void Matcher::add_sequence_string(const char *s, size_t len) {
+    if (k == 0)
+        k = len;
+    else if (k != len)
+        throw runtime_error("Sequence " + string(s, len) + " does not match size");
+
+    if (k > 32) {
+        vector<uint64_t> seq(sequence_words()), flags(sequence_words());
+        stringToBinaryWords(s, k, seq.data(), flags.data());
+        for (uint64_t f : flags) {
+            if (f) throw runtime_error("Sequence " + string(s, len) + " has N's");
+        }
+        add_wide_sequence(seq.data());
+        return;
+    }
     uint64_t flag = 0;
+    uint64_t seq = stringToBinary(s, len, flag);
+    if (flag) throw runtime_error("Sequence " + string(s, len) + " has N's");
+
+    add_sequence(seq);
+}
+
+void Matcher::add_sequences(vector<string> new_sequences) {
+    for (const string &s : new_sequences) {
+        add_sequence_string(s.c_str(), s.size());
+    }
+    build_index();
+}
 
-    for (string s : new_sequences) {
-        if (k == 0)
-            k = s.size();
-        else if (k != s.size())
-            throw runtime_error("Sequence " + s + " does not match size");
+void Matcher::add_sequences_file(string path, bool read_labels) {
+    GzipReader reader(path, 1);
+    vector<char> buf(1 << 20);
+    size_t filled = 0;
+    StringArena file_labels;
+    bool labeled = false;
+    auto add_line = [&](const char *line, size_t len) {
+        if (len > 0 && line[len - 1] == '\r') len--;
+        const char *tab = (const char *) memchr(line, '\t', len);
+        size_t seq_len = tab == nullptr ? len : tab - line;
+        if (seq_len == 0) return;
+        add_sequence_string(line, seq_len);
+        if (!read_labels) return;
+        if (tab == nullptr) {
+            file_labels.push_back(line, seq_len);
+            return;
+        }
+        labeled = true;
+        const char *label = tab + 1;
+        const char *label_end = (const char *) memchr(label, '\t', line + len - label);
+        file_labels.push_back(label, label_end == nullptr ? line + len - label : label_end - label);
+    };
+    while (true) {
+        if (filled == buf.size()) buf.resize(buf.size() * 2); // Line longer than the buffer
+        size_t n = reader.read(buf.data() + filled, buf.size() - filled);
+        if (n == 0) break;
+        filled += n;
+        // Add each complete line, and move any partial line to the start of the buffer
+        const char *begin = buf.data(), *end = buf.data() + filled;
+        while (const char *newline = (const char *) memchr(begin, '\n', end - begin)) {
+            add_line(begin, newline - begin);
+            begin = newline + 1;
+        }
+        filled = end - begin;
+        std::memmove(buf.data(), begin, filled);
+    }
+    if (filled > 0) add_line(buf.data(), filled);
+    if (size() == 0) throw invalid_argument("No sequences in whitelist file: " + path);
+    if (labeled) labels.append(file_labels, 0, file_labels.size());
+    build_index();
+}
 
-        uint64_t seq = stringToBinary(s, flag);
-        if (flag) throw runtime_error("Sequence " + s + " has N's");
+void Matcher::add_encoded_sequences(py::array_t<uint64_t, py::array::c_style | py::array::forcecast> seqs, size_t length) {
+    size_t words = binary_words(length);
+    if (length == 0) throw invalid_argument("Sequence length must be positive");
+    if (k != 0 && k != length) throw invalid_argument("Sequence length does not match existing sequences");
+    if (words == 1 ? seqs.ndim() != 1 : seqs.ndim() != 2 || (size_t) seqs.shape(1) != words) {
+        throw invalid_argument("Encoded sequences must have shape (n,) for sequences of at most 32 bases, or (n, words) for longer sequences");
+    }
+    const uint64_t *data = seqs.data();
+    size_t n = seqs.shape(0);
+    // Bits past the end of the sequence in its last word must be unset
+    size_t last_bases = length - 32 * (words - 1);
+    uint64_t unused = last_bases == 32 ? 0 : ~(((uint64_t) 1 << (2 * last_bases)) - 1);
 
-        add_sequence(seq);
+    py::gil_scoped_release release;
+    // Check every sequence before adding any, so invalid input leaves the matcher unchanged
+    for (size_t i = 0; i < n; i++) {
+        if (data[i * words + words - 1] & unused) {
+            throw invalid_argument("Encoded sequence " + std::to_string(i) + " has bits set past the sequence length");
+        }
+    }
+    k = length;
+    for (size_t i = 0; i < n; i++) {
+        const uint64_t *seq = data + i * words;
+        if (words == 1) add_sequence(*seq);
+        else add_wide_sequence(seq);
     }
+    build_index();
+}
+
+size_t Matcher::memory_usage() {
+    return sequences.memory_usage() + labels.data.capacity() + labels.offsets.capacity() * sizeof(uint64_t);
+}
+
+void Matcher::save_sequences(IndexWriter &w) {
+    w.value<uint64_t>(k);
+    w.array(sequences.data(), sequences.size());
+
+    w.array(labels.offsets.data(), labels.offsets.size());
+    w.array(labels.data.data(), labels.data.size());
+}
+
+void Matcher::load_sequences(IndexReader &r) {
+    k = r.value<uint64_t>();
+    sequences = r.array<uint64_t>();
+    if (k == 0 || k > UINT32_MAX || sequences.size() % sequence_words() != 0) throw runtime_error("Corrupt index file");
+    
+    auto offsets = r.array<uint64_t>();
+    auto data = r.array<char>();
+    // Labels are either absent or given for every sequence, with increasing offsets into the label data
+    bool valid = !offsets.empty() && offsets[0] == 0 && offsets[offsets.size() - 1] <= data.size() &&
+        (offsets.size() == 1 || offsets.size() == size() + 1);
+    for (size_t i = 1; valid && i < offsets.size(); i++) valid = offsets[i - 1] <= offsets[i];
+    if (!valid) throw runtime_error("Corrupt index file");
+    labels.offsets.assign(offsets.begin(), offsets.end());
+    labels.data.assign(data.begin(), data.end());
 }
 
 vector<string> Matcher::get_sequences() {
     vector<string> ret;
-    ret.reserve(sequences.size());
+    size_t words = sequence_words();
+    ret.reserve(size());
+    if (words > 1) {
+        vector<uint64_t> flags(words, 0);
+        for (size_t i = 0; i < size(); i++) {
+            ret.push_back(binaryWordsToString(sequences.data() + i*words, k, flags.data()));
+        }
+        return ret;
+    }
     for (uint64_t seq : sequences) {
         ret.push_back(binaryToString(seq, k, 0));
     }
@@ -26,56 +151,171 @@ vector<string> Matcher::get_sequences() {
 }
 
 
-void Matcher::_matchAll(const vector<string> &strings, const size_t start, const size_t end, uint64_t *out) {
+void Matcher::_matchAll(const StringColumn &strings, const size_t start, const size_t end, uint64_t *out_match, uint64_t *out_qual, size_t threads) {
     size_t n = strings.size();
 
     size_t len = end - start;
-    for (size_t i = 0; i < strings.size(); i++) {
-        uint64_t flag = 0;
-        uint64_t seq = stringToBinary(strings[i].c_str() + start, len, flag);
-        uint64_t qual = 0;
-        uint64_t match_idx = match(seq, flag, qual);
-        out[i] = match_idx;
-        out[n + i] = qual;
-    } 
+    size_t words = binary_words(len);
+    if (words > 1) {
+        if (words != sequence_words()) throw invalid_argument("Match window is longer than the barcodes");
+        parallel_for(n, threads, [&](size_t begin, size_t finish) {
+            vector<uint64_t> seqs(match_block_size * words), flags(match_block_size * words);
+            for (size_t block = begin; block < finish; block += match_block_size) {
+                size_t count = std::min(match_block_size, finish - block);
+                for (size_t i = 0; i < count; i++) {
+                    strings.encode_words(block + i, start, len, &seqs[i*words], &flags[i*words]);
+                }
+                match_wide_block(seqs.data(), flags.data(), count, out_match + block, out_qual + block);
+            }
+        });
+        return;
+    }
+    parallel_for(n, threads, [&](size_t begin, size_t finish) {
+        uint64_t seqs[match_block_size], flags[match_block_size];
+        for (size_t block = begin; block < finish; block += match_block_size) {
+            size_t count = std::min(match_block_size, finish - block);
+            for (size_t i = 0; i < count; i++) {
+                flags[i] = 0;
+                seqs[i] = strings.encode(block + i, start, len, flags[i]);
+            }
+            match_block(seqs, flags, count, out_match + block, out_qual + block);
+        }
+    });
 }
 
-py::array_t<uint64_t> Matcher::matchAll(vector<string> strings, const size_t start, const size_t end) {
-    size_t n = strings.size();
+void Matcher::match_block(const uint64_t *seqs, const uint64_t *flags, size_t n, uint64_t *out_match, uint64_t *out_qual) {
+    for (size_t i = 0; i < n; i++) {
+        out_match[i] = match(seqs[i], flags[i], out_qual[i]);
+    }
+}
+
+py::array_t<uint64_t> Matcher::matchAll(vector<string> strings, const size_t start, const size_t end, size_t threads, py::object out) {
+    StringArena arena;
+    for (const string &s : strings) arena.push_back(s);
+    return matchAll(arena.column(), start, end, threads, out);
+}
+
+py::array_t<uint64_t> Matcher::matchFixed(py::buffer strings, size_t char_size, const size_t start, const size_t end, size_t threads, py::object out) {
+    py::buffer_info info = strings.request();
+    if (info.ndim != 1) throw invalid_argument("Fixed width strings must be a 1-dimensional array");
+    if (char_size != 1 && char_size != 4) throw invalid_argument("char_size must be 1 or 4");
+    if (info.itemsize % char_size != 0 || (info.shape[0] > 1 && info.strides[0] < info.itemsize)) {
+        throw invalid_argument("Fixed width strings have invalid item size or stride");
+    }
+    StringColumn column{(const char *) info.ptr, nullptr, (size_t) info.shape[0]};
+    column.width = info.itemsize;
+    column.stride = info.strides[0];
+    column.char_size = char_size;
+    return matchAll(column, start, end, threads, out);
+}
+
+py::array_t<uint64_t> Matcher::matchArrow(py::buffer offsets, size_t offset_size, py::buffer data, py::object validity, size_t array_offset, size_t n,
+        const size_t start, const size_t end, size_t threads, py::object out) {
+    py::buffer_info offsets_info = offsets.request();
+    py::buffer_info data_info = data.request();
+    if (offset_size != 4 && offset_size != 8) throw invalid_argument("offset_size must be 4 or 8");
+    if ((size_t) offsets_info.size * offsets_info.itemsize < (array_offset + n + 1) * offset_size) {
+        throw invalid_argument("Arrow offsets buffer is too small");
+    }
     
-    uint64_t *out = new uint64_t[n*2];
+    StringColumn column{(const char *) data_info.ptr, nullptr, n};
+    int64_t last_offset;
+    if (offset_size == 4) {
+        column.offsets32 = (const int32_t *) offsets_info.ptr + array_offset;
+        last_offset = column.offsets32[n];
+    } else {
+        column.offsets = (const uint64_t *) offsets_info.ptr + array_offset;
+        last_offset = column.offsets[n];
+    }
+    if (last_offset < 0 || last_offset > (int64_t) (data_info.size * data_info.itemsize)) {
+        throw invalid_argument("Arrow offsets are past the end of the data buffer");
+    }
 
-    py::capsule free_when_done(out, [](void *f) {
-      auto mem = reinterpret_cast<uint64_t *>(f);
-      delete mem;
-    });
+    py::buffer_info validity_info;
+    if (!validity.is_none()) {
+        validity_info = validity.cast<py::buffer>().request();
+        if ((size_t) validity_info.size * validity_info.itemsize < (array_offset + n + 7) / 8) {
+            throw invalid_argument("Arrow validity buffer is too small");
+        }
+        column.validity = (const uint8_t *) validity_info.ptr;
+        column.validity_offset = array_offset;
+    }
+    return matchAll(column, start, end, threads, out);
+}
+
+py::array_t<uint64_t> Matcher::matchAll(const StringColumn &strings, const size_t start, const size_t end, size_t threads, py::object out) {
+    size_t n = strings.size();
+    py::array_t<uint64_t> result;
+    if (out.is_none()) {
+        result = py::array_t<uint64_t>({(size_t) 2, n});
+    } else {
+        // Output can be a column slice of a larger array, as long as each row is contiguous
+        if (!py::isinstance<py::array_t<uint64_t>>(out)) throw invalid_argument("out must be a uint64 array");
+        result = out.cast<py::array_t<uint64_t>>();
+        if (result.ndim() != 2 || result.shape(0) != 2 || (size_t) result.shape(1) != n) {
+            throw invalid_argument("out must have shape (2, " + std::to_string(n) + ")");
+        }
+        if (n > 1 && result.strides(1) != sizeof(uint64_t)) throw invalid_argument("out rows must be contiguous");
+    }
+    // Row pointers from the row stride, since indexed access is bounds-checked and fails for empty input
+    uint64_t *out_match = result.mutable_data();
+    uint64_t *out_qual = out_match + result.strides(0) / sizeof(uint64_t);
 
     // Allow the work to run in parallel
-    py::gil_scoped_release release;
-    Matcher::_matchAll(strings, start, end, out);
-    py::gil_scoped_acquire acquire;    
-    
-    // Create numpy array that takes ownership of the data buffer
-    py::array_t<uint64_t, py::array::c_style> result({(size_t) 2,  strings.size()}, out, free_when_done);
+    {
+        py::gil_scoped_release release;
+        _matchAll(strings, start, end, out_match, out_qual, threads);
+    }
     return result;
 }
 
-void Matcher::matchRaw(py::array_t<uint64_t> seqs, py::array_t<uint64_t> output) {
+void Matcher::matchRaw(py::array_t<uint64_t> seqs, py::array_t<uint64_t> output, size_t threads) {
     if (seqs.ndim() != 2 || output.ndim() != 2) throw runtime_error("Seqs and output must have ndim == 2");
     if (seqs.shape(1) != output.shape(1)) throw runtime_error("Seqs and output must have same number of columns");
     if (seqs.shape(0) != 2 || output.shape(0) != 2) throw runtime_error("Seqs and output must have 2 rows each");
 
     auto seq = seqs.unchecked<2>();
     auto res = output.mutable_unchecked<2>();
-    for (auto i = 0; i < seq.shape(1); i++) {
-        uint64_t qual = 0;
-        res(0,i) = match(seq(0,i), seq(1,i), qual);
-        res(1,i) = qual;
-    }
+
+    py::gil_scoped_release release;
+    parallel_for(seq.shape(1), threads, [&](size_t begin, size_t end) {
+        uint64_t seqs[match_block_size], flags[match_block_size], matches[match_block_size], quals[match_block_size];
+        for (size_t block = begin; block < end; block += match_block_size) {
+            size_t count = std::min(match_block_size, end - block);
+            for (size_t i = 0; i < count; i++) {
+                seqs[i] = seq(0, block + i);
+                flags[i] = seq(1, block + i);
+            }
+            match_block(seqs, flags, count, matches, quals);
+            for (size_t i = 0; i < count; i++) {
+                res(0, block + i) = matches[i];
+                res(1, block + i) = quals[i];
+            }
+        }
+    });
+}
+
+double Matcher::benchmark(vector<string> strings, const size_t start, const size_t end, size_t threads, double min_seconds) {
+    if (strings.empty()) throw invalid_argument("No sequences to benchmark");
+    StringArena arena;
+    for (const string &s : strings) arena.push_back(s);
+    StringColumn column = arena.column();
+    vector<uint64_t> out_match(strings.size()), out_qual(strings.size());
+
+    py::gil_scoped_release release;
+    auto begin = std::chrono::steady_clock::now();
+    size_t rounds = 0;
+    double elapsed;
+    do {
+        _matchAll(column, start, end, out_match.data(), out_qual.data(), threads);
+        rounds++;
+        elapsed = std::chrono::duration<double>(std::chrono::steady_clock::now() - begin).count();
+    } while (elapsed < min_seconds);
+    return rounds * strings.size() / elapsed;
 }
 
 bool Matcher::has_labels() {
-    return labels.size() == sequences.size();
+    return labels.size() == size();
 }
 
 void Matcher::add_label(string label) {
@@ -83,19 +323,72 @@ void Matcher::add_label(string label) {
 }
 
 void Matcher::add_labels(vector<string> new_labels) {
+    if (labels.size() + new_labels.size() != size()) {
+        throw invalid_argument("Got " + std::to_string(labels.size() + new_labels.size()) + " labels for " +
+            std::to_string(size()) + " sequences");
+    }
     for (string l : new_labels) {
         add_label(l);
     }
 }
 
 string Matcher::get_label(uint64_t index) {
-    return labels[index];
+    if (index >= size()) throw std::out_of_range("Label index out of range: " + std::to_string(index));
+    vector<char> out;
+    append_label(out, index);
+    return string(out.begin(), out.end());
 }
 
 vector<string> Matcher::get_labels(vector<uint64_t> indexes) {
     vector<string> ret;
+    ret.reserve(indexes.size());
     for (auto i : indexes) {
-        ret.push_back(get_label(i));
+        ret.push_back(i == (uint64_t) -1 ? string() : get_label(i));
     }
     return ret;
-}
\ No newline at end of file
+}
+
+StringArena Matcher::label_strings() const {
+    StringArena ret;
+    vector<char> label;
+    for (size_t i = 0; i < size(); i++) {
+        label.clear();
+        append_label(label, i);
+        ret.push_back(label.data(), label.size());
+    }
+    return ret;
+}
+
+std::pair<vector<uint64_t>, vector<string>> Matcher::find_labels(vector<string> wanted) const {
+    std::unordered_map<string, bool> found; // Requested label -> whether any index has it
+    for (const string &l : wanted) found.emplace(l, false);
+    std::pair<vector<uint64_t>, vector<string>> ret;
+    vector<char> label;
+    string key;
+    for (size_t i = 0; i < size(); i++) {
+        label.clear();
+        append_label(label, i);
+        key.assign(label.data(), label.size());
+        auto it = found.find(key);
+        if (it == found.end()) continue;
+        it->second = true;
+        ret.first.push_back(i);
+    }
+    for (const string &l : wanted) {
+        auto it = found.find(l);
+        if (!it->second) {
+            ret.second.push_back(l);
+            it->second = true; // Report repeated labels once
+        }
+    }
+    return ret;
+}
+
+void Matcher::append_sequence(vector<char> &out, uint64_t index) const {
+    static const char bases[4] = {'A', 'C', 'G', 'T'};
+    size_t words = sequence_words();
+    const uint64_t *seq = sequences.data() + index * words;
+    for (size_t i = 0; i < k; i++) {
+        out.push_back(bases[seq[i / 32] >> (2 * (i % 32)) & 3]);
+    }
+}
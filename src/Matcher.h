@@ -7,12 +7,16 @@
 #include <string>
 #include <stdexcept>
 #include <unordered_map>
+#include <utility>
 #include <vector>
 
 #include <pybind11/stl.h>
 #include <pybind11/numpy.h>
 
 #include "BinaryConverter.h"
+#include "MappedFile.h"
+#include "StringArena.h"
+#include "ThreadPool.h"
 
 
 
@@ -23,29 +27,79 @@ using std::string;
 using std::vector;
 using std::unordered_map;
 using std::runtime_error;
+using std::invalid_argument;
 
 class Matcher {
 protected: 
     size_t k = 0; // Length of barcode
-    vector<uint64_t> sequences; // List of barcode sequences
-    vector<string> labels; // (optional) List of names for sequences (same order as sequences vector)
+    MappedArray<uint64_t> sequences; // List of barcode sequences
+    // (optional) Names for sequences (same order as sequences vector), stored contiguously. If no labels are added,
+    // each sequence is labeled by itself, decoded from its binary encoding when needed
+    StringArena labels;
+
+    void add_sequence_string(const char *s, size_t len); // Encode and add one barcode sequence, checking its length and for N's
+    void save_sequences(IndexWriter &w); // Write sequence length, sequences, and labels to an index file
+    void load_sequences(IndexReader &r);
 public:
     virtual ~Matcher() {}
     void add_sequences(vector<string> sequences); // Add all sequences to matcher
+    // Add all sequences from a plain or gzipped text file with one sequence per line, and an optional tab-separated label.
+    // With read_labels, each sequence is labeled by its label column, or by the sequence itself where there is none.
+    // Labels are only stored if some line has a label column
+    void add_sequences_file(string path, bool read_labels = true);
+    // Add sequences of the given length already in binary encoding, with shape (n,) or (n, binary_words(length))
+    void add_encoded_sequences(py::array_t<uint64_t, py::array::c_style | py::array::forcecast> seqs, size_t length);
     vector<string> get_sequences(); // Get list of sequences in matcher
-    py::array_t<uint64_t> matchAll(vector<string> strings, const size_t start, const size_t end); // Match all sequences in a list
-    void matchRaw(py::array_t<uint64_t> seqs, py::array_t<uint64_t> output); // Used for benchmarking
+    size_t sequence_length() {return k;}
+    // Bases in each query window passed to match. Longer than sequence_length for matchers that allow insertions
+    virtual size_t query_length() const {return k;}
+    size_t sequence_words() const {return binary_words(k);} // Words per encoded barcode sequence (1 for barcodes of at most 32 bases)
+    virtual size_t size() const {return sequences.size() / sequence_words();} // Number of barcode sequences (valid match indexes)
+    // Match all sequences, returning a (2, n) array of match indexes and quals.
+    // If out is given, results are written to it and it is returned. It must be a (2, n) uint64 array with contiguous rows
+    py::array_t<uint64_t> matchAll(vector<string> strings, const size_t start, const size_t end, size_t threads = 1, py::object out = py::none()); // Match all sequences in a list
+    py::array_t<uint64_t> matchAll(const StringColumn &strings, const size_t start, const size_t end, size_t threads = 1, py::object out = py::none()); // Match all sequences in a column
+    // Match a 1-dimensional array of fixed width strings in place. char_size is 1 for bytes (NumPy S) or 4 for UCS4 (NumPy U)
+    py::array_t<uint64_t> matchFixed(py::buffer strings, size_t char_size, const size_t start, const size_t end, size_t threads = 1, py::object out = py::none());
+    // Match an Arrow string (offset_size 4) or large_string (offset_size 8) array in place, given its buffers
+    py::array_t<uint64_t> matchArrow(py::buffer offsets, size_t offset_size, py::buffer data, py::object validity, size_t array_offset, size_t n,
+        const size_t start, const size_t end, size_t threads = 1, py::object out = py::none());
+    void matchRaw(py::array_t<uint64_t> seqs, py::array_t<uint64_t> output, size_t threads = 1); // Used for benchmarking
+    // Match strings repeatedly for at least min_seconds (and at least once), returning queries matched per second
+    double benchmark(vector<string> strings, const size_t start, const size_t end, size_t threads = 1, double min_seconds = 0.1);
 
-    bool has_labels();
+    bool has_labels(); // True if labels were added for all sequences, rather than decoded from the sequences
     void add_label(string label);
-    void add_labels(vector<string> label);
+    void add_labels(vector<string> label); // Throws unless this gives every sequence a label
     string get_label(uint64_t index);
-    vector<string> get_labels(vector<uint64_t> indexes);
+    vector<string> get_labels(vector<uint64_t> indexes); // Labels of match indexes, with empty labels for unmatched (-1)
+    StringArena label_strings() const; // Labels of all match indexes, for setting up outputs per label
+    // Match indexes whose label is one of the given labels in increasing order, and the given labels that no index has
+    std::pair<vector<uint64_t>, vector<string>> find_labels(vector<string> labels) const;
+    // Append the label of match index to out, or nothing if there is no label. Called while writing output records
+    virtual void append_label(vector<char> &out, uint64_t index) const {
+        if (index < labels.size()) out.insert(out.end(), labels.get(index), labels.get(index) + labels.length(index));
+        else if (labels.size() == 0 && index < size()) append_sequence(out, index);
+    }
+    void append_sequence(vector<char> &out, uint64_t index) const; // Append the decoded sequence of match index to out
 
     virtual void add_sequence(uint64_t seq) {throw runtime_error("Not Implemented");}; // Add barcode sequence to match against
+    // Add a barcode sequence longer than 32 bases, encoded in sequence_words() words
+    virtual void add_wide_sequence(const uint64_t *seq) {throw runtime_error("Barcodes longer than 32 bases are not supported by this matcher");}
+    virtual void build_index() {}; // Called after add_sequences to (re)build any lookup structures
+    virtual size_t memory_usage(); // Bytes of memory used by sequences, labels, and indexes
     virtual uint64_t match(uint64_t seq, uint64_t flag, uint64_t &qual) {throw runtime_error("Not Implemented");}; // Return the index of closest matching barcode to seq + quality
-private:
-    void _matchAll(const vector<string> &strings, const size_t start, const size_t end, uint64_t *out); //Inner worker for matchAll, safe without holding GIL
+    // Match a block of n sequences, giving the same output as calling match on each. Override for batched implementations
+    virtual void match_block(const uint64_t *seqs, const uint64_t *flags, size_t n, uint64_t *out_match, uint64_t *out_qual);
+    // False for matchers that only match whole string columns in _matchAll, and so can't be wrapped by matchers that call match_block
+    virtual bool has_match_block() const {return true;}
+    // Match a block of n sequences longer than 32 bases, where sequence i is in words [i*sequence_words(), (i+1)*sequence_words())
+    // of seqs and flags. Used instead of match_block when sequence_words() > 1
+    virtual void match_wide_block(const uint64_t *seqs, const uint64_t *flags, size_t n, uint64_t *out_match, uint64_t *out_qual) {
+        throw runtime_error("Barcodes longer than 32 bases are not supported by this matcher");
+    }
+
+    virtual void _matchAll(const StringColumn &strings, const size_t start, const size_t end, uint64_t *out_match, uint64_t *out_qual, size_t threads); //Inner worker for matchAll, safe without holding GIL
 };
 
 
@@ -59,7 +113,17 @@ inline uint64_t hammingDistance(uint64_t seq, uint64_t flag, uint64_t barcode) {
     return mismatches;
 }
 
+// Hamming distance between multi-word seq+flag and barcode, one word (32 bases) at a time
+inline uint64_t hammingDistanceWords(const uint64_t *seq, const uint64_t *flag, const uint64_t *barcode, size_t words) {
+    uint64_t mismatches = 0;
+    for (size_t w = 0; w < words; w++) {
+        mismatches += hammingDistance(seq[w], flag[w], barcode[w]);
+    }
+    return mismatches;
+}
+
 const uint dist_bits = 6;
+const size_t match_block_size = 256; // Number of sequences passed to each Matcher::match_block call
 const uint max_dist = (1 << dist_bits) - 1;
 
 #endif // MATCHA_MATCHER_H
\ No newline at end of file
@@ -0,0 +1,217 @@
+#include "Pipeline.h"
+
+#include <chrono>
+#include <thread>
+
+using namespace std;
+
+typedef chrono::steady_clock Clock;
+
+static double seconds_since(Clock::time_point start) {
+    return chrono::duration<double>(Clock::now() - start).count();
+}
+
+// One chunk from every input file, plus match results and filter mask
+struct Pipeline::Batch {
+    vector<shared_ptr<FastqChunk>> chunks; // One per input file
+    size_t size = 0;
+    vector<uint64_t> results; // Per barcode b: size match indexes at [2*b*size], then size quals
+    vector<uint8_t> mask;
+    size_t passed = 0;
+
+    const uint64_t *matches(size_t b) const {return results.data() + 2*b*size;}
+    const uint64_t *quals(size_t b) const {return results.data() + (2*b + 1)*size;}
+};
+
+Pipeline::Pipeline(vector<FastqFile *> files, size_t chunk_size, size_t queue_depth) : 
+        files(files), chunk_size(chunk_size), queue_depth(queue_depth) {
+    if (files.empty()) throw invalid_argument("Pipeline needs at least one input file");
+    if (chunk_size == 0) throw invalid_argument("chunk_size must be positive");
+}
+
+void Pipeline::add_barcode(string name, Matcher *matcher, size_t file, size_t start, size_t end, size_t threads, int output_field) {
+    if (file >= files.size()) throw invalid_argument("Invalid file index for barcode " + name);
+    if (matcher == nullptr) throw invalid_argument("Missing matcher for barcode " + name);
+    barcodes.push_back(Barcode{name, matcher, file, start, end, nullptr, 0, 0, threads, output_field});
+}
+
+void Pipeline::add_dual_barcode(string name, DualIndexMatcher *matcher, size_t i7_file, size_t i7_start, size_t i5_file, size_t i5_start,
+        size_t threads, int output_field) {
+    if (i7_file >= files.size() || i5_file >= files.size()) throw invalid_argument("Invalid file index for barcode " + name);
+    if (matcher == nullptr) throw invalid_argument("Missing matcher for barcode " + name);
+    barcodes.push_back(Barcode{name, matcher, i7_file, i7_start, i7_start + matcher->i7_sequence_length(), 
+        matcher, i5_file, i5_start, threads, output_field});
+}
+
+void Pipeline::set_filter(const ReadFilter &f) {
+    if (f.barcode_count() > barcodes.size()) throw invalid_argument("Filter refers to a missing barcode");
+    filter = f;
+}
+
+void Pipeline::add_counter(size_t barcode, MatchCounter *counter) {
+    if (barcode >= barcodes.size() || counter == nullptr) throw invalid_argument("Invalid barcode for counter");
+    counters.push_back(Counter{barcode, counter});
+}
+
+void Pipeline::add_joint_counter(size_t barcode_a, size_t barcode_b, JointCounter *counter) {
+    if (barcode_a >= barcodes.size() || barcode_b >= barcodes.size() || counter == nullptr) {
+        throw invalid_argument("Invalid barcodes for joint counter");
+    }
+    joint_counters.push_back(JointCount{barcode_a, barcode_b, counter});
+}
+
+void Pipeline::add_umi_counter(size_t cell_barcode, size_t feature_barcode, size_t file, UmiCounter *counter) {
+    if (cell_barcode >= barcodes.size() || feature_barcode >= barcodes.size() || file >= files.size() || counter == nullptr) {
+        throw invalid_argument("Invalid barcodes or file for UMI counter");
+    }
+    umi_counters.push_back(UmiCount{cell_barcode, feature_barcode, file, counter});
+}
+
+py::dict Pipeline::run() {
+    // Output name patterns refer to barcodes by field index
+    size_t field_count = 0;
+    for (const Barcode &b : barcodes) field_count = max(field_count, (size_t) (b.output_field + 1));
+    vector<const Matcher *> field_matchers(field_count, nullptr);
+    for (const Barcode &b : barcodes) {
+        if (b.output_field >= 0) field_matchers[b.output_field] = b.matcher;
+    }
+    for (FastqFile *f : files) {
+        for (int field : f->required_fields()) {
+            if (f->has_output() && ((size_t) field >= field_count || field_matchers[field] == nullptr)) {
+                throw invalid_argument("Missing barcode for output name field " + std::to_string(field));
+            }
+        }
+    }
+
+    size_t reads = 0, reads_passed = 0, chunks = 0;
+    double read_seconds = 0, match_seconds = 0, write_seconds = 0;
+    vector<vector<uint64_t>> dist_counts(barcodes.size(), vector<uint64_t>(max_dist + 1, 0));
+    Clock::time_point start_time = Clock::now();
+
+    {
+        py::gil_scoped_release release;
+        BoundedQueue<shared_ptr<Batch>> to_match(queue_depth), to_write(queue_depth);
+        mutex error_lock;
+        exception_ptr error;
+        auto fail = [&]() {
+            {
+                lock_guard<mutex> l(error_lock);
+                if (!error) error = current_exception();
+            }
+            to_match.close();
+            to_write.close();
+        };
+
+        thread reader([&]() {
+            try {
+                while (true) {
+                    Clock::time_point t = Clock::now();
+                    auto batch = make_shared<Batch>();
+                    for (size_t i = 0; i < files.size(); i++) {
+                        batch->chunks.push_back(files[i]->next_chunk(chunk_size));
+                        if (batch->chunks[i]->size() != batch->chunks[0]->size()) {
+                            throw runtime_error("Unequal number of records read from input fastq files");
+                        }
+                    }
+                    batch->size = batch->chunks[0]->size();
+                    read_seconds += seconds_since(t);
+                    if (batch->size == 0 || !to_match.push(batch)) break;
+                }
+            } catch (...) {
+                fail();
+            }
+            to_match.close();
+        });
+
+        thread matcher([&]() {
+            try {
+                shared_ptr<Batch> batch;
+                while (to_match.pop(batch)) {
+                    Clock::time_point t = Clock::now();
+                    size_t n = batch->size;
+                    batch->results.resize(2 * n * barcodes.size());
+                    vector<ReadFilter::BarcodeResults> results;
+                    for (size_t b = 0; b < barcodes.size(); b++) {
+                        const Barcode &bc = barcodes[b];
+                        uint64_t *out = batch->results.data() + 2*b*n;
+                        if (bc.dual != nullptr) {
+                            bc.dual->match_columns(batch->chunks[bc.file]->seq.column(), bc.start, 
+                                batch->chunks[bc.i5_file]->seq.column(), bc.i5_start, out, out + n, bc.threads);
+                        } else {
+                            bc.matcher->_matchAll(batch->chunks[bc.file]->seq.column(), bc.start, bc.end, out, out + n, bc.threads);
+                        }
+                        results.push_back(ReadFilter::BarcodeResults{batch->matches(b), batch->quals(b), 
+                            &batch->chunks[bc.file]->qual, bc.start, bc.end});
+                        for (size_t i = 0; i < n; i++) dist_counts[b][results[b].quals[i] & max_dist]++;
+                    }
+                    batch->mask.resize(n);
+                    batch->passed = filter.apply(n, results, batch->mask.data());
+                    for (const Counter &c : counters) {
+                        c.counter->add(batch->matches(c.barcode), batch->quals(c.barcode), n);
+                    }
+                    for (const JointCount &c : joint_counters) {
+                        c.counter->add(batch->matches(c.barcode_a), batch->matches(c.barcode_b), n, batch->mask.data());
+                    }
+                    for (const UmiCount &c : umi_counters) {
+                        c.counter->add(batch->matches(c.cell_barcode), batch->matches(c.feature_barcode), 
+                            batch->chunks[c.file]->seq.column(), n, batch->mask.data());
+                    }
+                    match_seconds += seconds_since(t);
+                    if (!to_write.push(batch)) break;
+                }
+            } catch (...) {
+                fail();
+            }
+            to_write.close();
+        });
+
+        try {
+            shared_ptr<Batch> batch;
+            vector<const uint64_t *> field_matches(field_count, nullptr);
+            while (to_write.pop(batch)) {
+                Clock::time_point t = Clock::now();
+                for (const Barcode &b : barcodes) {
+                    if (b.output_field >= 0) field_matches[b.output_field] = batch->matches(&b - barcodes.data());
+                }
+                for (size_t i = 0; i < files.size(); i++) {
+                    files[i]->write_records(*batch->chunks[i], batch->mask.data(), batch->size, field_matchers, field_matches);
+                    files[i]->release_chunk(batch->chunks[i]);
+                }
+                reads += batch->size;
+                reads_passed += batch->passed;
+                chunks++;
+                write_seconds += seconds_since(t);
+            }
+        } catch (...) {
+            fail();
+        }
+        reader.join();
+        matcher.join();
+        if (error) rethrow_exception(error);
+    }
+
+    double seconds = seconds_since(start_time);
+    py::dict stage_seconds;
+    stage_seconds["read"] = read_seconds;
+    stage_seconds["match"] = match_seconds;
+    stage_seconds["write"] = write_seconds;
+
+    py::dict barcode_stats;
+    for (size_t b = 0; b < barcodes.size(); b++) {
+        vector<uint64_t> &counts = dist_counts[b];
+        while (!counts.empty() && counts.back() == 0) counts.pop_back();
+        py::dict d;
+        d["dist_counts"] = counts;
+        barcode_stats[barcodes[b].name.c_str()] = d;
+    }
+
+    py::dict stats;
+    stats["reads"] = reads;
+    stats["reads_passed"] = reads_passed;
+    stats["chunks"] = chunks;
+    stats["seconds"] = seconds;
+    stats["reads_per_second"] = seconds > 0 ? reads / seconds : 0.0;
+    stats["stage_seconds"] = stage_seconds;
+    stats["barcodes"] = barcode_stats;
+    return stats;
+}
@@ -0,0 +1,81 @@
+#ifndef MATCHA_PIPELINE_H
+#define MATCHA_PIPELINE_H
+
+#include <memory>
+#include <string>
+#include <vector>
+
+#include <pybind11/pybind11.h>
+
+#include "FastqFile.h"
+#include "MatchCounter.h"
+#include "DualIndexMatcher.h"
+#include "Matcher.h"
+#include "ReadFilter.h"
+#include "UmiCounter.h"
+
+namespace py = pybind11;
+
+using std::string;
+using std::vector;
+
+// Runs the read -> match -> filter -> write loop entirely in native code. Stages run on their own threads,
+// connected by bounded queues of batches, so reading, matching, and writing of different chunks overlap:
+//   - reader: reads one chunk from every input file
+//   - matcher: matches every barcode (split across each barcode's threads), then evaluates the filter and updates counters
+//   - writer (calling thread): writes passing reads to each output file
+// Files and matchers are held by pointer, and must outlive the pipeline
+class Pipeline {
+private:
+    struct Barcode {
+        string name;
+        Matcher *matcher;
+        size_t file;
+        size_t start, end;
+        DualIndexMatcher *dual; // Set for dual index barcodes, which match i7s in file and i5s in i5_file
+        size_t i5_file, i5_start;
+        size_t threads;
+        int output_field; // Index in the output name pattern, or -1 if unused
+    };
+    struct Counter {
+        size_t barcode;
+        MatchCounter *counter;
+    };
+    struct JointCount {
+        size_t barcode_a, barcode_b;
+        JointCounter *counter;
+    };
+    struct UmiCount {
+        size_t cell_barcode, feature_barcode, file;
+        UmiCounter *counter;
+    };
+    struct Batch; 
+    vector<FastqFile *> files;
+    vector<Barcode> barcodes;
+    vector<Counter> counters;
+    vector<JointCount> joint_counters;
+    vector<UmiCount> umi_counters;
+    ReadFilter filter;
+    size_t chunk_size;
+    size_t queue_depth;
+public:
+    // chunk_size -- Reads per batch
+    // queue_depth -- Max batches waiting between each pair of stages
+    Pipeline(vector<FastqFile *> files, size_t chunk_size, size_t queue_depth = 2);
+    void add_barcode(string name, Matcher *matcher, size_t file, size_t start, size_t end, size_t threads, int output_field);
+    // Add a dual index barcode, matching i7s from i7_file and i5s from i5_file. Filter conditions on min_qual use the i7 bases
+    void add_dual_barcode(string name, DualIndexMatcher *matcher, size_t i7_file, size_t i7_start, size_t i5_file, size_t i5_start,
+        size_t threads, int output_field);
+    void set_filter(const ReadFilter &filter);
+    // Accumulate counts for all reads of a barcode, or joint counts of reads passing the filter for a pair of barcodes.
+    // Counters are held by pointer, and must outlive the pipeline
+    void add_counter(size_t barcode, MatchCounter *counter);
+    void add_joint_counter(size_t barcode_a, size_t barcode_b, JointCounter *counter);
+    // Deduplicate UMIs from input file `file` for reads passing the filter. Counters must outlive the pipeline
+    void add_umi_counter(size_t cell_barcode, size_t feature_barcode, size_t file, UmiCounter *counter);
+    // Run until the inputs are exhausted, and return summary statistics: counts of reads, reads_passed, and chunks,
+    // seconds and reads_per_second, busy seconds of each stage, and per-barcode counts of reads by best match distance
+    py::dict run();
+};
+
+#endif // MATCHA_PIPELINE_H
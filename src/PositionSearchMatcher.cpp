@@ -0,0 +1,129 @@
+#include "PositionSearchMatcher.h"
+
+#include <algorithm>
+#include <limits>
+
+using namespace std;
+
+static const uint64_t unmatched = numeric_limits<uint64_t>::max();
+static const uint64_t max_offset_limit = (1 << 16) - 1;
+// Qual bits kept from the wrapped matcher: everything between second_best_dist and the offset
+static const uint64_t inner_qual_mask = (((uint64_t) 1 << PositionSearchMatcher::offset_shift) - 1) & ~(((uint64_t) 1 << (2*dist_bits)) - 1);
+
+PositionSearchMatcher::PositionSearchMatcher(Matcher *inner, size_t max_offset) : inner(inner), max_offset(max_offset) {
+    if (inner == nullptr) throw invalid_argument("Missing matcher to search with");
+    if (!inner->has_match_block()) {
+        throw invalid_argument("Position search can't wrap a combinatorial or position search matcher");
+    }
+    if (inner->query_length() == 0) throw invalid_argument("Matcher to search with has no sequences");
+    if (inner->sequence_words() > 1) throw invalid_argument("Position search supports barcodes of at most 32 bases");
+    if (max_offset > max_offset_limit) throw invalid_argument("max_offset must be at most " + std::to_string(max_offset_limit));
+    k = max_offset + inner->query_length();
+}
+
+void PositionSearchMatcher::set_anchor(string anchor, long barcode_offset, uint64_t max_anchor_mismatches) {
+    if (anchor.empty() || anchor.size() > 32) throw invalid_argument("Anchor length must be between 1 and 32");
+    uint64_t flag = 0;
+    anchor_seq = stringToBinary(anchor, flag);
+    if (flag) throw invalid_argument("Anchor " + anchor + " has N's");
+    anchor_length = anchor.size();
+    this->barcode_offset = barcode_offset;
+    this->max_anchor_mismatches = max_anchor_mismatches;
+    long barcode_end = barcode_offset + (long) inner->query_length();
+    k = max_offset + std::max((long) anchor_length, barcode_end);
+}
+
+// Slide windows of len bases one base to the right, shifting in the base at position pos of each string
+static void slide_windows(const StringColumn &strings, size_t block, size_t count, size_t pos, size_t len, uint64_t *seqs, uint64_t *flags) {
+    for (size_t i = 0; i < count; i++) {
+        uint64_t flag = 0;
+        uint64_t base = strings.encode(block + i, pos, 1, flag);
+        seqs[i] = seqs[i] >> 2 | base << (2*(len - 1));
+        flags[i] = flags[i] >> 2 | flag << (2*(len - 1));
+    }
+}
+
+void PositionSearchMatcher::match_sliding(const StringColumn &strings, size_t start, size_t block, size_t count, uint64_t *out_match, uint64_t *out_qual) {
+    size_t len = inner->query_length();
+    uint64_t seqs[match_block_size], flags[match_block_size];
+    // Results at offset o are at [o*count, (o+1)*count)
+    vector<uint64_t> matches((max_offset + 1) * count), quals((max_offset + 1) * count);
+    for (size_t i = 0; i < count; i++) {
+        flags[i] = 0;
+        seqs[i] = strings.encode(block + i, start, len, flags[i]);
+    }
+    for (size_t o = 0; o <= max_offset; o++) {
+        if (o > 0) slide_windows(strings, block, count, start + o + len - 1, len, seqs, flags);
+        inner->match_block(seqs, flags, count, &matches[o*count], &quals[o*count]);
+    }
+
+    for (size_t i = 0; i < count; i++) {
+        // Closest match over all offsets, preferring matched results and then the lowest offset
+        size_t best = 0;
+        for (size_t o = 1; o <= max_offset; o++) {
+            bool o_matched = matches[o*count + i] != unmatched, best_matched = matches[best*count + i] != unmatched;
+            if (o_matched != best_matched ? o_matched : (quals[o*count + i] & max_dist) < (quals[best*count + i] & max_dist)) best = o;
+        }
+        uint64_t match = matches[best*count + i], qual = quals[best*count + i];
+        if (match != unmatched) {
+            // Closest other barcode: the best match at offsets where it differs, else the second-best match there
+            uint64_t second = max_dist;
+            for (size_t o = 0; o <= max_offset; o++) {
+                uint64_t q = quals[o*count + i];
+                if (matches[o*count + i] == match) second = std::min(second, q >> dist_bits & max_dist);
+                else if (matches[o*count + i] != unmatched) second = std::min(second, q & max_dist);
+            }
+            qual = (qual & inner_qual_mask) | second << dist_bits | (qual & max_dist);
+        }
+        out_match[i] = match;
+        out_qual[i] = (qual & ~((uint64_t) max_offset_limit << offset_shift)) | (uint64_t) best << offset_shift;
+    }
+}
+
+void PositionSearchMatcher::match_anchor(const StringColumn &strings, size_t start, size_t block, size_t count, uint64_t *out_match, uint64_t *out_qual) {
+    size_t len = inner->query_length();
+    uint64_t seqs[match_block_size], flags[match_block_size];
+    uint64_t best_anchor[match_block_size], best_dist[match_block_size];
+    for (size_t i = 0; i < count; i++) {
+        flags[i] = 0;
+        seqs[i] = strings.encode(block + i, start, anchor_length, flags[i]);
+        best_anchor[i] = 0;
+        best_dist[i] = hammingDistance(seqs[i], flags[i], anchor_seq);
+    }
+    for (size_t o = 1; o <= max_offset; o++) {
+        slide_windows(strings, block, count, start + o + anchor_length - 1, anchor_length, seqs, flags);
+        for (size_t i = 0; i < count; i++) {
+            uint64_t dist = hammingDistance(seqs[i], flags[i], anchor_seq);
+            if (dist < best_dist[i]) {
+                best_dist[i] = dist;
+                best_anchor[i] = o;
+            }
+        }
+    }
+
+    for (size_t i = 0; i < count; i++) {
+        long pos = (long) best_anchor[i] + barcode_offset;
+        flags[i] = 0;
+        seqs[i] = pos >= 0 ? strings.encode(block + i, start + pos, len, flags[i]) : 0;
+    }
+    inner->match_block(seqs, flags, count, out_match, out_qual);
+    for (size_t i = 0; i < count; i++) {
+        long pos = (long) best_anchor[i] + barcode_offset;
+        if (best_dist[i] > max_anchor_mismatches || pos < 0) {
+            out_match[i] = unmatched;
+            out_qual[i] = max_dist << dist_bits | max_dist;
+            pos = 0;
+        }
+        out_qual[i] = (out_qual[i] & ~((uint64_t) max_offset_limit << offset_shift)) | (uint64_t) pos << offset_shift;
+    }
+}
+
+void PositionSearchMatcher::_matchAll(const StringColumn &strings, const size_t start, const size_t end, uint64_t *out_match, uint64_t *out_qual, size_t threads) {
+    parallel_for(strings.size(), threads, [&](size_t begin, size_t finish) {
+        for (size_t block = begin; block < finish; block += match_block_size) {
+            size_t count = std::min(match_block_size, finish - block);
+            if (anchor_length) match_anchor(strings, start, block, count, out_match + block, out_qual + block);
+            else match_sliding(strings, start, block, count, out_match + block, out_qual + block);
+        }
+    });
+}
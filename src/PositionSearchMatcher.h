@@ -0,0 +1,43 @@
+#ifndef MATCHA_POSITION_SEARCH_MATCHER_H
+#define MATCHA_POSITION_SEARCH_MATCHER_H
+
+#include "Matcher.h"
+
+// Matcher for barcodes at variable positions, such as after variable-length spacers or staggered primers.
+// Wraps another matcher, and searches barcode start offsets 0 to max_offset of the window being matched, in one of two modes:
+//  - sliding: the barcode is matched at every offset, and the offset with the closest match wins (ties go to the lowest offset)
+//  - anchor: a constant anchor sequence is found first, at the offset with fewest mismatches, and the barcode is
+//    matched once at a fixed distance from the anchor
+// Windows are encoded incrementally as they slide, shifting in one new base per offset.
+// Match indexes and labels are those of the wrapped matcher. The qual has the usual best and second-best distances
+// (with second_best_dist covering other barcodes at any offset in sliding mode), any extra bits from the wrapped matcher
+// up to bit 47, and the barcode offset in bits 48-63.
+// The wrapped matcher must match encoded blocks (so not a CombinatorialMatcher or another PositionSearchMatcher),
+// and is held by pointer, so must outlive this matcher
+class PositionSearchMatcher: public Matcher {
+private:
+    Matcher *inner;
+    size_t max_offset;
+    size_t anchor_length = 0; // 0 in sliding mode
+    uint64_t anchor_seq = 0;
+    long barcode_offset = 0; // Start of the barcode relative to the start of the anchor
+    uint64_t max_anchor_mismatches = 0;
+
+    void match_sliding(const StringColumn &strings, size_t start, size_t block, size_t count, uint64_t *out_match, uint64_t *out_qual);
+    void match_anchor(const StringColumn &strings, size_t start, size_t block, size_t count, uint64_t *out_match, uint64_t *out_qual);
+public:
+    static const size_t offset_shift = 48;
+
+    // Search barcode start offsets 0 to max_offset by sliding
+    PositionSearchMatcher(Matcher *inner, size_t max_offset);
+    // Switch to anchor mode: search for anchor at offsets 0 to max_offset, and match the barcode starting
+    // barcode_offset bases after the anchor start (negative if the barcode comes before the anchor)
+    void set_anchor(string anchor, long barcode_offset, uint64_t max_anchor_mismatches);
+    size_t size() const override {return inner->size();}
+    size_t memory_usage() override {return Matcher::memory_usage() + inner->memory_usage();}
+    void append_label(vector<char> &out, uint64_t index) const override {inner->append_label(out, index);}
+    bool has_match_block() const override {return false;}
+    void _matchAll(const StringColumn &strings, const size_t start, const size_t end, uint64_t *out_match, uint64_t *out_qual, size_t threads) override;
+};
+
+#endif // MATCHA_POSITION_SEARCH_MATCHER_H
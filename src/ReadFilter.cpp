@@ -0,0 +1,143 @@
+#include "ReadFilter.h"
+
+#include <algorithm>
+#include <limits>
+
+#include "Matcher.h"
+
+using namespace std;
+
+void ReadFilter::add_condition(size_t barcode, string field, string op, uint64_t value) {
+    Condition c{barcode, DIST, LE, value};
+    if (field == "dist") c.field = DIST;
+    else if (field == "second_best_dist") c.field = SECOND_BEST_DIST;
+    else if (field == "match") c.field = MATCH;
+    else if (field == "min_qual") c.field = MIN_QUAL;
+    else throw invalid_argument("Unknown filter field: " + field);
+
+    if (op == "<") c.op = LT;
+    else if (op == "<=") c.op = LE;
+    else if (op == ">") c.op = GT;
+    else if (op == ">=") c.op = GE;
+    else if (op == "==") c.op = EQ;
+    else if (op == "!=") c.op = NE;
+    else throw invalid_argument("Unknown filter comparison: " + op);
+    conditions.push_back(c);
+}
+
+void ReadFilter::add_membership(size_t barcode, const vector<uint64_t> &matches, bool negate) {
+    Condition c{barcode, MATCH, negate ? NOT_IN : IN, 0};
+    for (uint64_t m : matches) {
+        if (m > std::numeric_limits<uint32_t>::max()) throw invalid_argument("Match index out of range: " + std::to_string(m));
+        if (m >= c.members.size()) c.members.resize(m + 1, 0);
+        c.members[m] = 1;
+    }
+    conditions.push_back(std::move(c));
+}
+
+size_t ReadFilter::barcode_count() const {
+    size_t ret = 0;
+    for (const Condition &c : conditions) ret = max(ret, c.barcode + 1);
+    return ret;
+}
+
+bool ReadFilter::uses_base_quals() const {
+    for (const Condition &c : conditions) {
+        if (c.field == MIN_QUAL) return true;
+    }
+    return false;
+}
+
+template <class F>
+static void and_mask(uint8_t *mask, const uint64_t *values, size_t n, F pass) {
+    for (size_t i = 0; i < n; i++) {
+        mask[i] &= pass(values[i]);
+    }
+}
+
+template <class F>
+static void and_mask_compare(uint8_t *mask, const uint64_t *values, size_t n, ReadFilter::Op op, uint64_t v, F get) {
+    switch (op) {
+    case ReadFilter::LT: and_mask(mask, values, n, [v, get](uint64_t x) {return get(x) < v;}); break;
+    case ReadFilter::LE: and_mask(mask, values, n, [v, get](uint64_t x) {return get(x) <= v;}); break;
+    case ReadFilter::GT: and_mask(mask, values, n, [v, get](uint64_t x) {return get(x) > v;}); break;
+    case ReadFilter::GE: and_mask(mask, values, n, [v, get](uint64_t x) {return get(x) >= v;}); break;
+    case ReadFilter::EQ: and_mask(mask, values, n, [v, get](uint64_t x) {return get(x) == v;}); break;
+    case ReadFilter::NE: and_mask(mask, values, n, [v, get](uint64_t x) {return get(x) != v;}); break;
+    default: throw invalid_argument("Invalid filter comparison");
+    }
+}
+
+// Lowest Phred score (offset 33) among bases [start, end) of each quality string. 0 if the window is empty
+static void min_base_quals(const StringArena &quals, size_t start, size_t end, size_t n, uint64_t *out) {
+    for (size_t i = 0; i < n; i++) {
+        const uint8_t *q = (const uint8_t *) quals.get(i);
+        size_t len = std::min(end, quals.length(i));
+        uint8_t lowest = 255;
+        for (size_t j = start; j < len; j++) lowest = std::min(lowest, q[j]);
+        out[i] = start < len ? lowest - std::min(lowest, (uint8_t) 33) : 0;
+    }
+}
+
+size_t ReadFilter::apply(size_t n, const vector<BarcodeResults> &barcodes, uint8_t *mask) const {
+    if (barcode_count() > barcodes.size()) throw invalid_argument("Filter refers to a missing barcode");
+    std::fill(mask, mask + n, 1);
+    vector<uint64_t> scratch;
+    // Evaluate one condition at a time over all reads, so each inner loop is simple enough to vectorize
+    for (const Condition &c : conditions) {
+        const BarcodeResults &b = barcodes[c.barcode];
+        switch (c.field) {
+        case DIST:
+            and_mask_compare(mask, b.quals, n, c.op, c.value, [](uint64_t q) {return q & max_dist;});
+            break;
+        case SECOND_BEST_DIST:
+            and_mask_compare(mask, b.quals, n, c.op, c.value, [](uint64_t q) {return q >> dist_bits & max_dist;});
+            break;
+        case MATCH:
+            if (c.op == IN || c.op == NOT_IN) {
+                const uint8_t *members = c.members.data();
+                uint64_t size = c.members.size();
+                bool want = c.op == IN;
+                and_mask(mask, b.matches, n, [members, size, want](uint64_t m) {return (m < size && members[m]) == want;});
+            } else {
+                and_mask_compare(mask, b.matches, n, c.op, c.value, [](uint64_t m) {return m;});
+            }
+            break;
+        case MIN_QUAL:
+            if (b.base_quals == nullptr || b.base_quals->size() < n) throw invalid_argument("Missing base qualities for min_qual filter");
+            scratch.resize(n);
+            min_base_quals(*b.base_quals, b.start, b.end, n, scratch.data());
+            and_mask_compare(mask, scratch.data(), n, c.op, c.value, [](uint64_t q) {return q;});
+            break;
+        }
+    }
+    size_t passed = 0;
+    for (size_t i = 0; i < n; i++) passed += mask[i];
+    return passed;
+}
+
+py::array_t<bool> ReadFilter::evaluate(vector<py::array_t<uint64_t, py::array::c_style | py::array::forcecast>> results,
+        vector<FastqFile *> files, vector<size_t> starts, vector<size_t> ends) const {
+    if (files.size() != results.size() || starts.size() != results.size() || ends.size() != results.size()) {
+        throw invalid_argument("Need a file, start, and end for each barcode's results");
+    }
+    size_t n = results.empty() ? 0 : results[0].shape(1);
+    vector<BarcodeResults> barcodes;
+    for (size_t b = 0; b < results.size(); b++) {
+        if (results[b].ndim() != 2 || results[b].shape(0) != 2 || (size_t) results[b].shape(1) != n) {
+            throw invalid_argument("Results must be (2, n) arrays with equal n");
+        }
+        if (files[b] == nullptr) throw invalid_argument("Missing file for barcode results");
+        // Row pointers from the row stride, since indexed access is bounds-checked and fails for empty results
+        const uint64_t *matches = results[b].data();
+        barcodes.push_back(BarcodeResults{matches, matches + results[b].strides(0) / sizeof(uint64_t),
+            &files[b]->current_chunk().qual, starts[b], ends[b]});
+    }
+
+    py::array_t<bool> mask(n);
+    {
+        py::gil_scoped_release release;
+        apply(n, barcodes, (uint8_t *) mask.mutable_data());
+    }
+    return mask;
+}
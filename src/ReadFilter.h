@@ -0,0 +1,64 @@
+#ifndef MATCHA_READ_FILTER_H
+#define MATCHA_READ_FILTER_H
+
+#include <cstdint>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+#include <pybind11/numpy.h>
+#include <pybind11/stl.h>
+
+#include "FastqFile.h"
+#include "StringArena.h"
+
+namespace py = pybind11;
+
+using std::uint64_t;
+using std::string;
+using std::vector;
+
+// Conditions on barcode match results, evaluated natively to choose which reads are written.
+// A read passes if it meets every condition
+class ReadFilter {
+public:
+    enum Field {DIST, SECOND_BEST_DIST, MATCH, MIN_QUAL};
+    enum Op {LT, LE, GT, GE, EQ, NE, IN, NOT_IN};
+
+    // Match results for one barcode over a chunk, plus the base qualities its window was matched on
+    struct BarcodeResults {
+        const uint64_t *matches;
+        const uint64_t *quals; // Raw match quals
+        const StringArena *base_quals; // Quality strings of the matched reads (only needed for min_qual conditions)
+        size_t start, end; // Barcode window within each read
+    };
+private:
+    struct Condition {
+        size_t barcode;
+        Field field;
+        Op op;
+        uint64_t value;
+        vector<uint8_t> members; // For IN and NOT_IN: members[m] is set for each match index m in the set
+    };
+    vector<Condition> conditions;
+public:
+    // Add the condition `<field> <op> <value>` on the match results of a barcode.
+    // field is "dist", "second_best_dist", "match", or "min_qual" (lowest Phred score of the bases in the
+    // barcode window), and op is one of <, <=, >, >=, ==, !=
+    void add_condition(size_t barcode, string field, string op, uint64_t value);
+    // Add the condition that the best match index of a barcode is (or with negate, is not) one of matches.
+    // Unmatched reads are never in the set
+    void add_membership(size_t barcode, const vector<uint64_t> &matches, bool negate = false);
+    size_t barcode_count() const; // Number of barcodes the conditions refer to (max index + 1)
+    bool uses_base_quals() const; // True if any condition reads base qualities
+
+    // Set mask[i] for each of n reads to whether it passes all conditions, and return the number passing.
+    size_t apply(size_t n, const vector<BarcodeResults> &barcodes, uint8_t *mask) const;
+
+    // Evaluate the filter on the most recent chunk of each barcode's file. results[b] is the raw (2, n) result
+    // array from FastqFile.match for barcode b, which was matched on bases [starts[b], ends[b]) of files[b]
+    py::array_t<bool> evaluate(vector<py::array_t<uint64_t, py::array::c_style | py::array::forcecast>> results,
+        vector<FastqFile *> files, vector<size_t> starts, vector<size_t> ends) const;
+};
+
+#endif // MATCHA_READ_FILTER_H
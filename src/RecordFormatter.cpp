@@ -0,0 +1,88 @@
+#include "RecordFormatter.h"
+
+#include <algorithm>
+#include <stdexcept>
+
+using namespace std;
+
+static inline void append_bytes(vector<char> &out, const char *data, size_t len) {
+    out.insert(out.end(), data, data + len);
+}
+
+RecordFormatter::RecordFormatter(const vector<string> &literals, const vector<int> &fields) {
+    // Default to the original read names when no pattern is set
+    if (literals.empty() && fields.empty()) {
+        program = {Op{LITERAL, 0, "@"}, Op{READ_NAME, 0, ""}, Op{LITERAL, 0, "\n"}};
+        return;
+    }
+    if (literals.size() != fields.size() + 1) throw invalid_argument("Name pattern must have one more literal than fields");
+    string pending = "@" + literals[0];
+    for (size_t j = 0; j < fields.size(); j++) {
+        if (!pending.empty()) program.push_back(Op{LITERAL, 0, pending});
+        int f = fields[j];
+        if (f == -1) {
+            program.push_back(Op{READ_NAME, 0, ""});
+        } else if (f < -1) {
+            uint32_t field_idx = -f - 2;
+            if (field_idx >= max_name_fields) throw invalid_argument("Read name field index is too large");
+            program.push_back(Op{NAME_FIELD, field_idx, ""});
+            name_field_count = max(name_field_count, field_idx + 1);
+        } else {
+            program.push_back(Op{LABEL, (uint32_t) f, ""});
+            if (find(label_fields.begin(), label_fields.end(), f) == label_fields.end()) label_fields.push_back(f);
+        }
+        pending = literals[j+1];
+    }
+    pending += "\n";
+    program.push_back(Op{LITERAL, 0, pending});
+}
+
+void RecordFormatter::append(vector<char> &out, const StringArena &name, const StringArena &seq, const StringArena &qual, size_t i,
+        const vector<const Matcher *> &matchers, const vector<const uint64_t *> &matches) const {
+    // Split the read name into ':'-separated fields in one pass. The last field ends at the first whitespace,
+    // and missing fields are empty
+    const char *field_start[max_name_fields];
+    size_t field_len[max_name_fields];
+    const char *read_name = name.get(i);
+    size_t name_len = name.length(i);
+    if (name_field_count > 0) {
+        size_t f = 0, start = 0, pos = 0;
+        for (; pos < name_len && f < name_field_count; pos++) {
+            char c = read_name[pos];
+            if (c == ':' || c == ' ' || c == '\t') {
+                field_start[f] = read_name + start;
+                field_len[f] = pos - start;
+                f++;
+                start = pos + 1;
+                if (c != ':') break;
+            }
+        }
+        if (f < name_field_count && pos == name_len) {
+            field_start[f] = read_name + start;
+            field_len[f] = pos - start;
+            f++;
+        }
+        for (; f < name_field_count; f++) field_len[f] = 0;
+    }
+
+    for (const Op &op : program) {
+        switch (op.type) {
+        case LITERAL:
+            append_bytes(out, op.literal.data(), op.literal.size());
+            break;
+        case READ_NAME:
+            append_bytes(out, read_name, name_len);
+            break;
+        case NAME_FIELD:
+            if (field_len[op.arg]) append_bytes(out, field_start[op.arg], field_len[op.arg]);
+            break;
+        case LABEL:
+            matchers[op.arg]->append_label(out, matches[op.arg][i]);
+            break;
+        }
+    }
+    append_bytes(out, seq.get(i), seq.length(i));
+    append_bytes(out, "\n+\n", 3);
+    append_bytes(out, qual.get(i), qual.length(i));
+    out.push_back('\n');
+}
@@ -0,0 +1,44 @@
+#ifndef MATCHA_RECORD_FORMATTER_H
+#define MATCHA_RECORD_FORMATTER_H
+
+#include <cstdint>
+#include <string>
+#include <vector>
+
+#include "Matcher.h"
+#include "StringArena.h"
+
+using std::uint32_t;
+using std::uint64_t;
+using std::string;
+using std::vector;
+
+// Formats fastq output records, with read names built from a pattern set by FastqReader.set_output_names.
+// The pattern is compiled once into a list of operations, and records are appended to a byte buffer
+class RecordFormatter {
+private:
+    enum OpType {LITERAL, READ_NAME, NAME_FIELD, LABEL};
+    struct Op {
+        OpType type;
+        uint32_t arg; // NAME_FIELD: index of ':'-separated field in the read name. LABEL: barcode field index
+        string literal;
+    };
+    static const uint32_t max_name_fields = 16;
+    vector<Op> program;
+    uint32_t name_field_count = 0; // Number of leading read name fields used by the pattern
+    vector<int> label_fields;
+public:
+    // literals -- Literal text, with one more entry than fields
+    // fields -- Per field: -1 for the read name, -i-2 for the ith ':'-separated field of the read name, or i >= 0 for barcode i
+    // With no literals or fields, output names are the input read names
+    RecordFormatter(const vector<string> &literals = {}, const vector<int> &fields = {});
+
+    const vector<int> &barcode_fields() const {return label_fields;} // Barcode indexes used by the pattern
+
+    // Append the record for read i to out. The label for barcode field f is the label of match index matches[f][i] 
+    // in matchers[f]. Reads with no match for a barcode get an empty label
+    void append(vector<char> &out, const StringArena &name, const StringArena &seq, const StringArena &qual, size_t i,
+        const vector<const Matcher *> &matchers, const vector<const uint64_t *> &matches) const;
+};
+
+#endif // MATCHA_RECORD_FORMATTER_H
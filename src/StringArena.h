@@ -0,0 +1,144 @@
+#ifndef MATCHA_STRING_ARENA_H
+#define MATCHA_STRING_ARENA_H
+
+#include <algorithm>
+#include <cstdint>
+#include <cstring>
+#include <string>
+#include <vector>
+
+#include "BinaryConverter.h"
+
+using std::uint64_t;
+using std::string;
+using std::vector;
+
+// Non-owning view of a list of strings, used to encode strings for matching without copying them.
+// Strings can be stored in one of three layouts:
+//  - offsets: string i spans data[offsets[i], offsets[i+1]) (StringArena, or an Arrow large_string array)
+//  - offsets32: the same with 32-bit offsets (Arrow string array)
+//  - fixed width: string i is the first width bytes at data + i*stride, padded with null characters (NumPy S or U array).
+//    char_size is 1 for bytes, or 4 for UCS4 unicode, and lengths are in characters
+struct StringColumn {
+    const char *data;
+    const uint64_t *offsets;
+    size_t n;
+    const int32_t *offsets32 = nullptr;
+    size_t width = 0; // Fixed width layout if non-zero
+    size_t stride = 0;
+    size_t char_size = 1;
+    const uint8_t *validity = nullptr; // Optional Arrow validity bitmap. Null strings are treated as empty
+    size_t validity_offset = 0;
+
+    size_t size() const {return n;}
+    const char *get(size_t i) const {
+        if (width) return data + i * stride;
+        if (offsets32) return data + offsets32[i];
+        return data + offsets[i];
+    }
+    size_t length(size_t i) const {
+        if (validity && !(validity[(validity_offset + i) / 8] >> ((validity_offset + i) % 8) & 1)) return 0;
+        if (width) {
+            const char *s = get(i);
+            if (char_size == 1) {
+                const char *end = (const char *) memchr(s, 0, width);
+                return end ? end - s : width;
+            }
+            size_t l = 0;
+            while (l < width / char_size && !is_null_char(s + l * char_size)) l++;
+            return l;
+        }
+        if (offsets32) return offsets32[i+1] - offsets32[i];
+        return offsets[i+1] - offsets[i];
+    }
+
+    // Binary encode bases [start, start+len) of string i. Bases past the end of the string are flagged as N
+    uint64_t encode(size_t i, size_t start, size_t len, uint64_t &flag) const {
+        size_t l = length(i);
+        size_t available = start < l ? std::min(len, l - start) : 0;
+        uint64_t seq;
+        if (char_size == 1) {
+            seq = stringToBinary(get(i) + std::min(start, l), available, flag);
+        } else {
+            // Narrow UCS4 characters to bytes, with non-ASCII characters becoming N
+            char buf[32];
+            available = std::min(available, sizeof(buf));
+            for (size_t j = 0; j < available; j++) {
+                uint32_t c;
+                memcpy(&c, get(i) + (start + j) * char_size, sizeof(c));
+                buf[j] = c < 128 ? (char) c : 'N';
+            }
+            seq = stringToBinary(buf, available, flag);
+        }
+        for (size_t j = available; j < len && j < 32; j++) {
+            flag |= (uint64_t) 1 << (2*j);
+        }
+        return seq;
+    }
+    // Binary encode bases [start, start+len) of string i into binary_words(len) words, for sequences of any length
+    void encode_words(size_t i, size_t start, size_t len, uint64_t *seq, uint64_t *flag) const {
+        for (size_t w = 0; w < binary_words(len); w++) {
+            flag[w] = 0;
+            seq[w] = encode(i, start + 32*w, std::min(len - 32*w, (size_t) 32), flag[w]);
+        }
+    }
+private:
+    bool is_null_char(const char *c) const {
+        for (size_t j = 0; j < char_size; j++) {
+            if (c[j]) return false;
+        }
+        return true;
+    }
+};
+
+// Contiguous storage for a list of strings. All string bytes are stored back to back in data,
+// with string i at data[offsets[i], offsets[i+1]). Clearing keeps the allocated memory for reuse
+class StringArena {
+public:
+    vector<char> data;
+    vector<uint64_t> offsets = {0};
+
+    size_t size() const {return offsets.size() - 1;}
+    void clear() {
+        data.clear();
+        offsets.resize(1);
+    }
+    void truncate(size_t n) {
+        if (n >= size()) return;
+        offsets.resize(n + 1);
+        data.resize(offsets[n]);
+    }
+    void reserve(size_t strings, size_t bytes) {
+        offsets.reserve(strings + 1);
+        data.reserve(bytes);
+    }
+    void push_back(const char *s, size_t len) {
+        size_t pos = data.size();
+        data.resize(pos + len);
+        memcpy(data.data() + pos, s, len);
+        offsets.push_back(data.size());
+    }
+    void push_back(const string &s) {push_back(s.data(), s.size());}
+    // Append strings [start, start+count) from another arena
+    void append(const StringArena &other, size_t start, size_t count) {
+        size_t pos = data.size();
+        size_t bytes = other.offsets[start + count] - other.offsets[start];
+        data.resize(pos + bytes);
+        memcpy(data.data() + pos, other.get(start), bytes);
+        for (size_t i = start + 1; i <= start + count; i++) {
+            offsets.push_back(pos + other.offsets[i] - other.offsets[start]);
+        }
+    }
+    const char *get(size_t i) const {return data.data() + offsets[i];}
+    size_t length(size_t i) const {return offsets[i+1] - offsets[i];}
+    string str(size_t i) const {return string(get(i), length(i));}
+    vector<string> strings() const {
+        vector<string> ret;
+        ret.reserve(size());
+        for (size_t i = 0; i < size(); i++) ret.push_back(str(i));
+        return ret;
+    }
+    StringColumn column() const {return StringColumn{data.data(), offsets.data(), size()};}
+};
+
+#endif // MATCHA_STRING_ARENA_H
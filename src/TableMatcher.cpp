@@ -0,0 +1,110 @@
+#include "TableMatcher.h"
+
+static const uint32_t no_match = UINT32_MAX;
+
+TableMatcher::TableMatcher(size_t max_table_size, size_t threads) : max_table_size(max_table_size), threads(threads) {}
+
+// Candidates during the table build are packed as dist << 32 | index, so that comparing packed values
+// orders by distance and then by index, matching ListMatcher's choice of the first of several equally good matches
+static const uint64_t no_candidate = UINT64_MAX;
+
+static inline void insert_candidate(uint64_t c, uint64_t &best, uint64_t &next) {
+    if (c < best) {
+        next = best;
+        best = c;
+    } else if (c < next) {
+        next = c;
+    }
+}
+
+void TableMatcher::build_index() {
+    table.clear();
+    if (sequences.empty()) return;
+    if (k > 31 || ((size_t) 1 << (2*k)) > max_table_size) {
+        throw runtime_error("Table for sequence length " + std::to_string(k) + " exceeds max_table_size of " + 
+            std::to_string(max_table_size) + " entries");
+    }
+    if (sequences.size() >= no_match) throw runtime_error("Too many sequences for TableMatcher");
+    
+    // Find the best and second-best match for every query, one base position at a time.
+    // After processing positions [0, p), candidates[q] holds the two best (dist, index) pairs among barcodes that equal q
+    // at positions >= p, with dist counting mismatches in positions < p. Each step combines the 4 entries differing only at
+    // position p, which partition the barcodes by their base at p, so keeping only the best two candidates is exact.
+    size_t table_size = (size_t) 1 << (2*k);
+    vector<uint64_t> candidates(2 * table_size, no_candidate);
+    for (size_t i = 0; i < sequences.size(); i++) {
+        insert_candidate(i, candidates[2*sequences[i]], candidates[2*sequences[i] + 1]);
+    }
+
+    for (size_t p = 0; p < k; p++) {
+        size_t low_size = (size_t) 1 << (2*p);
+        parallel_for(table_size / 4, threads, [&](size_t begin, size_t end) {
+            for (size_t g = begin; g < end; g++) {
+                // Entries for group g are base + b * low_size for each base b at position p
+                size_t base = (g / low_size) * 4 * low_size + g % low_size;
+                uint64_t old[8];
+                for (size_t b = 0; b < 4; b++) {
+                    old[2*b] = candidates[2*(base + b*low_size)];
+                    old[2*b + 1] = candidates[2*(base + b*low_size) + 1];
+                }
+                for (size_t b = 0; b < 4; b++) {
+                    uint64_t best = no_candidate, next = no_candidate;
+                    for (size_t c = 0; c < 8; c++) {
+                        if (old[c] == no_candidate) continue;
+                        insert_candidate(old[c] + ((uint64_t) (c/2 != b) << 32), best, next);
+                    }
+                    candidates[2*(base + b*low_size)] = best;
+                    candidates[2*(base + b*low_size) + 1] = next;
+                }
+            }
+        }, 1 << 14);
+    }
+
+    table.resize(table_size);
+    parallel_for(table_size, threads, [&](size_t begin, size_t end) {
+        for (size_t q = begin; q < end; q++) {
+            uint64_t best = candidates[2*q], next = candidates[2*q + 1];
+            uint64_t next_dist = next == no_candidate ? max_dist : next >> 32;
+            table[q] = Entry{(uint32_t) best, (uint32_t) (next_dist << dist_bits | best >> 32)};
+        }
+    }, 1 << 16);
+}
+
+size_t TableMatcher::memory_usage() {
+    return Matcher::memory_usage() + table.capacity() * sizeof(Entry);
+}
+
+uint64_t TableMatcher::match(uint64_t seq, uint64_t flag, uint64_t &qual) {
+    if (flag || table.empty()) return ListMatcher::match(seq, flag, qual);
+    const Entry &e = table[seq];
+    qual = e.qual;
+    return e.match;
+}
+
+void TableMatcher::match_block(const uint64_t *seqs, const uint64_t *flags, size_t n, uint64_t *out_match, uint64_t *out_qual) {
+    if (table.empty()) return ListMatcher::match_block(seqs, flags, n, out_match, out_qual);
+    // Look up sequences without N's, and gather the rest for a batched fallback
+    vector<size_t> fallback;
+    for (size_t i = 0; i < n; i++) {
+        if (flags[i]) {
+            fallback.push_back(i);
+            continue;
+        }
+        const Entry &e = table[seqs[i]];
+        out_match[i] = e.match;
+        out_qual[i] = e.qual;
+    }
+    if (fallback.empty()) return;
+    vector<uint64_t> buf(4 * fallback.size());
+    uint64_t *fb_seqs = buf.data(), *fb_flags = fb_seqs + fallback.size();
+    uint64_t *fb_match = fb_flags + fallback.size(), *fb_qual = fb_match + fallback.size();
+    for (size_t j = 0; j < fallback.size(); j++) {
+        fb_seqs[j] = seqs[fallback[j]];
+        fb_flags[j] = flags[fallback[j]];
+    }
+    ListMatcher::match_block(fb_seqs, fb_flags, fallback.size(), fb_match, fb_qual);
+    for (size_t j = 0; j < fallback.size(); j++) {
+        out_match[fallback[j]] = fb_match[j];
+        out_qual[fallback[j]] = fb_qual[j];
+    }
+}
@@ -0,0 +1,28 @@
+#ifndef MATCHA_TABLE_MATCHER_H
+#define MATCHA_TABLE_MATCHER_H
+
+#include "ListMatcher.h"
+
+// Matcher with a dense lookup table holding the precomputed match for every possible query sequence.
+// Matching is a single array load, but the table has 4^k entries so it is only practical for short barcodes.
+// Queries containing N's are not in the table, and fall back to ListMatcher's linear search
+class TableMatcher: public ListMatcher {
+private:
+    struct Entry {
+        uint32_t match;
+        uint32_t qual;
+    };
+    size_t max_table_size;
+    size_t threads;
+    vector<Entry> table;
+public:
+    // max_table_size -- Maximum number of table entries (8 bytes each). Building a larger table raises an error
+    // threads -- Number of threads to use while building the table
+    TableMatcher(size_t max_table_size, size_t threads = 1);
+    void build_index() override;
+    size_t memory_usage() override;
+    uint64_t match(uint64_t seq, uint64_t flag, uint64_t &qual) override; //qual format is: bottom 6 bits = # mismatches to best match, next 6 bits = # mismatches to 2nd best match
+    void match_block(const uint64_t *seqs, const uint64_t *flags, size_t n, uint64_t *out_match, uint64_t *out_qual) override;
+};
+
+#endif // MATCHA_TABLE_MATCHER_H
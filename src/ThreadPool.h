@@ -0,0 +1,184 @@
+#ifndef MATCHA_THREAD_POOL_H
+#define MATCHA_THREAD_POOL_H
+
+#include <algorithm>
+#include <atomic>
+#include <condition_variable>
+#include <exception>
+#include <deque>
+#include <functional>
+#include <future>
+#include <memory>
+#include <mutex>
+#include <thread>
+#include <vector>
+
+using std::deque;
+using std::function;
+using std::future;
+using std::mutex;
+using std::condition_variable;
+using std::unique_lock;
+using std::vector;
+
+// Fixed-size pool of worker threads. Tasks are run in submission order by the first free worker
+class ThreadPool {
+private:
+    vector<std::thread> workers;
+    deque<function<void()>> tasks;
+    mutex lock;
+    condition_variable task_ready;
+    bool stopping = false;
+
+    void worker_loop() {
+        while (true) {
+            function<void()> task;
+            {
+                unique_lock<mutex> l(lock);
+                task_ready.wait(l, [this]{ return stopping || !tasks.empty(); });
+                if (tasks.empty()) return;
+                task = std::move(tasks.front());
+                tasks.pop_front();
+            }
+            task();
+        }
+    }
+public:
+    ThreadPool(size_t threads) {
+        for (size_t i = 0; i < threads; i++) {
+            workers.emplace_back([this]{ worker_loop(); });
+        }
+    }
+
+    ~ThreadPool() {
+        {
+            unique_lock<mutex> l(lock);
+            stopping = true;
+        }
+        task_ready.notify_all();
+        for (auto &w : workers) w.join();
+    }
+
+    size_t size() {return workers.size();}
+
+    // Queue f to run on a worker thread. Exceptions thrown by f are re-thrown from future::get()
+    template <class F>
+    auto submit(F f) -> future<decltype(f())> {
+        using R = decltype(f());
+        auto task = std::make_shared<std::packaged_task<R()>>(std::move(f));
+        future<R> ret = task->get_future();
+        {
+            unique_lock<mutex> l(lock);
+            tasks.emplace_back([task]{ (*task)(); });
+        }
+        task_ready.notify_one();
+        return ret;
+    }
+};
+
+// Blocking FIFO queue with a maximum capacity, used to connect producer and consumer threads
+template <class T>
+class BoundedQueue {
+private:
+    deque<T> items;
+    size_t capacity;
+    bool closed = false;
+    mutex lock;
+    condition_variable not_empty;
+    condition_variable not_full;
+public:
+    BoundedQueue(size_t capacity) : capacity(capacity > 0 ? capacity : 1) {}
+
+    // Add an item, blocking while the queue is full. Returns false if the queue has been closed
+    bool push(T item) {
+        unique_lock<mutex> l(lock);
+        not_full.wait(l, [this]{ return closed || items.size() < capacity; });
+        if (closed) return false;
+        items.push_back(std::move(item));
+        l.unlock();
+        not_empty.notify_one();
+        return true;
+    }
+
+    // Remove an item, blocking while the queue is empty. Returns false once the queue is closed and drained
+    bool pop(T &item) {
+        unique_lock<mutex> l(lock);
+        not_empty.wait(l, [this]{ return closed || !items.empty(); });
+        if (items.empty()) return false;
+        item = std::move(items.front());
+        items.pop_front();
+        l.unlock();
+        not_full.notify_one();
+        return true;
+    }
+
+    // Stop accepting new items and wake up all waiting threads. Items already queued can still be popped
+    void close() {
+        {
+            unique_lock<mutex> l(lock);
+            closed = true;
+        }
+        not_empty.notify_all();
+        not_full.notify_all();
+    }
+};
+
+// Process-wide pool shared by all parallel loops, sized to the number of cores
+inline ThreadPool &shared_pool() {
+    static ThreadPool pool(std::max(1u, std::thread::hardware_concurrency()));
+    return pool;
+}
+
+// Call fn(begin, end) on blocks covering [0, n), using up to `threads` threads (including the calling thread).
+// Blocks are claimed dynamically from the shared pool, and the calling thread works through blocks itself
+// rather than waiting, so concurrent parallel_for calls from different threads can't deadlock.
+// Exceptions thrown by fn are re-thrown in the calling thread.
+template <class F>
+void parallel_for(size_t n, size_t threads, F fn, size_t min_block_size = 1024) {
+    if (threads <= 1 || n <= min_block_size) {
+        fn((size_t) 0, n);
+        return;
+    }
+    struct State {
+        F fn;
+        size_t n, block_size, blocks;
+        std::atomic<size_t> next_block{0};
+        size_t finished_blocks = 0;
+        std::exception_ptr error;
+        mutex lock;
+        condition_variable all_finished;
+        State(F fn) : fn(fn) {}
+
+        void run() {
+            while (true) {
+                size_t b = next_block++;
+                if (b >= blocks) return;
+                std::exception_ptr e;
+                try {
+                    fn(b * block_size, std::min(n, (b+1) * block_size));
+                } catch (...) {
+                    e = std::current_exception();
+                }
+                unique_lock<mutex> l(lock);
+                if (e && !error) error = e;
+                if (++finished_blocks == blocks) all_finished.notify_all();
+            }
+        }
+    };
+    auto state = std::make_shared<State>(fn);
+    state->n = n;
+    state->block_size = std::max(min_block_size, (n + 4*threads - 1) / (4*threads));
+    state->blocks = (n + state->block_size - 1) / state->block_size;
+
+    ThreadPool &pool = shared_pool();
+    for (size_t i = 1; i < std::min(threads, state->blocks); i++) {
+        pool.submit([state]{ state->run(); });
+    }
+    state->run();
+
+    unique_lock<mutex> l(state->lock);
+    state->all_finished.wait(l, [&state]{ return state->finished_blocks == state->blocks; });
+    if (state->error) std::rethrow_exception(state->error);
+}
+
+#endif // MATCHA_THREAD_POOL_H
@@ -0,0 +1,141 @@
+#include "UmiCounter.h"
+
+#include <algorithm>
+#include <numeric>
+
+using namespace std;
+
+static const size_t min_merge_size = 1 << 20;
+
+static uint32_t bits_for(size_t count) {
+    uint32_t bits = 0;
+    while (bits < 64 && ((uint64_t) 1 << bits) < count) bits++;
+    return bits;
+}
+
+static uint64_t shift_left(uint64_t x, uint32_t shift) {
+    return shift >= 64 ? 0 : x << shift;
+}
+
+UmiCounter::UmiCounter(size_t cell_count, size_t feature_count, size_t umi_start, size_t umi_length) :
+        cell_count(cell_count), feature_count(feature_count), umi_start(umi_start), umi_length(umi_length) {
+    if (umi_length == 0 || umi_length > 32) throw invalid_argument("UMI length must be between 1 and 32");
+    umi_bits = 2 * umi_length;
+    feature_bits = bits_for(feature_count);
+    if (bits_for(cell_count) + feature_bits + umi_bits > 64) {
+        throw invalid_argument("Too many cells, features, and UMI bases to pack in a 64-bit key");
+    }
+}
+
+void UmiCounter::add(const uint64_t *cells, const uint64_t *features, const StringColumn &umis, size_t n, const uint8_t *mask) {
+    for (size_t i = 0; i < n; i++) {
+        if (mask != nullptr && !mask[i]) continue;
+        uint64_t flag = 0;
+        uint64_t umi = umis.encode(i, umi_start, umi_length, flag);
+        if (cells[i] >= cell_count || features[i] >= feature_count || flag != 0) {
+            reads_skipped++;
+            continue;
+        }
+        pending.push_back(shift_left(cells[i], feature_bits + umi_bits) | shift_left(features[i], umi_bits) | umi);
+        reads_counted++;
+    }
+    if (pending.size() >= std::max(min_merge_size, keys.size() / 2)) merge_pending();
+}
+
+void UmiCounter::add_chunk(ResultArray cell_results, ResultArray feature_results, FastqFile &umi_file, py::object mask) {
+    const StringColumn umis = umi_file.current_chunk().seq.column();
+    size_t n = umis.size();
+    for (ResultArray *r : {&cell_results, &feature_results}) {
+        if (r->ndim() != 2 || r->shape(0) != 2 || (size_t) r->shape(1) != n) {
+            throw invalid_argument("Results must be (2, n) arrays matching the chunk size");
+        }
+    }
+    const uint8_t *mask_data = nullptr;
+    py::array_t<bool, py::array::c_style | py::array::forcecast> mask_array;
+    if (!mask.is_none()) {
+        mask_array = mask.cast<py::array_t<bool, py::array::c_style | py::array::forcecast>>();
+        if (mask_array.ndim() != 1 || (size_t) mask_array.shape(0) != n) throw invalid_argument("Mask must match the chunk size");
+        mask_data = (const uint8_t *) mask_array.data();
+    }
+    py::gil_scoped_release release;
+    add(cell_results.data(), feature_results.data(), umis, n, mask_data);
+}
+
+void UmiCounter::merge_pending() {
+    if (pending.empty()) return;
+    sort(pending.begin(), pending.end());
+    vector<uint64_t> new_keys;
+    vector<uint32_t> new_reads;
+    new_keys.reserve(keys.size() + pending.size());
+    new_reads.reserve(keys.size() + pending.size());
+    size_t i = 0, j = 0;
+    while (i < keys.size() || j < pending.size()) {
+        uint64_t key = j == pending.size() || (i < keys.size() && keys[i] < pending[j]) ? keys[i] : pending[j];
+        uint32_t count = 0;
+        if (i < keys.size() && keys[i] == key) count += reads[i++];
+        while (j < pending.size() && pending[j] == key) {
+            count++;
+            j++;
+        }
+        new_keys.push_back(key);
+        new_reads.push_back(count);
+    }
+    keys.swap(new_keys);
+    reads.swap(new_reads);
+    pending.clear();
+}
+
+uint64_t UmiCounter::count_molecules(size_t begin, size_t end, bool collapse) const {
+    if (!collapse || end - begin == 1) return end - begin;
+    // Visit UMIs from most to least reads. A UMI is a new molecule unless an earlier-visited neighbor
+    // at hamming distance 1 has at least 2*count - 1 reads
+    vector<size_t> order(end - begin);
+    iota(order.begin(), order.end(), begin);
+    stable_sort(order.begin(), order.end(), [this](size_t a, size_t b) {return reads[a] > reads[b];});
+    vector<size_t> rank(end - begin);
+    for (size_t r = 0; r < order.size(); r++) rank[order[r] - begin] = r;
+
+    uint64_t molecules = 0;
+    for (size_t r = 0; r < order.size(); r++) {
+        size_t u = order[r];
+        bool duplicate = false;
+        for (size_t pos = 0; pos < umi_length && !duplicate; pos++) {
+            for (uint64_t change = 1; change < 4 && !duplicate; change++) {
+                uint64_t neighbor = keys[u] ^ (change << (2 * pos));
+                const uint64_t *found = lower_bound(keys.data() + begin, keys.data() + end, neighbor);
+                if (found == keys.data() + end || *found != neighbor) continue;
+                size_t v = found - keys.data();
+                duplicate = rank[v - begin] < r && (uint64_t) reads[v] + 1 >= 2 * (uint64_t) reads[u];
+            }
+        }
+        if (!duplicate) molecules++;
+    }
+    return molecules;
+}
+
+std::tuple<py::array_t<uint64_t>, py::array_t<uint64_t>, py::array_t<uint64_t>, py::array_t<uint64_t>> UmiCounter::get_counts(bool collapse) {
+    vector<uint64_t> cells, features, molecules, read_counts;
+    {
+        py::gil_scoped_release release;
+        merge_pending();
+        uint64_t feature_mask = shift_left(1, feature_bits) - 1;
+        for (size_t begin = 0; begin < keys.size();) {
+            uint64_t pair = umi_bits >= 64 ? 0 : keys[begin] >> umi_bits;
+            size_t end = begin;
+            uint64_t total_reads = 0;
+            while (end < keys.size() && (umi_bits >= 64 ? 0 : keys[end] >> umi_bits) == pair) total_reads += reads[end++];
+            cells.push_back(feature_bits >= 64 ? 0 : pair >> feature_bits);
+            features.push_back(pair & feature_mask);
+            molecules.push_back(count_molecules(begin, end, collapse));
+            read_counts.push_back(total_reads);
+            begin = end;
+        }
+    }
+    auto to_array = [](const vector<uint64_t> &v) {return py::array_t<uint64_t>(v.size(), v.data());};
+    return std::make_tuple(to_array(cells), to_array(features), to_array(molecules), to_array(read_counts));
+}
+
+std::map<std::string, uint64_t> UmiCounter::stats() {
+    merge_pending();
+    return {{"reads", reads_counted}, {"skipped_reads", reads_skipped}, {"unique_umis", keys.size()}};
+}
@@ -0,0 +1,60 @@
+#ifndef MATCHA_UMI_COUNTER_H
+#define MATCHA_UMI_COUNTER_H
+
+#include <cstdint>
+#include <map>
+#include <string>
+#include <tuple>
+#include <vector>
+
+#include <pybind11/numpy.h>
+
+#include "FastqFile.h"
+#include "MatchCounter.h"
+#include "StringArena.h"
+
+namespace py = pybind11;
+
+using std::uint32_t;
+using std::uint64_t;
+using std::vector;
+
+// Streaming deduplication of (cell, UMI, feature) observations. Each read with a matched cell and feature
+// and an N-free UMI is packed into a single 64-bit key of cell index, feature index, and 2-bit encoded UMI.
+// Keys are collected in a buffer that is periodically sorted and merged into a sorted table of
+// unique keys with read counts, so memory use is about 12 bytes per unique molecule.
+// At the end, molecules are counted per (cell, feature) pair, optionally collapsing UMIs within hamming distance 1.
+class UmiCounter {
+private:
+    size_t cell_count, feature_count;
+    size_t umi_start, umi_length;
+    uint32_t umi_bits, feature_bits;
+    vector<uint64_t> pending; // Keys not yet merged into the table
+    vector<uint64_t> keys; // Sorted unique keys
+    vector<uint32_t> reads; // Read count for each key
+    uint64_t reads_counted = 0, reads_skipped = 0;
+
+    void merge_pending();
+    // Count molecules for the keys [begin, end) of one (cell, feature) pair, which are sorted by UMI
+    uint64_t count_molecules(size_t begin, size_t end, bool collapse) const;
+public:
+    // cell_count and feature_count are the number of sequences in the cell and feature matchers.
+    // UMIs are bases [umi_start, umi_start + umi_length) of each read
+    UmiCounter(size_t cell_count, size_t feature_count, size_t umi_start, size_t umi_length);
+    UmiCounter(const Matcher &cells, const Matcher &features, size_t umi_start, size_t umi_length) :
+        UmiCounter(cells.size(), features.size(), umi_start, umi_length) {}
+
+    // Add n reads, given cell and feature match indexes and the reads holding the UMIs.
+    // mask is optional, and if given only reads with mask[i] set are added
+    void add(const uint64_t *cells, const uint64_t *features, const StringColumn &umis, size_t n, const uint8_t *mask = nullptr);
+    // Add the most recent chunk of a FastqFile, given (2, n) cell and feature match results
+    void add_chunk(ResultArray cell_results, ResultArray feature_results, FastqFile &umi_file, py::object mask = py::none());
+
+    // Counts in coordinate format, sorted by cell then feature: arrays of (cell, feature, molecules, reads).
+    // If collapse is set, a UMI is merged into a hamming distance 1 neighbor with at least 2*count - 1 reads 
+    // (the directional method of UMI-tools)
+    std::tuple<py::array_t<uint64_t>, py::array_t<uint64_t>, py::array_t<uint64_t>, py::array_t<uint64_t>> get_counts(bool collapse = false);
+    std::map<std::string, uint64_t> stats(); // Reads counted and skipped, and unique (cell, feature, UMI) keys
+};
+
+#endif // MATCHA_UMI_COUNTER_H
@@ -4,8 +4,18 @@
 #include "Matcher.h"
 #include "ListMatcher.h"
 #include "HashMatcher.h"
+#include "TableMatcher.h"
+#include "CombinatorialMatcher.h"
+#include "DualIndexMatcher.h"
+#include "PositionSearchMatcher.h"
+#include "IndelMatcher.h"
 #include "BinaryConverter.h"
 #include "FastqFile.h"
+#include "HammingKernels.h"
+#include "MatchCounter.h"
+#include "Pipeline.h"
+#include "ReadFilter.h"
+#include "UmiCounter.h"
 
 namespace py = pybind11;
 
@@ -31,34 +41,133 @@ PYBIND11_MODULE(_matcha, m) {
 
     m.def("binaryToString", &binaryToString);
 
+    m.def("stringToBinaryWords", [](string s) {
+        vector<uint64_t> seq(binary_words(s.size())), flag(binary_words(s.size()));
+        stringToBinaryWords(s.c_str(), s.size(), seq.data(), flag.data());
+        return std::make_tuple(seq, flag);
+    });
+
+    m.def("binaryWordsToString", [](vector<uint64_t> seq, size_t len, vector<uint64_t> flag) {
+        if (seq.size() != binary_words(len) || flag.size() != seq.size()) throw invalid_argument("Wrong number of words for sequence length");
+        return binaryWordsToString(seq.data(), len, flag.data());
+    });
+
+    m.def("hamming_kernels", &hamming_kernels);
+    m.def("get_hamming_kernel", &get_hamming_kernel);
+    m.def("set_hamming_kernel", &set_hamming_kernel);
+
     //bindings to Matcher class
     py::class_<Matcher>matcher(m, "Matcher");
     matcher.def("add_sequences", &Matcher::add_sequences)
+        .def("add_sequences_file", &Matcher::add_sequences_file, py::arg("path"), py::arg("read_labels") = true,
+            py::call_guard<py::gil_scoped_release>())
+        .def("add_encoded_sequences", &Matcher::add_encoded_sequences, py::arg("seqs"), py::arg("length"))
         .def("get_sequences", &Matcher::get_sequences)
-        .def("match_all", &Matcher::matchAll)
-        .def("match_raw", &Matcher::matchRaw)
+        .def("sequence_length", &Matcher::sequence_length)
+        .def("size", &Matcher::size)
+        .def("match_all", static_cast<py::array_t<uint64_t> (Matcher::*)(vector<string>, const size_t, const size_t, size_t, py::object)>(&Matcher::matchAll),
+            py::arg("strings"), py::arg("start"), py::arg("end"), py::arg("threads") = 1, py::arg("out") = py::none())
+        .def("match_fixed", &Matcher::matchFixed,
+            py::arg("strings"), py::arg("char_size"), py::arg("start"), py::arg("end"), py::arg("threads") = 1, py::arg("out") = py::none())
+        .def("match_arrow", &Matcher::matchArrow,
+            py::arg("offsets"), py::arg("offset_size"), py::arg("data"), py::arg("validity"), py::arg("array_offset"), py::arg("n"),
+            py::arg("start"), py::arg("end"), py::arg("threads") = 1, py::arg("out") = py::none())
+        .def("match_raw", &Matcher::matchRaw, py::arg("seqs"), py::arg("output"), py::arg("threads") = 1)
+        .def("benchmark", &Matcher::benchmark, py::arg("strings"), py::arg("start"), py::arg("end"), py::arg("threads") = 1,
+            py::arg("min_seconds") = 0.1)
+        .def("memory_usage", &Matcher::memory_usage)
         .def("has_labels", &Matcher::has_labels)
         .def("add_label", &Matcher::add_label)
         .def("add_labels", &Matcher::add_labels)
         .def("get_label", &Matcher::get_label)
-        .def("get_labels", &Matcher::get_labels);
+        .def("get_labels", &Matcher::get_labels)
+        .def("find_labels", &Matcher::find_labels, py::arg("labels"));
 
     py::class_<ListMatcher>(m, "ListMatcher", matcher)
-        .def(py::init<>()) 
+        .def(py::init<uint64_t>(), py::arg("max_mismatches") = max_dist)
         .def("match", &ListMatcher::match);
 
     py::class_<HashMatcher>(m, "HashMatcher", matcher)
-        .def(py::init<vector<uint64_t>, vector<vector<uint64_t>>, uint>()) 
-        .def("match", &HashMatcher::match);
+        .def(py::init<vector<uint64_t>, vector<vector<uint64_t>>, uint, size_t>(),
+            py::arg("chunk_masks"), py::arg("mismatch_masks"), py::arg("max_mismatches"), py::arg("threads") = 1)
+        .def(py::init<vector<vector<uint64_t>>, vector<vector<vector<uint64_t>>>, uint, size_t>(),
+            py::arg("chunk_masks"), py::arg("mismatch_masks"), py::arg("max_mismatches"), py::arg("threads") = 1)
+        .def("match", &HashMatcher::match)
+        .def("save", &HashMatcher::save)
+        .def_static("load", &HashMatcher::load, py::return_value_policy::take_ownership);
+
+    py::class_<TableMatcher>(m, "TableMatcher", matcher)
+        .def(py::init<size_t, size_t>(), py::arg("max_table_size"), py::arg("threads") = 1)
+        .def("match", &TableMatcher::match);
+
+    py::class_<CombinatorialMatcher>(m, "CombinatorialMatcher", matcher)
+        .def(py::init<string>(), py::arg("separator") = "_")
+        .def("add_round", &CombinatorialMatcher::add_round, py::arg("matcher"), py::arg("offset"), py::keep_alive<1, 2>())
+        .def("round_count", &CombinatorialMatcher::round_count);
+
+    py::class_<DualIndexMatcher>(m, "DualIndexMatcher", matcher)
+        .def(py::init<size_t, size_t, uint64_t, uint64_t, string>(), py::arg("i7_length"), py::arg("i5_length"),
+            py::arg("max_i7_mismatches"), py::arg("max_i5_mismatches"), py::arg("i5_orientation") = "forward")
+        .def("match", &DualIndexMatcher::match)
+        .def("match_files", &DualIndexMatcher::match_files, py::arg("i7_file"), py::arg("i7_start"), py::arg("i5_file"), 
+            py::arg("i5_start"), py::arg("threads") = 1)
+        .def("i7_sequence_length", &DualIndexMatcher::i7_sequence_length)
+        .def("i5_sequence_length", &DualIndexMatcher::i5_sequence_length);
+
+    py::class_<PositionSearchMatcher>(m, "PositionSearchMatcher", matcher)
+        .def(py::init<Matcher *, size_t>(), py::arg("matcher"), py::arg("max_offset"), py::keep_alive<1, 2>())
+        .def("set_anchor", &PositionSearchMatcher::set_anchor, py::arg("anchor"), py::arg("barcode_offset"), py::arg("max_anchor_mismatches"));
+
+    py::class_<IndelMatcher>(m, "IndelMatcher", matcher)
+        .def(py::init<uint64_t, size_t>(), py::arg("max_edits"), py::arg("extra_bases"))
+        .def("query_length", &IndelMatcher::query_length);
 
     py::class_<FastqFile>(m, "FastqFile")
-        .def(py::init<string, vector<string>, vector<int>, string >())
+        .def(py::init<string, vector<string>, vector<int>, string, size_t, size_t, size_t, int >())
         .def("read_chunk", &FastqFile::read_chunk, py::call_guard<py::gil_scoped_release>())
-        .def("match", &FastqFile::match)
+        .def("input_stats", &FastqFile::input_stats)
+        .def("match", &FastqFile::match, py::arg("matcher"), py::arg("start"), py::arg("end"), py::arg("threads") = 1)
         .def("inspect_reads", &FastqFile::inspect_reads)
+        .def("get_buffers", &FastqFile::get_buffers)
         .def("write_chunk", &FastqFile::write_chunk)
+        .def("set_demux_output", &FastqFile::set_demux_output, py::arg("prefix"), py::arg("suffix"), py::arg("field"), py::arg("matcher"),
+            py::arg("max_open_files") = 256, py::arg("threads") = 1, py::arg("compression_level") = Z_DEFAULT_COMPRESSION,
+            py::arg("create_empty_files") = false)
         .def("close", &FastqFile::close);
 
+    py::class_<ReadFilter>(m, "ReadFilter")
+        .def(py::init<>())
+        .def("add_condition", &ReadFilter::add_condition, py::arg("barcode"), py::arg("field"), py::arg("op"), py::arg("value"))
+        .def("add_membership", &ReadFilter::add_membership, py::arg("barcode"), py::arg("matches"), py::arg("negate") = false)
+        .def("evaluate", &ReadFilter::evaluate, py::arg("results"), py::arg("files"), py::arg("starts"), py::arg("ends"));
+
+    py::class_<MatchCounter>(m, "MatchCounter")
+        .def(py::init<const Matcher &>(), py::arg("matcher"))
+        .def("add", &MatchCounter::add_results, py::arg("results"))
+        .def("get_match_counts", &MatchCounter::get_match_counts)
+        .def("get_dist_counts", &MatchCounter::get_dist_counts);
+
+    py::class_<JointCounter>(m, "JointCounter")
+        .def(py::init<>())
+        .def("add", &JointCounter::add_results, py::arg("results_a"), py::arg("results_b"), py::arg("mask") = py::none())
+        .def("get_counts", &JointCounter::get_counts);
+
+    py::class_<UmiCounter>(m, "UmiCounter")
+        .def(py::init<const Matcher &, const Matcher &, size_t, size_t>(), py::arg("cells"), py::arg("features"), py::arg("umi_start"), py::arg("umi_length"))
+        .def("add_chunk", &UmiCounter::add_chunk, py::arg("cell_results"), py::arg("feature_results"), py::arg("umi_file"), py::arg("mask") = py::none())
+        .def("get_counts", &UmiCounter::get_counts, py::arg("collapse") = false)
+        .def("stats", &UmiCounter::stats);
+
+    py::class_<Pipeline>(m, "Pipeline")
+        .def(py::init<vector<FastqFile*>, size_t, size_t>(), py::arg("files"), py::arg("chunk_size"), py::arg("queue_depth") = 2)
+        .def("add_barcode", &Pipeline::add_barcode)
+        .def("add_dual_barcode", &Pipeline::add_dual_barcode)
+        .def("set_filter", &Pipeline::set_filter)
+        .def("add_counter", &Pipeline::add_counter)
+        .def("add_joint_counter", &Pipeline::add_joint_counter)
+        .def("add_umi_counter", &Pipeline::add_umi_counter)
+        .def("run", &Pipeline::run);
+
 #ifdef VERSION_INFO
     m.attr("__version__") = VERSION_INFO;
 #else
@@ -0,0 +1,76 @@
+import random
+
+import numpy as np
+
+import matcha
+from matcha import estimate_optimal_bins
+
+from .utils import random_sequence, random_mismatches
+
+def test_auto_matcher():
+    random.seed("auto")
+    barcodes = list({random_sequence(12, "ACGT") for i in range(500)})
+    queries = [random_mismatches(random.choice(barcodes), random.randint(0, 2)) for i in range(2000)]
+
+    res = matcha.auto_matcher(barcodes, 1, sample_queries=queries, max_candidates=2, min_seconds=0.01)
+    assert isinstance(res.matcher, (matcha.ListMatcher, matcha.HashMatcher))
+    assert len(res.benchmarks) == 2
+    assert res.benchmarks[0][1] == res.queries_per_second
+    assert res.benchmarks[0][1] >= res.benchmarks[1][1]
+    assert res.memory_usage == res.matcher._matcher.memory_usage() > 0
+
+    # The chosen matcher gives the same results as the list matcher within max_mismatches
+    reference = matcha.ListMatcher(barcodes).match_all(queries)
+    r = res.matcher.match_all(queries)
+    within = reference.dist <= 1
+    assert np.all(r.match[within] == reference.match[within])
+    assert np.all(r.dist[within] == reference.dist[within])
+
+def test_auto_matcher_candidates_agree():
+    # Every candidate gives the same results, including for queries beyond max_mismatches
+    random.seed("auto_agree")
+    barcodes = list({random_sequence(10, "ACGT") for i in range(200)})
+    queries = [random_mismatches(random.choice(barcodes), random.randint(0, 4)) for i in range(2000)] + ["ACGTAAAAAC"]
+    candidates = [matcha.ListMatcher(barcodes, max_mismatches=1)]
+    candidates += [matcha.HashMatcher(barcodes, 1, b) for b in estimate_optimal_bins.bin_range(10, 1)]
+    candidates.append(matcha.auto_matcher(barcodes, 1, max_candidates=10, min_seconds=0.01).matcher)
+    reference = candidates[0].match_all(queries)
+    assert 0 < np.sum(reference.match == 2**64 - 1) < len(queries)
+    for m in candidates[1:]:
+        r = m.match_all(queries)
+        assert np.all(r.match == reference.match)
+        assert np.all(r.dist == reference.dist)
+        assert np.all(r.second_best_dist == reference.second_best_dist)
+
+def test_auto_matcher_default_queries():
+    random.seed("auto_default")
+    barcodes = [random_sequence(40, "ACGT") for i in range(100)]
+    labels = [f"bc{i}" for i in range(len(barcodes))]
+    res = matcha.auto_matcher(barcodes, 2, labels=labels, min_seconds=0.01)
+    # Barcodes longer than 32bp need at least 2 hash subsequences
+    assert all(d == "list" or d.startswith("hash(subsequence_count=") and int(d[-2]) >= 2 for d, _, _ in res.benchmarks)
+    assert res.matcher.match_all([barcodes[5]]).label[0] == "bc5"
+
+def test_cost_model():
+    assert list(estimate_optimal_bins.bin_range(16, 1)) == [1, 2]
+    assert list(estimate_optimal_bins.bin_range(40, 0)) == [2]
+    # Splitting into more bins pays off for large whitelists
+    assert estimate_optimal_bins.optimal_bins(10**6, 16, 1) == 2
+    assert estimate_optimal_bins.cost(10**6, 16, 2, 1) < estimate_optimal_bins.list_cost(10**6)
+
+def test_auto_matcher_inputs(tmp_path):
+    random.seed("auto_inputs")
+    barcodes = list({random_sequence(16, "ACGT") for i in range(300)})
+    path = tmp_path / "whitelist.txt"
+    path.write_text("\n".join(barcodes) + "\n")
+    encoded = np.array([matcha.Matcher._binary_encode([b])[0, 0] for b in barcodes], dtype=np.uint64)
+    queries = [random_mismatches(random.choice(barcodes), random.randint(0, 1)) for i in range(500)]
+    reference = matcha.ListMatcher(barcodes).match_all(queries)
+
+    for sequences, kwargs in [(str(path), {}), (encoded, {"sequence_length": 16})]:
+        res = matcha.auto_matcher(sequences, 1, min_seconds=0.01, threads=2, **kwargs)
+        assert res.matcher.sequence_length == 16
+        assert res.matcher._matcher.size() == len(barcodes)
+        r = res.matcher.match_all(queries)
+        within = reference.dist <= 1
+        assert np.all(r.match[within] == reference.match[within])
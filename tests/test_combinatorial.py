@@ -0,0 +1,99 @@
+import random
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import matcha
+
+from .utils import random_sequence, random_mismatches
+
+def make_rounds():
+    random.seed("combinatorial")
+    round_sequences = [[random_sequence(8, "ACGT") for i in range(12)] for r in range(3)]
+    round_labels = [[f"R{r}_{i:02d}" for i in range(12)] for r in range(3)]
+    # Linker sequences between rounds, as in split-pool designs
+    offsets = [0, 12, 24]
+    matchers = [
+        matcha.ListMatcher(round_sequences[0], round_labels[0]),
+        matcha.HashMatcher(round_sequences[1], 1, 2, round_labels[1]),
+        matcha.TableMatcher(round_sequences[2], round_labels[2]),
+    ]
+    return round_sequences, round_labels, offsets, matchers
+
+def random_reads(round_sequences, count):
+    reads = []
+    for i in range(count):
+        parts = [random_mismatches(random.choice(seqs), random.choice([0, 0, 1, 2])) for seqs in round_sequences]
+        reads.append(parts[0] + "ACGT" + parts[1] + "ACGT" + parts[2] + "TT")
+    return reads
+
+def test_combinatorial_match():
+    round_sequences, round_labels, offsets, matchers = make_rounds()
+    m = matcha.CombinatorialMatcher(list(zip(matchers, offsets)), separator="-")
+    assert m.sequence_length == 32
+    reads = random_reads(round_sequences, 2000)
+    
+    res = m.match_all(reads, start=0, threads=2)
+    round_results = [rm.match_all(reads, start=offset) for rm, offset in zip(matchers, offsets)]
+
+    matched = np.all([r.match != 2**64 - 1 for r in round_results], axis=0)
+    expected_match = round_results[0].match + 12 * (round_results[1].match + 12 * round_results[2].match)
+    assert np.all(res.match[matched] == expected_match[matched])
+    assert np.all(res.match[~matched] == 2**64 - 1)
+    assert 0 < matched.sum() < len(reads)
+
+    for r in range(3):
+        assert np.all(res.round_matches[r][matched] == round_results[r].match[matched])
+        assert np.all(res.round_dists[r] == round_results[r].dist)
+    total = np.minimum(sum(r.dist for r in round_results), 63)
+    assert np.all(res.dist == total)
+    second = np.minimum(total + np.min([r.second_best_dist - r.dist for r in round_results], axis=0), 63)
+    assert np.all(res.second_best_dist == second)
+
+    expected_labels = ["-".join(round_labels[r][round_results[r].match[i]] for r in range(3)) if matched[i] else ""
+        for i in range(len(reads))]
+    assert res.label.tolist() == expected_labels
+    assert m.labels[expected_match[matched][0]] == expected_labels[np.argmax(matched)]
+
+def test_combinatorial_output_names(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    round_sequences, round_labels, offsets, matchers = make_rounds()
+    reads = random_reads(round_sequences, 300)
+    with open(tmpdir / "R1", "w") as f:
+        for i, read in enumerate(reads):
+            f.write(f"@read{i}\nGG{read}\n+\n{'F' * (len(read) + 2)}\n")
+
+    m = matcha.CombinatorialMatcher(list(zip(matchers, offsets)))
+    expected = m.match_all(reads).label
+
+    f = matcha.FastqReader()
+    f.add_sequence("R1", tmpdir / "R1", tmpdir / "R1_out")
+    f.add_barcode("cell", m, "R1", match_start=2)
+    f.set_output_names("{cell}:{read_name}")
+    while f.read_chunk(128):
+        f.write_chunk()
+    f.close()
+
+    names = [l[1:].split(":")[0] for l in (tmpdir / "R1_out").read_text().splitlines()[::4]]
+    assert names == expected.tolist()
+
+def test_combinatorial_invalid():
+    with pytest.raises(ValueError):
+        matcha.CombinatorialMatcher([])
+    rounds = [(matcha.ListMatcher(["ACGT", "TTTT"]), 4 * r) for r in range(9)]
+    with pytest.raises(ValueError):
+        matcha.CombinatorialMatcher(rounds)
+
+def test_combinatorial_count_limit(tmpdir):
+    # Four rounds of 96 barcodes have about 85M combinations, too many for dense per-index counts
+    random.seed("combinatorial_count")
+    round_matcher = matcha.ListMatcher(list({random_sequence(8, "ACGT") for i in range(200)})[:96])
+    m = matcha.CombinatorialMatcher([(round_matcher, 8 * r) for r in range(4)])
+    path = Path(str(tmpdir)) / "R1"
+    path.write_text(f"@read0\n{'A' * 32}\n+\n{'F' * 32}\n")
+    f = matcha.FastqReader()
+    f.add_sequence("R1", path)
+    f.add_barcode("cell", m, "R1", count=True)
+    with pytest.raises(ValueError, match="too many match indexes"):
+        f.read_chunk(10)
@@ -42,6 +42,18 @@ def test_binary_conversion_vectorized():
 
     assert np.all(np.array(no_vector).T == vector)
 
+def test_long_sequence_N():
+    sequence = "ACGTACGTACGTACGTACGT"
+    query = sequence[:18] + "N" + sequence[19:]
+    m = _matcha.ListMatcher()
+    m.add_sequences([sequence])
+    res = m.match_all([query, sequence[:15]], 0, len(sequence))
+    assert res[1,0] & 63 == 1
+    # Bases past the end of a query count as mismatches
+    assert res[1,1] & 63 == 5
+    binary, flag = _matcha.stringToBinary(query)
+    assert _matcha.binaryToString(binary, len(query), flag) == query
+
 def mismatch_compare(sequence_length):
     # Test matching against 3 sequences, make sure match, top dist, and 2nd best dist are right
     seqs = [random_sequence(sequence_length, "ATGC") for i in range(3)]
@@ -72,3 +84,32 @@ def test_mismatches_random_long():
     random.seed("happyseed2")
     for i in range(3000):
         mismatch_compare(10)
+
+def test_binary_words():
+    sequence = "ACGTACGTACGTACGTACGTACGTACGTACGTTGCAN"
+    seq, flag = _matcha.stringToBinaryWords(sequence)
+    assert len(seq) == 2 and len(flag) == 2
+    assert (seq[0], flag[0]) == _matcha.stringToBinary(sequence[:32])
+    assert (seq[1], flag[1]) == _matcha.stringToBinary(sequence[32:])
+    assert _matcha.binaryWordsToString(seq, len(sequence), flag) == sequence
+
+def test_joint_counter_large_indexes():
+    # Match indexes past 2^32 (e.g. packed CombinatorialMatcher indexes) are counted as distinct pairs
+    unmatched = 2**64 - 1
+    a = np.array([[2**32 - 1, 2**32, 2**40 + 3, unmatched, 2**32], [0] * 5], dtype=np.uint64)
+    b = np.array([[1, 2**33, 5, 7, 2**33], [0] * 5], dtype=np.uint64)
+    counter = _matcha.JointCounter()
+    counter.add(a, b)
+    match_a, match_b, count = counter.get_counts()
+    assert match_a.tolist() == [2**32 - 1, 2**32, 2**40 + 3, unmatched]
+    assert match_b.tolist() == [1, 2**33, 5, 7]
+    assert count.tolist() == [1, 2, 1, 1]
+
+def test_counters_empty_results():
+    empty = np.zeros((2, 0), dtype=np.uint64)
+    counter = _matcha.MatchCounter(_matcha.ListMatcher())
+    counter.add(empty)
+    assert counter.get_match_counts().sum() == 0
+    joint = _matcha.JointCounter()
+    joint.add(empty, empty)
+    assert [c.tolist() for c in joint.get_counts()] == [[], [], []]
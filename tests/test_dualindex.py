@@ -0,0 +1,110 @@
+import random
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import matcha
+
+from .utils import hamming_dist, random_sequence, random_mismatches
+
+def reverse_complement(seq):
+    return seq[::-1].translate(str.maketrans("ACGTN", "TGCAN"))
+
+def make_pairs():
+    random.seed("dual index")
+    # i7s and i5s are shared between some pairs, as in combinatorial plate layouts
+    i7s = [random_sequence(8, "ACGT") for i in range(12)]
+    i5s = [random_sequence(10, "ACGT") for i in range(8)]
+    pairs = random.sample([(a, b) for a in i7s for b in i5s], 40)
+    return pairs, i7s, i5s
+
+def reference_match(pairs, i7, i5, max_i7, max_i5, orientation):
+    """Brute force (match, dist, second_best_dist, i7_dist, i5_dist) for one read"""
+    candidates = []
+    for p, (a, b) in enumerate(pairs):
+        d7 = hamming_dist(i7, a)
+        d5 = min(
+            hamming_dist(i5, b) if orientation != "reverse_complement" else 63, 
+            hamming_dist(i5, reverse_complement(b)) if orientation != "forward" else 63
+        )
+        if d7 <= max_i7 and d5 <= max_i5:
+            candidates.append((d7 + d5, p, d7, d5))
+    candidates.sort()
+    if not candidates:
+        return (2**64 - 1, 63, 63)
+    second = candidates[1][0] if len(candidates) > 1 else 63
+    return (candidates[0][1], candidates[0][0], second, candidates[0][2], candidates[0][3])
+
+def random_reads(pairs, count, orientation):
+    reads = []
+    for i in range(count):
+        a, b = random.choice(pairs)
+        if orientation == "reverse_complement" or (orientation == "both" and random.random() < 0.5):
+            b = reverse_complement(b)
+        reads.append((random_mismatches(a, random.choice([0, 0, 1, 2])), random_mismatches(b, random.choice([0, 0, 1, 3]))))
+    return reads
+
+@pytest.mark.parametrize("orientation", ["forward", "reverse_complement", "both"])
+def test_dual_index_match(orientation):
+    pairs, _, _ = make_pairs()
+    m = matcha.DualIndexMatcher(pairs, max_i7_mismatches=1, max_i5_mismatches=2, i5_orientation=orientation)
+    reads = random_reads(pairs, 1000, orientation)
+
+    res = m.match_all([a + b for a, b in reads])
+    expected = [reference_match(pairs, a, b, 1, 2, orientation) for a, b in reads]
+    assert res.match.tolist() == [e[0] for e in expected]
+    assert res.dist.tolist() == [e[1] for e in expected]
+    assert res.second_best_dist.tolist() == [e[2] for e in expected]
+    matched = res.match != 2**64 - 1
+    assert 0 < matched.sum() < len(reads)
+    assert res.i7_dist[matched].tolist() == [e[3] for e in expected if e[0] != 2**64 - 1]
+    assert res.i5_dist[matched].tolist() == [e[4] for e in expected if e[0] != 2**64 - 1]
+    if orientation == "both":
+        assert 0 < res.i5_reverse_complement[matched].sum() < matched.sum()
+    else:
+        assert res.i5_reverse_complement.sum() == (orientation == "reverse_complement") * matched.sum()
+
+def test_dual_index_invalid():
+    with pytest.raises(ValueError):
+        matcha.DualIndexMatcher([("ACGT", "ACGTA"), ("ACGTT", "ACGTA")])
+    with pytest.raises(ValueError):
+        matcha.DualIndexMatcher([("ACGT", "ACGT")], i5_orientation="reverse")
+    with pytest.raises(ValueError):
+        matcha.FastqReader().add_barcode("sample", matcha.ListMatcher(["ACGT"]), ("I1", "I2"))
+
+@pytest.mark.parametrize("use_pipeline", [False, True])
+def test_dual_index_fastqs(tmpdir, use_pipeline):
+    tmpdir = Path(str(tmpdir))
+    pairs, _, _ = make_pairs()
+    labels = [f"S{i}" for i in range(len(pairs))]
+    reads = random_reads(pairs, 500, "reverse_complement")
+    with open(tmpdir / "I1", "w") as i1, open(tmpdir / "I2", "w") as i2:
+        for i, (a, b) in enumerate(reads):
+            i1.write(f"@read{i}\n{a}\n+\n{'F' * len(a)}\n")
+            i2.write(f"@read{i}\nTT{b}\n+\n{'F' * (len(b) + 2)}\n")
+
+    m = matcha.DualIndexMatcher(pairs, labels, i5_orientation="reverse_complement")
+    expected = m.match_all([a + b for a, b in reads])
+
+    f = matcha.Pipeline() if use_pipeline else matcha.FastqReader()
+    f.add_sequence("I1", tmpdir / "I1", tmpdir / "I1_out")
+    f.add_sequence("I2", tmpdir / "I2")
+    f.add_barcode("sample", m, ("I1", "I2"), match_start=(0, 2), count=True)
+    f.add_filter("sample.dist <= 2")
+    f.set_output_names("{sample}:{read_name}")
+    if use_pipeline:
+        f.run(chunk_size=64)
+    else:
+        match = []
+        while f.read_chunk(64):
+            match.append(f.matches["sample"].match)
+            f.write_chunk()
+        f.close()
+        assert np.concatenate(match).tolist() == expected.match.tolist()
+
+    counts = f.get_counts("sample")["match"]
+    assert counts.tolist() == np.bincount(np.minimum(expected.match, len(pairs)).astype(np.int64), minlength=len(pairs) + 1).tolist()
+    passed = expected.dist <= 2
+    names = [l[1:].split(":")[0] for l in (tmpdir / "I1_out").read_text().splitlines()[::4]]
+    assert names == [labels[i] for i in expected.match[passed]]
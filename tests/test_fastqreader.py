@@ -1,11 +1,16 @@
+import collections
 import gzip
+import struct
 from pathlib import Path
 
 
+import numpy as np
 import pytest
+
+import _matcha
 import matcha
 
-from .utils import hamming_dist, random_sequence
+from .utils import hamming_dist, random_sequence, bgzf_compress
 
 def run_matcher(f):
     """Setup and run a matcher for the fastq data
@@ -93,6 +98,480 @@ def test_gzip_io(tmpdir):
         assert output[0] == f"@i5_1+i7_1:{input_text[0][1:]}"
         assert output[4] == f"@i5_4+i7_4:{input_text[12][1:]}"
 
+def check_output_text(output_text, read):
+    output = output_text.splitlines()
+    input_text = test_data[read].splitlines()
+
+    # Check that sequence and quality are preserved
+    assert output[1:4] == input_text[1:4]
+    assert output[5:8] == input_text[13:16]
+
+    assert output[0] == f"@i5_1+i7_1:{input_text[0][1:]}"
+    assert output[4] == f"@i5_4+i7_4:{input_text[12][1:]}"
+
+@pytest.mark.parametrize("input_threads", [0, 1, 3])
+def test_bgzf_input(tmpdir, input_threads):
+    tmpdir = Path(str(tmpdir))
+    f = matcha.FastqReader()
+    for read in ["R1", "R2", "I1", "I2"]:
+        path = tmpdir / (read + ".gz")
+        # Use small blocks so records span block boundaries
+        path.write_bytes(bgzf_compress(test_data[read].encode(), block_size=37))
+        f.add_sequence(read, path, tmpdir / (read + "_out"), input_threads=input_threads)
+
+    run_matcher(f)
+
+    for read in ["R1", "R2", "I1", "I2"]:
+        check_output_text((tmpdir / (read + "_out")).read_text(), read)
+
+@pytest.mark.parametrize("input_threads", [0, 2])
+def test_bgzf_empty_blocks(tmpdir, input_threads):
+    tmpdir = Path(str(tmpdir))
+    # An empty bgzip file holds only the EOF marker block
+    (tmpdir / "empty.gz").write_bytes(bgzf_compress(b""))
+    f = matcha.FastqReader()
+    f.add_sequence("R1", tmpdir / "empty.gz", input_threads=input_threads)
+    assert f.read_chunk(100) == 0
+    f.close()
+
+    # Add single-block chunks until the compressed size passes 1MB, so the EOF block is read alone in the next batch
+    rng = np.random.default_rng(20)
+    data, records = bytearray(), 0
+    while len(data) < 1 << 20:
+        chunk = "".join(
+            f"@read{records + i}\n{''.join(rng.choice(list('ACGT'), 100))}\n+\n" +
+            "".join(chr(33 + q) for q in rng.integers(2, 41, 100)) + "\n"
+            for i in range(200)
+        )
+        data += bgzf_compress(chunk.encode())[:-28]
+        records += 200
+    (tmpdir / "R1.gz").write_bytes(bytes(data) + bgzf_compress(b""))
+    f = matcha.FastqReader()
+    f.add_sequence("R1", tmpdir / "R1.gz", input_threads=input_threads)
+    total = 0
+    while f.read_chunk(5000):
+        names = f.get_sequence_name("R1")
+        assert names[0] == f"read{total}"
+        total += len(names)
+    assert total == records
+    f.close()
+
+@pytest.mark.parametrize("input_threads", [0, 1])
+def test_bgzf_invalid_block_size(tmpdir, input_threads):
+    tmpdir = Path(str(tmpdir))
+    # Block sizes too small to hold the header and footer, first alone and then after a valid block
+    header = struct.pack("<BBBBIBBHBBHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, 3)
+    valid = bgzf_compress(test_data["R1"].encode())[:-28]
+    for data in [header + b"\x00", valid + header + b"\x00" * 10]:
+        path = tmpdir / "R1.gz"
+        path.write_bytes(data)
+        f = matcha.FastqReader()
+        f.add_sequence("R1", path, input_threads=input_threads)
+        with pytest.raises(RuntimeError, match="Invalid BGZF block size"):
+            while f.read_chunk(100):
+                pass
+
+@pytest.mark.parametrize("input_threads", [0, 2])
+def test_multi_member_gzip_input(tmpdir, input_threads):
+    tmpdir = Path(str(tmpdir))
+    f = matcha.FastqReader()
+    for read in ["R1", "R2", "I1", "I2"]:
+        path = tmpdir / (read + ".gz")
+        text = test_data[read].encode()
+        path.write_bytes(gzip.compress(text[:100]) + gzip.compress(text[100:]))
+        f.add_sequence(read, path, tmpdir / (read + "_out"), input_threads=input_threads)
+
+    run_matcher(f)
+
+    for read in ["R1", "R2", "I1", "I2"]:
+        check_output_text((tmpdir / (read + "_out")).read_text(), read)
+
+@pytest.mark.parametrize("input_threads", [0, 2])
+def test_gzip_trailing_bytes(tmpdir, input_threads):
+    tmpdir = Path(str(tmpdir))
+    text = test_data["R1"].encode()
+    padded = tmpdir / "padded.gz"
+    padded.write_bytes(gzip.compress(text[:100]) + gzip.compress(text[100:]) + bytes(1000))
+    f = matcha.FastqReader()
+    f.add_sequence("R1", padded, input_threads=input_threads)
+    assert f.read_chunk(100) == len(text.splitlines()) // 4
+    f.close()
+
+    garbage = tmpdir / "garbage.gz"
+    garbage.write_bytes(gzip.compress(text[:100]) + b"\x00\x00not gzip")
+    f = matcha.FastqReader()
+    f.add_sequence("R1", garbage, input_threads=input_threads)
+    with pytest.raises(RuntimeError, match="Trailing garbage"):
+        f.read_chunk(100)
+
+@pytest.mark.parametrize("prefetch", [1, 3])
+def test_prefetch_io(tmpdir, prefetch):
+    tmpdir = Path(str(tmpdir))
+    f = matcha.FastqReader(threads=2, prefetch=prefetch)
+    for read in ["R1", "R2", "I1", "I2"]:
+        path = tmpdir / (read + ".gz")
+        path.write_bytes(gzip.compress(test_data[read].encode()))
+        f.add_sequence(read, path, tmpdir / (read + "_out"))
+
+    run_matcher(f)
+
+    for read in ["R1", "R2", "I1", "I2"]:
+        check_output_text((tmpdir / (read + "_out")).read_text(), read)
+
+def test_prefetch_chunk_size_change(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    f = matcha.FastqReader(prefetch=2)
+    path = tmpdir / "R1"
+    path.write_text(test_data["R1"])
+    f.add_sequence("R1", path)
+    
+    names = [l[1:] for l in test_data["R1"].splitlines()[::4]]
+    assert f.read_chunk(2) == 2
+    assert list(f.get_sequence_name("R1")) == names[0:2]
+    assert f.read_chunk(1) == 1
+    assert list(f.get_sequence_name("R1")) == names[2:3]
+    assert f.read_chunk(3) == 2
+    assert list(f.get_sequence_name("R1")) == names[3:5]
+    assert f.read_chunk(3) == 0
+    f.close()
+
+@pytest.mark.parametrize("output_threads,compression_level", [(0, 6), (1, 1), (4, 9), (2, 0)])
+def test_bgzf_output(tmpdir, output_threads, compression_level):
+    tmpdir = Path(str(tmpdir))
+    # Enough reads to span several BGZF blocks
+    text = "".join(f"@read{i}\n{random_sequence(100, 'ACGT')}\n+\n{'E' * 100}\n" for i in range(2000))
+    in_path = tmpdir / "R1"
+    in_path.write_text(text)
+    out_path = tmpdir / "R1_out.gz"
+    f = matcha.FastqReader()
+    f.add_sequence("R1", in_path, out_path, output_threads=output_threads, compression_level=compression_level)
+    while f.read_chunk(300):
+        f.write_chunk(np.ones(300, dtype=bool))
+    f.close()
+
+    data = out_path.read_bytes()
+    assert gzip.decompress(data).decode() == text
+    # BGZF header with BC extra field, and the standard 28-byte EOF block
+    assert data[:4] == b"\x1f\x8b\x08\x04" and data[12:16] == b"BC\x02\x00"
+    assert data[-28:] == bgzf_compress(b"")
+    
+    # Read it back in with parallel BGZF decompression
+    f = matcha.FastqReader()
+    f.add_sequence("R1", out_path, input_threads=3)
+    assert f.read_chunk(5000) == 2000
+    assert list(f.get_sequence_read("R1")) == text.splitlines()[1::4]
+
+def test_input_stats(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    f = matcha.FastqReader()
+    path = tmpdir / "R1.gz"
+    path.write_bytes(gzip.compress(test_data["R1"].encode()))
+    f.add_sequence("R1", path)
+    while f.read_chunk(2):
+        pass
+    stats = f.get_input_stats("R1")
+    assert stats["compressed_bytes"] == path.stat().st_size
+    assert stats["uncompressed_bytes"] == len(test_data["R1"].encode())
+    assert stats["mb_per_second"] > 0
+    f.close()
+
+def test_missing_final_newline(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    f = matcha.FastqReader()
+    path = tmpdir / "R1"
+    path.write_text(test_data["R1"].rstrip("\n"))
+    f.add_sequence("R1", path)
+    assert f.read_chunk(10) == 5
+    assert f.get_sequence_qual("R1")[4] == test_data["R1"].splitlines()[-1]
+
+def test_sequence_views(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    f = matcha.FastqReader()
+    for read in ["R1", "I1"]:
+        path = tmpdir / read
+        path.write_text(test_data[read])
+        f.add_sequence(read, path)
+    
+    input_lines = test_data["R1"].splitlines()
+    assert f.read_chunk(3) == 3
+    reads = f.get_sequence_read("R1", as_bytes=True)
+    umis = f.get_sequence_read("R1", start=16, end=28, as_bytes=True)
+    assert reads.dtype == "S36"
+    assert list(reads) == [l.encode() for l in input_lines[1:12:4]]
+    assert list(umis) == [l[16:28].encode() for l in input_lines[1:12:4]]
+    assert list(f.get_sequence_qual("R1", end=5)) == [l[:5] for l in input_lines[3:12:4]]
+    assert list(f.get_sequence_name("I1")) == [l[1:] for l in test_data["I1"].splitlines()[0:12:4]]
+
+    # Views stay valid after reading the next chunk
+    assert f.read_chunk(3) == 2
+    assert list(reads) == [l.encode() for l in input_lines[1:12:4]]
+    assert list(f.get_sequence_read("R1")) == input_lines[13::4]
+
+def test_variable_length_reads(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    f = matcha.FastqReader()
+    path = tmpdir / "R1"
+    path.write_text("@a\nACGT\n+\nEEEE\n@b\nAC\n+\nEE\n@c\nACGTAC\n+\nEEEEEE\n")
+    f.add_sequence("R1", path)
+    assert f.read_chunk(10) == 3
+    assert list(f.get_sequence_read("R1")) == ["ACGT", "AC", "ACGTAC"]
+    assert list(f.get_sequence_read("R1", start=1, end=4)) == ["CGT", "C", "CGT"]
+    assert list(f.get_sequence_name("R1")) == ["a", "b", "c"]
+
+def test_output_labels(tmpdir):
+    # Labels are read from HashMatchers (including one loaded from an index file), and are empty for unmatched reads
+    tmpdir = Path(str(tmpdir))
+    matcha.HashMatcher(["TCCGAGCC", "ACAGGCGC"], 1, 2, ["i5_1", "i5_4"]).save(str(tmpdir / "i5.idx"))
+    
+    f = matcha.FastqReader()
+    (tmpdir / "I2").write_text(test_data["I2"])
+    f.add_sequence("I2", tmpdir / "I2", tmpdir / "I2_out")
+    f.add_barcode("cell_i5", matcha.HashMatcher.load(str(tmpdir / "i5.idx")), "I2")
+    f.set_output_names("{cell_i5}:{read_name}")
+    while f.read_chunk(2):
+        f.write_chunk(np.ones(2, dtype=bool))
+    f.close()
+
+    names = [l.split(":")[0] for l in (tmpdir / "I2_out").read_text().splitlines()[::4]]
+    assert names == ["@i5_1", "@", "@", "@i5_4", "@"]
+
+def test_output_name_fields(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    f = matcha.FastqReader()
+    (tmpdir / "I1").write_text(test_data["I1"])
+    f.add_sequence("I1", tmpdir / "I1", tmpdir / "I1_out")
+    f.set_output_names("L{lane}_T{tile}_{x}_{y}#{read_name}/end")
+    while f.read_chunk(2):
+        f.write_chunk(np.ones(2, dtype=bool))
+    f.close()
+
+    output = (tmpdir / "I1_out").read_text().splitlines()
+    input_text = test_data["I1"].splitlines()
+    for i in range(0, len(input_text), 4):
+        read_name = input_text[i][1:]
+        lane, tile, x, y = read_name.split(" ")[0].split(":")[3:7]
+        assert output[i] == f"@L{lane}_T{tile}_{x}_{y}#{read_name}/end"
+        assert output[i+1:i+4] == input_text[i+1:i+4]
+
+def write_random_fastq(path, barcodes, count, seed):
+    rng = np.random.default_rng(seed)
+    with open(path, "w") as f:
+        for i in range(count):
+            seq = list(barcodes[rng.integers(len(barcodes))])
+            for pos in rng.choice(len(seq), rng.integers(0, 3), replace=False):
+                seq[pos] = "ACGTN"[rng.integers(5)]
+            qual = "".join(chr(33 + q) for q in rng.integers(2, 41, len(seq)))
+            f.write(f"@read{i}\n{''.join(seq)}\n+\n{qual}\n")
+
+def test_add_filter(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    barcodes = [random_sequence(10, "ACGT") for i in range(20)]
+    labels = [f"bc{i % 5}" for i in range(20)]
+    write_random_fastq(tmpdir / "I1", barcodes, 3000, 14)
+    matcher = matcha.ListMatcher(barcodes, labels)
+
+    ref = matcha.FastqReader()
+    ref.add_sequence("I1", tmpdir / "I1", tmpdir / "I1_ref")
+    ref.add_barcode("bc", matcher, "I1")
+    
+    f = matcha.FastqReader()
+    f.add_sequence("I1", tmpdir / "I1", tmpdir / "I1_out")
+    f.add_barcode("bc", matcher, "I1")
+    f.add_filter("bc.dist <= 1")
+    f.add_filter("bc.second_best_dist > 1")
+    f.add_filter("bc.label not in excluded", excluded={"bc3"})
+    f.add_filter("bc.label not in ['undetermined']")
+    f.add_filter("bc.match in [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16]")
+    f.add_filter("bc.min_qual >= 10")
+
+    total_passed = 0
+    while ref.read_chunk(700):
+        assert f.read_chunk(700) == len(ref.matches["bc"].match)
+        m = ref.matches["bc"]
+        quals = ref.get_sequence_qual("I1", as_bytes=True).view(np.uint8).reshape(-1, 10)
+        expected = (m.dist <= 1) & (m.second_best_dist > 1) & ~np.isin(m.match, [3, 8, 13, 18]) & (m.match <= 16) & \
+            (quals.min(axis=1) >= 10 + 33)
+        assert np.all(f.passed_filters == expected)
+        total_passed += expected.sum()
+        ref.write_chunk(expected)
+        f.write_chunk()
+    ref.close()
+    f.close()
+    assert 0 < total_passed < 3000
+    assert (tmpdir / "I1_out").read_text() == (tmpdir / "I1_ref").read_text()
+
+def test_invalid_filters():
+    f = matcha.FastqReader()
+    f.add_sequence("I1", "unused")
+    f.add_barcode("bc", matcha.ListMatcher(["ACGT"], ["a"]), "I1")
+    with pytest.raises(ValueError):
+        f.add_filter("bc.dist = 1")
+    with pytest.raises(ValueError):
+        f.add_filter("bc.label in 'a'")
+    f.add_filter("bc.label in ['b']")
+    with pytest.raises(ValueError):
+        f._make_read_filter()
+
+def test_filter_empty_chunk(tmpdir):
+    path = Path(str(tmpdir)) / "I1"
+    path.write_text("")
+    fastq_file = _matcha.FastqFile(str(path), [""], [], "", 1, 0, 0, 1)
+    assert fastq_file.read_chunk(10) == 0
+    read_filter = _matcha.ReadFilter()
+    read_filter.add_condition(0, "dist", "<=", 1)
+    assert len(read_filter.evaluate([np.zeros((2, 0), dtype=np.uint64)], [fastq_file], [0], [4])) == 0
+
+def test_find_labels():
+    barcodes = ["AAAA", "CCCC", "GGGG", "TTTT"]
+    m = matcha.ListMatcher(barcodes, ["x", "y", "x", "z"])
+    assert m._matcher.find_labels(["x", "z", "w", "x"]) == ([0, 2, 3], ["w"])
+    # Labels decoded from sequences when none are given
+    m = matcha.ListMatcher(barcodes)
+    assert m._matcher.find_labels(["GGGG", "ACGT"]) == ([2], ["ACGT"])
+
+@pytest.mark.parametrize("suffix", ["", ".gz"])
+def test_demux_output(tmpdir, suffix):
+    tmpdir = Path(str(tmpdir))
+    barcodes = [random_sequence(10, "ACGT") for i in range(20)]
+    labels = [f"s{i % 7}" for i in range(20)]
+    write_random_fastq(tmpdir / "I1", barcodes, 3000, 15)
+    matcher = matcha.HashMatcher(barcodes, 1, 2, labels)
+
+    # Reference matches for all reads in one chunk
+    ref = matcha.FastqReader()
+    ref.add_sequence("I1", tmpdir / "I1")
+    ref.add_barcode("sample", matcher, "I1")
+    ref.read_chunk(10000)
+    names = ref.get_sequence_name("I1")
+    match = ref.matches["sample"].match
+    dist = ref.matches["sample"].dist
+    second_best_dist = ref.matches["sample"].second_best_dist
+    ref.close()
+
+    f = matcha.FastqReader()
+    f.add_sequence("I1", tmpdir / "I1", str(tmpdir / "{sample}_I1.fastq") + suffix, max_open_files=2)
+    f.add_barcode("sample", matcher, "I1")
+    f.add_filter("sample.second_best_dist > 0")
+    f.set_output_names("{read_name}_{sample}")
+    while f.read_chunk(500):
+        f.write_chunk()
+    f.close()
+
+    opener = gzip.open if suffix else open
+    for label in set(labels) | {"unmatched"}:
+        with opener(tmpdir / f"{label}_I1.fastq{suffix}", "rt") as out:
+            output_names = out.read().splitlines()[::4]
+        expected = [
+            f"@{name}_{labels[m] if d <= 1 else ''}" for name, m, d, sd in zip(names, match, dist, second_best_dist) 
+            if (labels[m] if d <= 1 else "unmatched") == label and sd > 0
+        ]
+        assert output_names == expected
+        assert len(expected) > 0
+
+@pytest.mark.parametrize("create_empty_files", [False, True])
+def test_demux_empty_outputs(tmpdir, create_empty_files):
+    tmpdir = Path(str(tmpdir))
+    barcodes = [random_sequence(10, "ACGT") for i in range(3)]
+    write_random_fastq(tmpdir / "I1", barcodes[:2], 100, 18)
+    matcher = matcha.ListMatcher(barcodes, ["a", "b", "c"])
+
+    f = matcha.FastqReader()
+    f.add_sequence("I1", tmpdir / "I1", str(tmpdir / "{sample}.fastq.gz"), create_empty_files=create_empty_files)
+    f.add_barcode("sample", matcher, "I1")
+    f.add_filter("sample.dist <= 1")
+    while f.read_chunk(30):
+        f.write_chunk()
+    f.close()
+
+    assert (tmpdir / "a.fastq.gz").exists() and (tmpdir / "b.fastq.gz").exists()
+    assert (tmpdir / "c.fastq.gz").exists() == create_empty_files
+    assert (tmpdir / "unmatched.fastq.gz").exists() == create_empty_files
+    if create_empty_files:
+        assert gzip.open(tmpdir / "c.fastq.gz").read() == b""
+
+def test_demux_unlabeled_limit(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    write_random_fastq(tmpdir / "I1", ["ACGTACGTAC"], 10, 19)
+    barcodes = np.arange(20000, dtype=np.uint64)
+    f = matcha.FastqReader()
+    f.add_sequence("I1", tmpdir / "I1", str(tmpdir / "{cell}.fastq"))
+    f.add_barcode("cell", matcha.HashMatcher(barcodes, 1, 2, sequence_length=10), "I1")
+    with pytest.raises(ValueError):
+        f.read_chunk(10)
+
+def test_demux_invalid_template(tmpdir):
+    f = matcha.FastqReader()
+    with pytest.raises(ValueError):
+        f.add_sequence("I1", "unused", "{a}_{b}.fastq")
+    f.add_sequence("I1", "unused", "{sample}.fastq")
+    with pytest.raises(ValueError):
+        f.read_chunk(10)
+
+def test_counts(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    cells = [random_sequence(10, "ACGT") for i in range(30)]
+    features = [random_sequence(8, "ACGT") for i in range(5)]
+    write_random_fastq(tmpdir / "I1", cells, 2000, 16)
+    write_random_fastq(tmpdir / "I2", features, 2000, 17)
+    cell_matcher = matcha.HashMatcher(cells, 1, 2)
+    feature_matcher = matcha.ListMatcher(features)
+
+    f = matcha.FastqReader()
+    f.add_sequence("I1", tmpdir / "I1")
+    f.add_sequence("I2", tmpdir / "I2")
+    f.add_barcode("cell", cell_matcher, "I1", count=True)
+    f.add_barcode("feature", feature_matcher, "I2", count=True)
+    f.add_joint_counts("cell", "feature")
+    f.add_filter("feature.dist <= 1")
+
+    match_counts = np.zeros(len(cells) + 1, dtype=np.uint64)
+    dist_counts = np.zeros((64, 64), dtype=np.uint64)
+    pairs = collections.Counter()
+    while f.read_chunk(300):
+        cell, feature = f.matches["cell"], f.matches["feature"]
+        np.add.at(match_counts, np.minimum(cell.match, len(cells)), 1)
+        np.add.at(dist_counts, (cell.dist, cell.second_best_dist), 1)
+        passing = feature.dist <= 1
+        pairs.update(zip(cell.match[passing].tolist(), feature.match[passing].tolist()))
+    f.close()
+
+    counts = f.get_counts("cell")
+    assert np.all(counts["match"] == match_counts)
+    assert np.all(counts["dist"] == dist_counts)
+    assert f.get_counts("feature")["match"].sum() == 2000
+    
+    match_a, match_b, count = f.get_joint_counts("cell", "feature")
+    expected = sorted(pairs.items())
+    assert list(zip(match_a.tolist(), match_b.tolist())) == [k for k, v in expected]
+    assert count.tolist() == [v for k, v in expected]
+    assert match_a[-1] == 2**64 - 1
+
+@pytest.mark.parametrize("use_pipeline", [False, True])
+def test_wide_barcodes(tmpdir, use_pipeline):
+    # Barcodes longer than 32 bases are matched natively from fastq chunks
+    tmpdir = Path(str(tmpdir))
+    barcodes = [random_sequence(50, "ACGT") for i in range(40)]
+    labels = [f"spot{i}" for i in range(40)]
+    write_random_fastq(tmpdir / "R1", barcodes, 1000, 18)
+    m = matcha.HashMatcher(barcodes, 2, 3, labels)
+    reads = [l for l in (tmpdir / "R1").read_text().splitlines()[1::4]]
+    expected = matcha.ListMatcher(barcodes).match_all(reads)
+
+    f = matcha.Pipeline() if use_pipeline else matcha.FastqReader()
+    f.add_sequence("R1", tmpdir / "R1", tmpdir / "R1_out")
+    f.add_barcode("spot", m, "R1", count=True)
+    f.set_output_names("{spot}:{read_name}")
+    if use_pipeline:
+        f.run(chunk_size=300)
+    else:
+        while f.read_chunk(300):
+            f.write_chunk(np.ones(f.matches["spot"].match.shape, dtype=bool))
+        f.close()
+
+    assert f.get_counts("spot")["match"][:-1].tolist() == np.bincount(expected.match, minlength=40).tolist()
+    names = [l[1:].split(":")[0] for l in (tmpdir / "R1_out").read_text().splitlines()[::4]]
+    assert names == [labels[i] for i in expected.match]
+
 test_data = {}
 test_data["I1"] = """\
 @NB551514:265:H5KHFBGXC:1:23208:10434:9061 1:N:0:0
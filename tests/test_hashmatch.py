@@ -1,3 +1,4 @@
+import gzip
 import random
 
 import pytest
@@ -111,4 +112,187 @@ def test_all_different():
         r = matcha.HashMatcher(barcode_sequences, sequence_len, subseqs).match_all(["C" * sequence_len])
         assert list(r.match) == [0]
         assert list(r.dist) == [sequence_len]
-        assert list(r.second_best_dist) == [sequence_len]
\ No newline at end of file
+        assert list(r.second_best_dist) == [sequence_len]
+
+
+def test_threaded_matching():
+    random.seed("threaded")
+    sequence_len = 12
+    barcode_sequences = [random_sequence(sequence_len, "ATGC") for i in range(500)]
+    mismatch_against = random.choices(barcode_sequences, k=20000)
+    sequences = [random_mismatches(b, random.randint(0, 2)) for b in mismatch_against]
+
+    m = matcha.HashMatcher(barcode_sequences, 2, 2)
+    single = m.match_all(sequences)
+    threaded = m.match_all(sequences, threads=4)
+    assert np.all(single.match == threaded.match)
+    assert np.all(single.dist == threaded.dist)
+    assert np.all(single.second_best_dist == threaded.second_best_dist)
+
+    binary = _matcha.stringsToBinary(sequences, 0, sequence_len)
+    raw = np.zeros_like(binary)
+    m._matcher.match_raw(binary, raw, threads=3)
+    assert np.all(raw[0] == single.match)
+
+@pytest.mark.parametrize("subseqs", [1, 2])
+def test_save_load(tmp_path, subseqs):
+    random.seed("save_load")
+    sequence_len = 16
+    barcode_sequences = [random_sequence(sequence_len, "ATGC") for i in range(1000)]
+    labels = [f"bc{i}" for i in range(len(barcode_sequences))]
+    mismatch_against = random.choices(barcode_sequences, k=2000)
+    sequences = [random_mismatches(b, random.randint(0, 3)) for b in mismatch_against]
+
+    m = matcha.HashMatcher(barcode_sequences, 2, subseqs, labels)
+    path = str(tmp_path / "index.bin")
+    m.save(path)
+    loaded = matcha.HashMatcher.load(path)
+
+    assert loaded.sequence_length == sequence_len
+    assert list(loaded.sequences) == barcode_sequences
+    assert list(loaded.labels) == labels
+
+    expected = m.match_all(sequences)
+    r = loaded.match_all(sequences, threads=2)
+    assert np.all(r.match == expected.match)
+    assert np.all(r.dist == expected.dist)
+    assert np.all(r.second_best_dist == expected.second_best_dist)
+    assert list(r.label) == list(expected.label)
+
+def test_load_invalid(tmp_path):
+    path = tmp_path / "index.bin"
+    path.write_bytes(b"not an index file")
+    with pytest.raises(RuntimeError, match="Not a matcha index file"):
+        matcha.HashMatcher.load(str(path))
+
+    matcha.HashMatcher(["ACGT", "TTTT"], 1, 2).save(str(path))
+    data = path.read_bytes()
+    path.write_bytes(data[:8] + b"\xff\x00\x00\x00" + data[12:])
+    with pytest.raises(RuntimeError, match="Unsupported index file version"):
+        matcha.HashMatcher.load(str(path))
+
+    path.write_bytes(data[:len(data) // 2])
+    with pytest.raises(RuntimeError):
+        matcha.HashMatcher.load(str(path))
+
+@pytest.mark.parametrize("sequence_len", [12, 20])
+def test_load_corrupt(tmp_path, sequence_len):
+    # Damaged index files must either fail to load or load as a matcher that is safe to use.
+    # 12bp barcodes use direct-addressed indexes and 20bp barcodes use hashed ones
+    random.seed(f"corrupt{sequence_len}")
+    barcode_sequences = [random_sequence(sequence_len, "ATGC") for i in range(30)]
+    sequences = [random_mismatches(b, 1) for b in barcode_sequences]
+    path = tmp_path / "index.bin"
+    matcha.HashMatcher(barcode_sequences, 2, 2, [f"bc{i}" for i in range(30)]).save(str(path))
+    data = path.read_bytes()
+
+    for end in range(0, len(data), 64):
+        path.write_bytes(data[:end])
+        with pytest.raises(RuntimeError):
+            matcha.HashMatcher.load(str(path))
+
+    for pos in range(16, len(data) - 7, 8):
+        for value in [b"\xff" * 8, b"\x01\x00\x00\x80\x00\x00\x00\x00"]:
+            path.write_bytes(data[:pos] + value + data[pos + 8:])
+            try:
+                loaded = matcha.HashMatcher.load(str(path))
+            except RuntimeError:
+                continue
+            loaded.match_all(sequences)
+
+@pytest.mark.parametrize("sequence_len,subseqs", [(40, 2), (64, 3), (80, 3)])
+def test_wide_barcodes(tmp_path, sequence_len, subseqs):
+    random.seed("wide hash")
+    barcode_sequences = [random_sequence(sequence_len, "ATGC") for i in range(200)]
+    sequences = [random_mismatches(random.choice(barcode_sequences), random.randint(0, 4)) for i in range(500)]
+
+    ref_results = matcha.ListMatcher(barcode_sequences).match_all(sequences)
+    m = matcha.HashMatcher(barcode_sequences, 2, subseqs)
+    r = m.match_all(sequences, threads=2)
+    assert_match_results_equal(ref_results, r, 2, sequence_len)
+    assert np.sum(r.dist <= 2) > 100
+
+    m.save(str(tmp_path / "wide.idx"))
+    loaded = matcha.HashMatcher.load(str(tmp_path / "wide.idx"))
+    assert list(loaded.sequences) == barcode_sequences
+    r2 = loaded.match_all(sequences)
+    assert np.all(r2.match == r.match)
+    assert np.all(r2.dist == r.dist)
+
+def test_wide_subsequence_too_long():
+    with pytest.raises(ValueError):
+        matcha.HashMatcher([random_sequence(40, "ATGC")], 1, 1)
+
+@pytest.mark.parametrize("gzipped", [False, True])
+def test_whitelist_file(tmp_path, gzipped):
+    random.seed("whitelist file")
+    barcode_sequences = [random_sequence(16, "ATGC") for i in range(1000)]
+    labels = [f"bc{i}" if i % 3 else s for i, s in enumerate(barcode_sequences)]
+    lines = [f"{s}\tbc{i}\textra" if i % 3 else s for i, s in enumerate(barcode_sequences)]
+    text = "\r\n".join(lines[:500]) + "\n\n" + "\n".join(lines[500:])
+    path = tmp_path / ("whitelist.txt.gz" if gzipped else "whitelist.txt")
+    if gzipped:
+        with gzip.open(path, "wt") as f:
+            f.write(text)
+    else:
+        path.write_text(text)
+
+    sequences = [random_mismatches(random.choice(barcode_sequences), random.randint(0, 2)) for i in range(2000)]
+    expected = matcha.HashMatcher(barcode_sequences, 1, 2, labels).match_all(sequences)
+    m = matcha.HashMatcher(path, 1, 2, threads=2)
+    assert m.sequence_length == 16
+    assert list(m.sequences) == barcode_sequences
+    assert list(m.labels) == labels
+    r = m.match_all(sequences)
+    assert np.all(r.match == expected.match)
+    assert np.all(r.dist == expected.dist)
+    assert list(r.label) == list(expected.label)
+
+    # Given labels replace the label column
+    m = matcha.ListMatcher(str(path), labels=[f"x{i}" for i in range(1000)])
+    assert m.match_all([barcode_sequences[7]]).label[0] == "x7"
+
+    bad = tmp_path / "bad.txt"
+    bad.write_text("ACGT\nACGTA\n")
+    with pytest.raises(RuntimeError, match="does not match size"):
+        matcha.ListMatcher(bad)
+
+@pytest.mark.parametrize("sequence_len", [16, 40])
+def test_encoded_sequences(sequence_len):
+    random.seed("encoded")
+    barcode_sequences = [random_sequence(sequence_len, "ATGC") for i in range(500)]
+    encoded = matcha.Matcher._binary_encode(barcode_sequences)[:, 0].astype(np.uint64)
+    sequences = [random_mismatches(random.choice(barcode_sequences), random.randint(0, 2)) for i in range(1000)]
+
+    expected = matcha.HashMatcher(barcode_sequences, 2, 3).match_all(sequences)
+    m = matcha.HashMatcher(encoded, 2, 3, sequence_length=sequence_len)
+    assert list(m.sequences) == barcode_sequences
+    assert list(m.labels) == barcode_sequences
+    r = m.match_all(sequences)
+    assert np.all(r.match == expected.match)
+    assert np.all(r.dist == expected.dist)
+
+    with pytest.raises(ValueError, match="sequence_length"):
+        matcha.ListMatcher(encoded)
+    with pytest.raises(ValueError):
+        matcha.ListMatcher(encoded, sequence_length=sequence_len - 2)
+
+def test_encoded_sequences_invalid():
+    # A bad row rejects the whole array, leaving the matcher unchanged
+    m = _matcha.ListMatcher()
+    with pytest.raises(ValueError, match="bits set"):
+        m.add_encoded_sequences(np.array([0b1101, 1 << 12, 3], dtype=np.uint64), 4)
+    assert m.size() == 0 and m.sequence_length() == 0
+    m.add_encoded_sequences(np.array([0b1101, 3], dtype=np.uint64), 6)
+    assert m.size() == 2 and m.sequence_length() == 6
+
+@pytest.mark.parametrize("subseqs", [1, 2, 3])
+def test_parallel_index_build(subseqs):
+    random.seed("parallel build")
+    barcode_sequences = [random_sequence(16, "ATGC") for i in range(20000)]
+    sequences = [random_mismatches(random.choice(barcode_sequences), random.randint(0, 2)) for i in range(2000)]
+    expected = matcha.HashMatcher(barcode_sequences, 2, subseqs).match_all(sequences)
+    r = matcha.HashMatcher(barcode_sequences, 2, subseqs, threads=8).match_all(sequences)
+    assert np.all(r.match == expected.match)
+    assert np.all(r.dist == expected.dist)
+    assert np.all(r.second_best_dist == expected.second_best_dist)
@@ -0,0 +1,102 @@
+import random
+
+import numpy as np
+import pytest
+
+import matcha
+
+from .utils import random_sequence, random_mismatches
+
+def prefix_edit_dist(barcode, window):
+    """Smallest edit distance between barcode and any prefix of window, with the shortest such prefix length"""
+    row = list(range(len(barcode) + 1))
+    best, aligned = row[-1], 0
+    for j, c in enumerate(window):
+        prev, row[0] = row[0], j + 1
+        for i, b in enumerate(barcode):
+            cur = min(row[i + 1] + 1, row[i] + 1, prev + (b != c or c == "N"))
+            prev, row[i + 1] = row[i + 1], cur
+        if row[-1] < best:
+            best, aligned = row[-1], j + 1
+    return best, aligned
+
+def reference_match(barcodes, windows, max_edits):
+    match, dist, second, aligned = [], [], [], []
+    for w in windows:
+        scores = [prefix_edit_dist(b, w) for b in barcodes]
+        dists = np.array([s[0] for s in scores])
+        order = np.argsort(dists, kind="stable")
+        best = order[0]
+        if dists[best] <= max_edits:
+            match.append(best)
+            dist.append(dists[best])
+            aligned.append(scores[best][1])
+        else:
+            match.append(2**64 - 1)
+            dist.append(63)
+            aligned.append(0)
+        second.append(dists[order[1]] if dists[order[1]] <= max_edits else 63)
+    return np.array(match, dtype=np.uint64), np.array(dist), np.array(second), np.array(aligned)
+
+def random_edits(seq, edits):
+    for i in range(edits):
+        kind = random.choice(["sub", "ins", "del"])
+        pos = random.randrange(len(seq))
+        if kind == "sub":
+            seq = random_mismatches(seq, 1)
+        elif kind == "ins":
+            seq = seq[:pos] + random.choice("ACGTN") + seq[pos:]
+        else:
+            seq = seq[:pos] + seq[pos + 1:]
+    return seq
+
+@pytest.mark.parametrize("max_edits", [1, 2])
+def test_indel_match(max_edits):
+    random.seed(f"indel{max_edits}")
+    k = 12
+    barcodes = [random_sequence(k, "ACGT") for i in range(200)]
+    m = matcha.IndelMatcher(barcodes, max_edits=max_edits)
+    assert m.sequence_length == k + max_edits
+
+    reads = [
+        random_edits(random.choice(barcodes), random.randint(0, 3)) + random_sequence(k, "ACGT")
+        for i in range(500)
+    ]
+    res = m.match_all(reads, threads=2)
+    match, dist, second, aligned = reference_match(barcodes, [r[:k + max_edits] for r in reads], max_edits)
+    assert np.all(res.match == match)
+    assert np.all(res.dist == dist)
+    assert np.all(res.second_best_dist == second)
+    assert np.all(res.aligned_length == aligned)
+    assert np.mean(res.dist <= max_edits) > 0.5
+
+def test_indel_shifts():
+    barcodes = ["ACGTACGTAA", "TTTTGGGGCC", "GATTACAGAT"]
+    m = matcha.IndelMatcher(barcodes, max_edits=1, extra_bases=2)
+    reads = [
+        "ACGTACGTAA" + "GGGG", # exact
+        "ACGTCGTAA" + "GGGG",  # deletion
+        "GATTACCAGAT" + "GG",  # insertion
+        "TTTTGGAGCC" + "GGGG", # substitution
+        "CCCCCCCCCC" + "CCCC", # unmatched
+    ]
+    res = m.match_all(reads)
+    assert list(res.match) == [0, 0, 2, 1, 2**64 - 1]
+    assert list(res.dist) == [0, 1, 1, 1, 63]
+    assert list(res.aligned_length) == [10, 9, 11, 10, 0]
+    assert list(res.label[:4]) == ["ACGTACGTAA", "ACGTACGTAA", "GATTACAGAT", "TTTTGGGGCC"]
+
+def test_indel_limits():
+    with pytest.raises(ValueError):
+        matcha.IndelMatcher(["ACGT"], max_edits=3)
+    with pytest.raises(ValueError):
+        matcha.IndelMatcher([random_sequence(30, "ACGT")], max_edits=2, extra_bases=3)
+
+def test_indel_wrapped():
+    # Wrapping matchers pass the whole query window, so reads with insertions still match
+    m = matcha.IndelMatcher(["ACGTACGTAC", "TTTTGGGGCC"], max_edits=1, extra_bases=2)
+    read = "ACGTTACGTACGG"
+    for wrapped in [m, matcha.PositionSearchMatcher(m, 0), matcha.CombinatorialMatcher([(m, 0)])]:
+        res = wrapped.match_all([read])
+        assert list(res.match) == [0]
+        assert list(res.dist) == [1]
@@ -17,3 +17,89 @@ def test_basic_matching():
 
     assert list(m.labels[results.match]) == labels
     assert list(results.dist) == dists
+
+@pytest.mark.parametrize("kernel", _matcha.hamming_kernels())
+def test_simd_kernels(kernel):
+    random.seed("kernels")
+    sequence_len = 14
+    barcode_sequences = ["".join(random.choices("ATGC", k=sequence_len)) for i in range(300)]
+    # Duplicate barcodes exercise tie breaking between equally good matches
+    barcode_sequences += barcode_sequences[:5]
+    queries = [
+        "".join(random.choices("ATGC" if i % 5 else "ATGCN", k=sequence_len)) 
+        for i in range(1037)
+    ]
+    queries += barcode_sequences
+    
+    default_kernel = _matcha.get_hamming_kernel()
+    try:
+        _matcha.set_hamming_kernel("scalar")
+        expected = matcha.ListMatcher(barcode_sequences).match_all(queries)
+        _matcha.set_hamming_kernel(kernel)
+        r = matcha.ListMatcher(barcode_sequences).match_all(queries, threads=2)
+    finally:
+        _matcha.set_hamming_kernel(default_kernel)
+    
+    assert np.all(r.match == expected.match)
+    assert np.all(r.dist == expected.dist)
+    assert np.all(r.second_best_dist == expected.second_best_dist)
+
+def test_invalid_kernel():
+    with pytest.raises(ValueError):
+        _matcha.set_hamming_kernel("not_a_kernel")
+
+@pytest.mark.parametrize("sequence_len", [33, 48, 70])
+def test_wide_barcodes(sequence_len):
+    # Barcodes longer than 32 bases are matched across multiple words, with the same results as a brute force search
+    random.seed("wide")
+    barcode_sequences = ["".join(random.choices("ATGC", k=sequence_len)) for i in range(40)]
+    barcode_sequences += barcode_sequences[:2]
+    queries = []
+    for i in range(300):
+        q = list(random.choice(barcode_sequences))
+        for pos in random.sample(range(sequence_len), random.randint(0, 4)):
+            q[pos] = random.choice("ATGCN")
+        queries.append("".join(q))
+    queries.append(barcode_sequences[0][:sequence_len - 3])
+
+    m = matcha.ListMatcher(barcode_sequences)
+    assert m.sequence_length == sequence_len
+    assert list(m._matcher.get_sequences()) == barcode_sequences
+    r = m.match_all(queries, threads=2)
+
+    for i, q in enumerate(queries):
+        q = q.ljust(sequence_len, "N")
+        dists = [sum(a != b for a, b in zip(q, s)) for s in barcode_sequences]
+        order = sorted(range(len(dists)), key=lambda b: (dists[b], b))
+        assert r.match[i] == order[0]
+        assert r.dist[i] == dists[order[0]]
+        assert r.second_best_dist[i] == dists[order[1]]
+
+@pytest.mark.parametrize("sequence_len", [10, 40])
+def test_label_less(sequence_len):
+    random.seed("label-less")
+    barcode_sequences = ["".join(random.choices("ATGC", k=sequence_len)) for i in range(100)]
+    m = matcha.ListMatcher(barcode_sequences)
+    labeled = matcha.ListMatcher(barcode_sequences, [f"bc{i}" for i in range(100)])
+
+    # Without labels, sequences label themselves and neither is copied in Python until accessed
+    assert not m._matcher.has_labels()
+    assert labeled._matcher.has_labels()
+    assert "sequences" not in m.__dict__ and "labels" not in m.__dict__
+    assert m._matcher.memory_usage() < labeled._matcher.memory_usage()
+
+    r = m.match_all(barcode_sequences[::-1])
+    assert list(r.label) == barcode_sequences[::-1]
+    assert "labels" not in m.__dict__
+    assert m._matcher.get_label(3) == barcode_sequences[3]
+    assert list(m.labels) == barcode_sequences
+    assert list(r.label) == barcode_sequences[::-1]
+    assert list(labeled.match_all(barcode_sequences[:3]).label) == ["bc0", "bc1", "bc2"]
+    with pytest.raises(IndexError):
+        m._matcher.get_label(100)
+
+def test_label_count():
+    with pytest.raises(ValueError):
+        matcha.ListMatcher(["ACGT", "TTTT", "GGGG"], labels=["a", "b"])
+    with pytest.raises(ValueError):
+        matcha.ListMatcher(["ACGT"], labels=["a", "b"])
@@ -0,0 +1,102 @@
+import random
+
+import pytest
+import numpy as np
+
+import matcha
+
+from .utils import random_sequence, random_mismatches
+
+@pytest.fixture
+def matcher_and_queries():
+    random.seed("match_input")
+    barcodes = [random_sequence(10, "ATGC") for i in range(50)]
+    queries = [random_mismatches(random.choice(barcodes), random.randint(0, 3)) for i in range(3000)]
+    # Longer and shorter queries, plus N's
+    queries += ["GG" + q + "TT" for q in queries[:100]]
+    queries += [q[:7] for q in queries[:100]]
+    queries += ["NNN" + q[3:] for q in queries[:100]]
+    return matcha.ListMatcher(barcodes), queries
+
+def assert_results_equal(a, b):
+    assert np.all(a.match == b.match)
+    assert np.all(a.dist == b.dist)
+    assert np.all(a.second_best_dist == b.second_best_dist)
+
+@pytest.mark.parametrize("start", [0, 2])
+def test_numpy_input(matcher_and_queries, start):
+    m, queries = matcher_and_queries
+    expected = m.match_all(queries, start)
+
+    assert_results_equal(expected, m.match_all(np.array(queries, dtype="S"), start, threads=2))
+    assert_results_equal(expected, m.match_all(np.array(queries, dtype="U"), start, threads=2))
+    
+    # Strided views are read in place
+    wide = np.array(queries + queries, dtype="S")
+    assert_results_equal(m.match_all(queries[::2], start), m.match_all(wide[:len(queries)][::2], start))
+
+def test_bytes_input(matcher_and_queries):
+    m, queries = matcher_and_queries
+    fixed = [q for q in queries if len(q) == 10]
+    data = "".join(fixed).encode()
+    expected = m.match_all(fixed)
+    assert_results_equal(expected, m.match_all(data, stride=10))
+    assert_results_equal(expected, m.match_all(memoryview(data), stride=10))
+    
+    with pytest.raises(ValueError):
+        m.match_all(data)
+
+def test_out_array(matcher_and_queries):
+    m, queries = matcher_and_queries
+    expected = m.match_all(queries)
+    out = np.zeros((2, len(queries)), dtype=np.uint64)
+    r = m.match_all(np.array(queries, dtype="S"), out=out)
+    assert_results_equal(expected, r)
+    assert np.shares_memory(r.match, out)
+    
+    # Writing into column slices of a larger array
+    big = np.zeros((2, 2 * len(queries)), dtype=np.uint64)
+    m.match_all(queries, out=big[:, len(queries):])
+    assert np.all(big[0, len(queries):] == expected.match)
+    assert np.all(big[:, :len(queries)] == 0)
+
+    with pytest.raises(ValueError):
+        m.match_all(queries, out=np.zeros((2, 5), dtype=np.uint64))
+    with pytest.raises(ValueError):
+        m.match_all(queries, out=np.zeros((2, len(queries)), dtype=np.int32))
+
+def test_empty_input(matcher_and_queries):
+    m, _ = matcher_and_queries
+    for sequences, kwargs in [([], {}), (np.array([], dtype="S10"), {}), (np.array([], dtype="U10"), {}), (b"", {"stride": 10})]:
+        res = m.match_all(sequences, **kwargs)
+        assert res.match.shape == res.dist.shape == (0,)
+    raw = m._matcher.match_arrow(np.zeros(1, dtype=np.int32), 4, np.zeros(0, dtype=np.uint8), None, 0, 0, 0, 10)
+    assert raw.shape == (2, 0)
+
+@pytest.mark.parametrize("offset_size", [4, 8])
+def test_arrow_buffers(matcher_and_queries, offset_size):
+    m, queries = matcher_and_queries
+    data = np.frombuffer("".join(queries).encode(), dtype=np.uint8)
+    offsets = np.cumsum([0] + [len(q) for q in queries]).astype(np.int32 if offset_size == 4 else np.int64)
+    
+    # Every third value is null, and the array is sliced starting at index 5
+    valid = np.arange(len(queries)) % 3 != 0
+    validity = np.packbits(valid, bitorder="little")
+    n = len(queries) - 5
+    raw = m._matcher.match_arrow(offsets, offset_size, data, validity, 5, n, 0, 10)
+    expected = m.match_all([q if v else "" for q, v in zip(queries, valid)][5:])
+    assert np.all(raw[0] == expected.match)
+    assert np.all(raw[1] == expected.dist + (expected.second_best_dist << 6))
+
+    with pytest.raises(ValueError):
+        m._matcher.match_arrow(offsets[:10], offset_size, data, None, 5, n, 0, 10)
+
+def test_arrow_input(matcher_and_queries):
+    pa = pytest.importorskip("pyarrow")
+    m, queries = matcher_and_queries
+    expected = m.match_all(queries)
+    assert_results_equal(expected, m.match_all(pa.array(queries)))
+    assert_results_equal(expected, m.match_all(pa.array(queries, type=pa.large_string())))
+    chunked = pa.chunked_array([queries[:1000], [], queries[1000:]], type=pa.string())
+    assert_results_equal(expected, m.match_all(chunked))
+    assert len(m.match_all(pa.array([], type=pa.string())).match) == 0
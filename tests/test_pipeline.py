@@ -0,0 +1,134 @@
+import gzip
+import json
+import random
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import matcha
+import matcha.cli
+
+from .test_fastqreader import test_data
+from .utils import random_sequence, random_mismatches
+
+def write_inputs(tmpdir):
+    for read in ["R1", "R2", "I1", "I2"]:
+        (tmpdir / read).write_text(test_data[read])
+
+def test_pipeline_matches_fastq_reader(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    write_inputs(tmpdir)
+
+    i5_matcher = matcha.ListMatcher(["TCCGAGCC", "ACAGGCGC"], ["i5_1", "i5_4"])
+    i7_matcher = matcha.ListMatcher(["GCCAATTC", "CTGTATTA"], ["i7_1", "i7_4"])
+    
+    # Reference output from FastqReader
+    f = matcha.FastqReader()
+    for read in ["R1", "R2", "I1", "I2"]:
+        f.add_sequence(read, tmpdir / read, tmpdir / (read + "_ref"))
+    f.add_barcode("cell_i5", i5_matcher, "I2")
+    f.add_barcode("cell_i7", i7_matcher, "I1")
+    f.set_output_names("{cell_i5}+{cell_i7}:{read_name}")
+    while f.read_chunk(2):
+        f.write_chunk((f.matches["cell_i5"].dist <= 1) & (f.matches["cell_i7"].dist <= 1))
+    f.close()
+
+    p = matcha.Pipeline()
+    for read in ["R1", "R2", "I1", "I2"]:
+        p.add_sequence(read, tmpdir / read, tmpdir / (read + "_out"))
+    p.add_barcode("cell_i5", i5_matcher, "I2")
+    p.add_barcode("cell_i7", i7_matcher, "I1")
+    p.set_output_names("{cell_i5}+{cell_i7}:{read_name}")
+    p.add_filter("cell_i5.dist <= 1")
+    p.add_filter("cell_i7.dist<=1")
+    stats = p.run(chunk_size=2)
+    
+    for read in ["R1", "R2", "I1", "I2"]:
+        assert (tmpdir / (read + "_out")).read_text() == (tmpdir / (read + "_ref")).read_text()
+    assert stats["reads"] == 5
+    assert stats["reads_passed"] == 2
+    assert stats["chunks"] == 3
+    assert sum(stats["barcodes"]["cell_i5"]["dist_counts"]) == 5
+
+def test_pipeline_large(tmpdir):
+    # Many chunks through a gzipped output and threaded matching
+    tmpdir = Path(str(tmpdir))
+    random.seed("pipeline")
+    barcodes = [random_sequence(12, "ATGC") for i in range(200)]
+    reads = [random_mismatches(random.choice(barcodes), random.randint(0, 3)) for i in range(20000)]
+    with open(tmpdir / "I1", "w") as f:
+        for i, r in enumerate(reads):
+            f.write(f"@read{i}\n{r}\n+\n{'F' * len(r)}\n")
+    
+    m = matcha.HashMatcher(barcodes, 2, 3)
+    expected = m.match_all(reads)
+    passing = (expected.dist <= 1) & (expected.second_best_dist > 1)
+
+    p = matcha.Pipeline(prefetch=2)
+    p.add_sequence("I1", tmpdir / "I1", tmpdir / "I1_out.gz", output_threads=2)
+    p.add_barcode("bc", m, "I1", threads=2, count=True)
+    p.set_output_names("{read_name}_{bc}")
+    p.add_filter("bc.dist <= 1")
+    p.add_filter("bc.second_best_dist > 1")
+    stats = p.run(chunk_size=1000)
+
+    assert stats["reads"] == len(reads)
+    assert stats["reads_passed"] == passing.sum()
+    counts = p.get_counts("bc")
+    assert np.all(counts["match"] == np.bincount(np.minimum(expected.match, len(barcodes)), minlength=len(barcodes) + 1))
+    assert np.all(counts["dist"].sum(axis=1)[:len(stats["barcodes"]["bc"]["dist_counts"])] == stats["barcodes"]["bc"]["dist_counts"])
+    output = gzip.open(tmpdir / "I1_out.gz", "rt").read().splitlines()
+    expected_names = [f"@read{i}_{m.labels[expected.match[i]]}" for i in np.nonzero(passing)[0]]
+    assert output[::4] == expected_names
+
+def test_pipeline_demux(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    write_inputs(tmpdir)
+    i7_matcher = matcha.ListMatcher(["GCCAATTC", "CTGTATTA"], ["i7_1", "i7_4"])
+
+    p = matcha.Pipeline()
+    p.add_sequence("R1", tmpdir / "R1", str(tmpdir / "{sample}_R1.fastq.gz"), create_empty_files=True)
+    p.add_sequence("I1", tmpdir / "I1")
+    p.add_barcode("sample", i7_matcher, "I1")
+    p.add_filter("sample.dist <= 1")
+    stats = p.run(chunk_size=2)
+
+    expected = i7_matcher.match_all(test_data["I1"].splitlines()[1::4])
+    r1_records = test_data["R1"].splitlines()
+    for label in ["i7_1", "i7_4", "unmatched"]:
+        output = gzip.open(tmpdir / f"{label}_R1.fastq.gz", "rt").read().splitlines()
+        reads = [i for i in range(stats["reads"]) if expected.dist[i] <= 1 and i7_matcher.labels[expected.match[i]] == label]
+        assert output == [line for i in reads for line in r1_records[4*i:4*i+4]]
+
+def test_invalid_filter():
+    p = matcha.Pipeline()
+    with pytest.raises(ValueError):
+        p.add_filter("bc.dist << 1")
+
+def test_cli(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    write_inputs(tmpdir)
+    (tmpdir / "i5.tsv").write_text("TCCGAGCC\ti5_1\nACAGGCGC\ti5_4\n")
+    config = f"""
+chunk_size: 2
+sequences:
+  I1: {{input: {tmpdir / "I1"}, output: {tmpdir / "I1_out"}}}
+  I2: {{input: {tmpdir / "I2"}}}
+barcodes:
+  cell_i5:
+    sequence: I2
+    matcher: list
+    whitelist: {tmpdir / "i5.tsv"}
+output_names: "{{cell_i5}}"
+filters:
+  - cell_i5.dist <= 1
+"""
+    (tmpdir / "config.yaml").write_text(config)
+    assert matcha.cli.main(["run", str(tmpdir / "config.yaml"), "--stats", str(tmpdir / "stats.json")]) == 0
+    
+    stats = json.loads((tmpdir / "stats.json").read_text())
+    assert stats["reads"] == 5
+    assert stats["reads_passed"] == 2
+    output = (tmpdir / "I1_out").read_text().splitlines()
+    assert output[::4] == ["@i5_1", "@i5_4"]
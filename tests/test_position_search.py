@@ -0,0 +1,111 @@
+import random
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import matcha
+
+from .utils import random_sequence, random_mismatches
+
+def make_reads(barcodes, count, max_offset, anchor=""):
+    """Reads with a random-length spacer, then the anchor (if any), then a barcode with errors"""
+    reads, offsets = [], []
+    for i in range(count):
+        spacer = random_sequence(random.randint(0, max_offset), "ACGT")
+        barcode = random_mismatches(random.choice(barcodes), random.choice([0, 0, 1, 2]))
+        reads.append(spacer + anchor + barcode + random_sequence(12, "ACGT"))
+        offsets.append(len(spacer))
+    return reads, np.array(offsets)
+
+def test_sliding_search():
+    random.seed("sliding")
+    barcodes = [random_sequence(10, "ACGT") for i in range(50)]
+    reads, _ = make_reads(barcodes, 1000, 5)
+    inner = matcha.ListMatcher(barcodes)
+    m = matcha.PositionSearchMatcher(inner, 5)
+    assert m.sequence_length == 15
+    res = m.match_all(reads, threads=2)
+
+    per_offset = [inner.match_all(reads, start=o) for o in range(6)]
+    dists = np.array([r.dist for r in per_offset])
+    offset = np.argmin(dists, axis=0)
+    assert np.all(res.offset == offset)
+    assert np.all(res.dist == dists.min(axis=0))
+    expected_match = np.array([per_offset[o].match[i] for i, o in enumerate(offset)])
+    assert np.all(res.match == expected_match)
+    # Second best covers other barcodes at any offset
+    other = np.array([
+        np.where(r.match == expected_match, r.second_best_dist, r.dist) for r in per_offset
+    ]).min(axis=0)
+    assert np.all(res.second_best_dist == other)
+    assert np.all(res.label == inner.labels[res.match])
+
+def test_anchor_search():
+    random.seed("anchor")
+    barcodes = [random_sequence(8, "ACGT") for i in range(30)]
+    anchor = "GTACTGAC"
+    reads, offsets = make_reads(barcodes, 1000, 6, anchor)
+    inner = matcha.HashMatcher(barcodes, 1, 2)
+    m = matcha.PositionSearchMatcher(inner, 6, anchor=anchor, barcode_offset=8, max_anchor_mismatches=1)
+    res = m.match_all(reads)
+
+    # Anchors are found at the spacer length (except where the spacer happens to contain a closer anchor)
+    found = res.match != 2**64 - 1
+    assert np.mean(res.offset[found] == offsets[found] + 8) > 0.95
+    expected = [inner.match_all([r], start=int(o)).match[0] for r, o in zip(reads, res.offset)]
+    assert np.all(res.match[found] == np.array(expected)[found])
+
+    # Reads without the anchor are unmatched
+    res = m.match_all([barcodes[0] * 3])
+    assert res.match[0] == 2**64 - 1 and res.dist[0] == 63
+
+    # Barcode before the anchor
+    before = matcha.PositionSearchMatcher(inner, 10, anchor=anchor, barcode_offset=-8)
+    res = before.match_all(["TT" + barcodes[3] + anchor + "TTTT", barcodes[4] + anchor + "TTTTTTT", anchor + "TTTTTTTT"])
+    assert res.match.tolist() == [3, 4, 2**64 - 1]
+    assert res.offset.tolist()[:2] == [2, 0]
+
+@pytest.mark.parametrize("use_pipeline", [False, True])
+def test_position_search_fastq(tmpdir, use_pipeline):
+    tmpdir = Path(str(tmpdir))
+    random.seed("position fastq")
+    barcodes = [random_sequence(10, "ACGT") for i in range(20)]
+    labels = [f"bc{i}" for i in range(20)]
+    reads, _ = make_reads(barcodes, 300, 4)
+    with open(tmpdir / "R1", "w") as f:
+        for i, read in enumerate(reads):
+            f.write(f"@read{i}\nNN{read}\n+\n{'F' * (len(read) + 2)}\n")
+
+    m = matcha.PositionSearchMatcher(matcha.ListMatcher(barcodes, labels), 4)
+    expected = m.match_all(reads)
+
+    f = matcha.Pipeline() if use_pipeline else matcha.FastqReader()
+    f.add_sequence("R1", tmpdir / "R1", tmpdir / "R1_out")
+    f.add_barcode("cell", m, "R1", match_start=2)
+    f.add_filter("cell.dist <= 1")
+    f.set_output_names("{cell}:{read_name}")
+    if use_pipeline:
+        f.run(chunk_size=64)
+    else:
+        while f.read_chunk(64):
+            f.write_chunk()
+        f.close()
+
+    names = [l[1:].split(":")[0] for l in (tmpdir / "R1_out").read_text().splitlines()[::4]]
+    assert names == [labels[i] for i in expected.match[expected.dist <= 1]]
+
+def test_position_search_invalid():
+    inner = matcha.ListMatcher(["ACGT"])
+    with pytest.raises(ValueError):
+        matcha.PositionSearchMatcher(inner, 2**16)
+    with pytest.raises(ValueError):
+        matcha.PositionSearchMatcher(inner, 2, anchor="ACNT")
+    # Matchers that don't match encoded blocks, and whose qual bits would overlap the offset, can't be wrapped
+    combinatorial = matcha.CombinatorialMatcher([(inner, 0), (inner, 4)])
+    with pytest.raises(ValueError):
+        matcha.PositionSearchMatcher(combinatorial, 2)
+    with pytest.raises(ValueError):
+        matcha.PositionSearchMatcher(matcha.PositionSearchMatcher(inner, 2), 2)
+    with pytest.raises(ValueError):
+        matcha.CombinatorialMatcher([(combinatorial, 0)])
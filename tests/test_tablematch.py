@@ -0,0 +1,45 @@
+import random
+
+import pytest
+import numpy as np
+
+import matcha
+import _matcha
+
+from .utils import random_sequence, random_mismatches
+
+def test_basic_matching():
+    barcode_sequences = ["ATGC", "TGAC", "ACAA", "CGAT"]
+    query_sequences   = ["ATGC", "TCAC", "ACAA", "CAAG"]
+    dists             = [0, 1, 0, 2]
+    labels = ["one", "two", "three", "four"]    
+
+    m = matcha.TableMatcher(barcode_sequences, labels)
+    results = m.match_all(query_sequences, 0)
+
+    assert list(m.labels[results.match]) == labels
+    assert list(results.dist) == dists
+
+@pytest.mark.parametrize("barcode_count", [1, 2, 30])
+def test_matches_list_matcher(barcode_count):
+    random.seed(f"table{barcode_count}")
+    sequence_len = 7
+    barcode_sequences = [random_sequence(sequence_len, "ATGC") for i in range(barcode_count)]
+    # Duplicates and near-duplicates exercise tie breaking between equally good matches
+    barcode_sequences += barcode_sequences[:2] + [random_mismatches(b, 1) for b in barcode_sequences[:3]]
+
+    # Every possible query, plus some with N's to use the fallback path
+    all_queries = [_matcha.binaryToString(i, sequence_len, 0) for i in range(4**sequence_len)]
+    n_queries = [random_sequence(sequence_len, "ATGCN") for i in range(500)]
+    queries = all_queries + n_queries
+
+    expected = matcha.ListMatcher(barcode_sequences).match_all(queries)
+    r = matcha.TableMatcher(barcode_sequences, threads=3).match_all(queries, threads=2)
+    assert np.all(r.match == expected.match)
+    assert np.all(r.dist == expected.dist)
+    assert np.all(r.second_best_dist == expected.second_best_dist)
+
+def test_max_table_size():
+    matcha.TableMatcher(["ACGTA", "TTTTT"], max_table_size=4**5)
+    with pytest.raises(RuntimeError, match="max_table_size"):
+        matcha.TableMatcher(["ACGTAC", "TTTTTT"], max_table_size=4**5)
@@ -0,0 +1,103 @@
+import collections
+import random
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import _matcha
+import matcha
+
+from .utils import hamming_dist, random_sequence, random_mismatches
+
+def write_reads(tmpdir, cells, features):
+    """Write R1 (cell barcode + 6bp UMI) and R2 (feature barcode) fastqs, with PCR duplicates and UMI errors.
+    Returns the list of (cell, umi, feature) sequences written"""
+    random.seed("umi")
+    molecules = [(random.choice(cells), random_sequence(6, "ACGT"), random.choice(features)) for i in range(400)]
+    reads = []
+    for cell, umi, feature in molecules:
+        reads += [(cell, umi, feature)] * random.randint(1, 6)
+        if random.random() < 0.3:
+            reads.append((cell, random_mismatches(umi, 1, "ACGT"), feature))
+    # Reads that shouldn't count: UMI with N, and unmatched feature
+    reads.append((cells[0], "ACGTNA", features[0]))
+    reads.append((cells[0], "ACGTAA", "NNNNNNNN"))
+    random.shuffle(reads)
+    with open(tmpdir / "R1", "w") as r1, open(tmpdir / "R2", "w") as r2:
+        for i, (cell, umi, feature) in enumerate(reads):
+            r1.write(f"@read{i}\n{cell}{umi}\n+\n{'F' * 16}\n")
+            r2.write(f"@read{i}\n{feature}\n+\n{'F' * 8}\n")
+    return reads
+
+def expected_counts(reads, cells, features, collapse):
+    """Reference molecule counts per (cell index, feature index), using the directional collapse rule"""
+    umi_reads = collections.defaultdict(collections.Counter)
+    for cell, umi, feature in reads:
+        if "N" in umi or feature not in features:
+            continue
+        umi_reads[(cells.index(cell), features.index(feature))][umi] += 1
+    
+    ret = {}
+    for key, counts in umi_reads.items():
+        order = sorted(counts, key=lambda u: (-counts[u], u))
+        molecules = 0
+        for r, u in enumerate(order):
+            duplicate = collapse and any(
+                hamming_dist(u, v) == 1 and counts[v] >= 2 * counts[u] - 1 for v in order[:r]
+            )
+            molecules += not duplicate
+        ret[key] = (molecules, sum(counts.values()))
+    return ret
+
+@pytest.mark.parametrize("use_pipeline", [False, True])
+def test_umi_counts(tmpdir, use_pipeline):
+    tmpdir = Path(str(tmpdir))
+    cells = [random_sequence(10, "ACGT") for i in range(20)]
+    features = [random_sequence(8, "ACGT") for i in range(4)]
+    reads = write_reads(tmpdir, cells, features)
+
+    f = matcha.Pipeline() if use_pipeline else matcha.FastqReader()
+    f.add_sequence("R1", tmpdir / "R1")
+    f.add_sequence("R2", tmpdir / "R2")
+    f.add_barcode("cell", matcha.ListMatcher(cells), "R1")
+    f.add_barcode("feature", matcha.HashMatcher(features, 1, 2), "R2")
+    f.add_umi_counts("cell", "feature", "R1", 10, 6)
+    if use_pipeline:
+        f.run(chunk_size=100)
+    else:
+        while f.read_chunk(100):
+            pass
+        f.close()
+
+    for collapse in [False, True]:
+        expected = expected_counts(reads, cells, features, collapse)
+        coo = f.get_umi_counts("cell", "feature", collapse=collapse)
+        keys = list(zip(coo["cell"].tolist(), coo["feature"].tolist()))
+        assert keys == sorted(expected)
+        assert coo["umis"].tolist() == [expected[k][0] for k in keys]
+        assert coo["reads"].tolist() == [expected[k][1] for k in keys]
+    
+    csr = f.get_umi_counts("cell", "feature", format="csr")
+    assert csr["shape"] == (len(cells), len(features))
+    assert csr["indptr"][-1] == len(coo["cell"])
+    rows = np.repeat(np.arange(len(cells)), np.diff(csr["indptr"]).astype(np.int64))
+    assert np.all(rows == coo["cell"])
+    assert np.all(csr["indices"] == coo["feature"])
+    assert csr["data"].sum() == sum(v[0] for v in expected_counts(reads, cells, features, False).values())
+
+def test_umi_key_too_large():
+    cells = matcha.ListMatcher(["ACGT"])
+    with pytest.raises(ValueError):
+        _matcha.UmiCounter(cells._matcher, cells._matcher, 0, 33)
+
+def test_umi_counts_empty_chunk(tmpdir):
+    path = Path(str(tmpdir)) / "R1"
+    path.write_text("")
+    umi_file = _matcha.FastqFile(str(path), [""], [], "", 1, 0, 0, 1)
+    assert umi_file.read_chunk(10) == 0
+    cells = matcha.ListMatcher(["ACGT"])
+    counter = _matcha.UmiCounter(cells._matcher, cells._matcher, 0, 4)
+    empty = np.zeros((2, 0), dtype=np.uint64)
+    counter.add_chunk(empty, empty, umi_file)
+    assert counter.stats()["reads"] == 0
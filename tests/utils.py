@@ -1,4 +1,6 @@
 import random
+import struct
+import zlib
 
 def hamming_dist(a, b):
     return sum(c1 != c2 for c1, c2 in zip(a,b))
@@ -25,4 +27,16 @@ def results_equal(reference, r, max_mismatches, sequence_len):
         return False
     if not all((r.second_best_dist == reference.second_best_dist) | ((r.second_best_dist == (2**6-1)) & ~within_second_best)):
         return False
-    return True
\ No newline at end of file
+    return True
+
+def bgzf_compress(data, block_size=65280):
+    """Compress bytes in BGZF format (as written by bgzip), including the EOF marker block"""
+    out = bytearray()
+    blocks = [data[i:i+block_size] for i in range(0, len(data), block_size)] + [b""]
+    for block in blocks:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        deflated = compressor.compress(block) + compressor.flush()
+        out += struct.pack("<BBBBIBBHBBHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(deflated) + 25)
+        out += deflated
+        out += struct.pack("<II", zlib.crc32(block), len(block))
+    return bytes(out)